@@ -0,0 +1,89 @@
+"""Micro-benchmark for rendering build changelogs.
+
+Compares the original per-commit renderer (re.findall, one str.replace per PR
+number and += concatenation) with render_changelog, cold and with a warm line
+cache, on changelogs of 1,000 or more commits.
+
+Usage:
+    python benchmarks/bench_changelog.py [--commits 5000] [--repeat 5]
+"""
+
+import argparse
+import os
+import random
+import re
+import sys
+import timeit
+import urllib.parse
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+os.environ.setdefault("WEBHOOK_URL", '["http://example.com"]')
+
+from paper_poller import convert_commit_hash_to_short, render_changelog, render_commit_line
+
+
+def legacy_changelog(project, commits) -> str:
+    """The renderer get_changes_for_build used before the changelog engine"""
+    return_string = ""
+    for change in commits:
+        commit_hash = convert_commit_hash_to_short(change["sha"])
+        full_hash = change["sha"]
+        summary = change["message"].strip().split("\n")[0]
+        pr_numbers = set(re.findall(r"#(\d+)", summary))
+        for pr_number in pr_numbers:
+            summary = summary.replace(
+                f"#{pr_number}",
+                f"[#{pr_number}](https://github.com/PaperMC/{project}/issues/{pr_number})",
+            )
+        github_url = urllib.parse.quote(
+            f"https://github.com/PaperMC/{project}/commit/{full_hash}"
+        )
+        return_string += f"- [{commit_hash}](https://diffs.dev/?github_url={github_url}) {summary}\n"
+    return return_string
+
+
+def make_commits(count, seed=0):
+    rng = random.Random(seed)
+    commits = []
+    for _ in range(count):
+        references = " ".join(f"#{rng.randint(1, 12000)}" for _ in range(rng.randint(0, 4)))
+        commits.append(
+            {
+                "sha": "%040x" % rng.getrandbits(160),
+                "message": f"Fix chunk loading regression {references}\n\nLonger description",
+            }
+        )
+    return commits
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--commits", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    commits = make_commits(args.commits)
+
+    def cold():
+        render_commit_line.cache_clear()
+        render_changelog("paper", commits)
+
+    def warm():
+        render_changelog("paper", commits)
+
+    timings = {
+        "legacy": lambda: legacy_changelog("paper", commits),
+        "engine (cold cache)": cold,
+        "engine (warm cache)": warm,
+    }
+    warm()
+    print(f"Changelog of {args.commits} commits, best of {args.repeat}:")
+    baseline = None
+    for name, run in timings.items():
+        best = min(timeit.repeat(run, number=1, repeat=args.repeat))
+        baseline = baseline or best
+        print(f"  {name:<20} {best * 1000:8.2f} ms  ({baseline / best:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
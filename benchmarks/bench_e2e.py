@@ -0,0 +1,153 @@
+"""End-to-end benchmark: full poll cycles against local fake upstreams.
+
+Runs main() in a fresh interpreter against a stand-in for the PaperMC GraphQL
+API and a Discord webhook sink, both on localhost. Each mode runs two cycles in
+the same working directory:
+
+    cold    empty state, the schema is introspected and every build is announced
+    update  every project released --new-builds builds since the cold cycle
+
+Reported per cycle: wall time of main(), GraphQL and webhook request counts,
+bytes sent and received by the poller, and the peak RSS of the process.
+
+Results can be saved with --save and compared against a saved run with
+--compare. The comparison fails (exit code 1) when wall time, requests or bytes
+of any cycle grew by more than --tolerance.
+
+Usage:
+    python benchmarks/bench_e2e.py [--versions 10] [--builds 5] [--commits 20]
+        [--webhooks 3] [--latency-ms 20] [--new-builds 2] [--async]
+        [--save results.json] [--compare results.json --tolerance 0.2]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+
+from tests.fake_upstreams import FakeDiscordServer, FakeFillServer
+
+CYCLE = f"""
+import json, resource, sys, time
+sys.path.insert(0, {ROOT!r})
+start = time.perf_counter()
+import paper_poller
+paper_poller.main()
+elapsed = time.perf_counter() - start
+peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({{"elapsed": elapsed, "peak_kb": peak_kb}}))
+"""
+
+MODES = {"single-version": "false", "multi-version": "true"}
+COMPARED = ("elapsed", "graphql_requests", "webhook_requests", "bytes_sent", "bytes_received")
+
+
+def traffic(graphql, discord):
+    return {
+        "graphql_requests": len(graphql.requests),
+        "webhook_requests": len(discord.requests),
+        "bytes_sent": graphql.bytes_received + discord.bytes_received,
+        "bytes_received": graphql.bytes_sent + discord.bytes_sent,
+    }
+
+
+def run_cycle(workdir, env, graphql, discord):
+    before = traffic(graphql, discord)
+    output = subprocess.run(
+        [sys.executable, "-c", CYCLE],
+        capture_output=True,
+        text=True,
+        check=True,
+        cwd=workdir,
+        env=env,
+    ).stdout
+    # The last line is the cycle's report, anything before it is the poller's log
+    result = json.loads(output.strip().splitlines()[-1])
+    after = traffic(graphql, discord)
+    result.update({key: after[key] - before[key] for key in after})
+    return result
+
+
+def run_mode(check_all_versions, args):
+    latency = args.latency_ms / 1000
+    graphql = FakeFillServer(args.versions, args.builds, args.commits, latency=latency)
+    discord = FakeDiscordServer(latency=latency)
+    with graphql, discord, tempfile.TemporaryDirectory() as workdir:
+        env = dict(
+            os.environ,
+            WEBHOOK_URL=json.dumps(discord.webhook_urls(args.webhooks)),
+            PAPER_POLLER_GRAPHQL_URL=graphql.url,
+            PAPER_POLLER_CHECK_ALL_VERSIONS=check_all_versions,
+            PAPER_POLLER_ASYNC=str(args.use_async).lower(),
+            PAPER_POLLER_DRY_RUN="false",
+        )
+        cold = run_cycle(workdir, env, graphql, discord)
+        graphql.release(args.new_builds)
+        update = run_cycle(workdir, env, graphql, discord)
+    return {"cold": cold, "update": update}
+
+
+def print_results(results):
+    print(f"{'cycle':<22} {'wall ms':>9} {'gql req':>8} {'hook req':>9} {'sent KiB':>9} {'recv KiB':>9} {'peak MiB':>9}")
+    for mode, cycles in results.items():
+        for cycle, r in cycles.items():
+            print(
+                f"{mode + ' ' + cycle:<22} {r['elapsed'] * 1000:9.1f} {r['graphql_requests']:8d} "
+                f"{r['webhook_requests']:9d} {r['bytes_sent'] / 1024:9.1f} "
+                f"{r['bytes_received'] / 1024:9.1f} {r['peak_kb'] / 1024:9.1f}"
+            )
+
+
+def regressions(results, baseline, tolerance):
+    found = []
+    for mode, cycles in results.items():
+        for cycle, r in cycles.items():
+            before = baseline.get(mode, {}).get(cycle)
+            if not before:
+                continue
+            for key in COMPARED:
+                if r[key] > before[key] * (1 + tolerance):
+                    found.append(f"{mode} {cycle}: {key} {before[key]:g} -> {r[key]:g}")
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--versions", type=int, default=10)
+    parser.add_argument("--builds", type=int, default=5)
+    parser.add_argument("--commits", type=int, default=20)
+    parser.add_argument("--webhooks", type=int, default=3)
+    parser.add_argument("--latency-ms", type=float, default=20.0)
+    parser.add_argument("--new-builds", type=int, default=2)
+    parser.add_argument("--async", dest="use_async", action="store_true")
+    parser.add_argument("--mode", choices=sorted(MODES), action="append")
+    parser.add_argument("--save")
+    parser.add_argument("--compare")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    results = {mode: run_mode(MODES[mode], args) for mode in args.mode or MODES}
+    print(
+        f"{args.versions} versions x {args.builds} builds x {args.commits} commits per project, "
+        f"{args.webhooks} webhooks, {args.latency_ms:g} ms upstream latency:"
+    )
+    print_results(results)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare, "r") as f:
+            found = regressions(results, json.load(f), args.tolerance)
+        for line in found:
+            print(f"  regression: {line}")
+        sys.exit(1 if found else 0)
+
+
+if __name__ == "__main__":
+    main()
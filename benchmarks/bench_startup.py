@@ -0,0 +1,109 @@
+"""Startup benchmark: how long importing paper_poller and starting the poller take.
+
+Every sample is a fresh interpreter, so the numbers include module lookup and
+bytecode loading but nothing that a previous import left behind. The bare
+interpreter startup is measured the same way and subtracted.
+
+Besides the import, it times the start of `python paper_poller.py`, the command
+cron runs, up to the call of main(). `python paper-poller.py` is shown for
+comparison: a script is compiled on every start and never cached.
+
+Importing must not pull in the GraphQL or HTTP stacks. The benchmark fails
+(exit code 1) when any of them is loaded, or when the median overhead of the
+import or of the cron command is above the target.
+
+Usage:
+    python benchmarks/bench_startup.py [--runs 20] [--target-ms 50]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+# Modules that must only be imported once they are used
+HEAVY_MODULES = (
+    "aiohttp",
+    "asyncio",
+    "backoff",
+    "dotenv",
+    "filelock",
+    "gql",
+    "graphql",
+    "requests",
+    "sqlite3",
+    "websockets",
+)
+
+PROBE = f"""
+import json, sys, time
+sys.path.insert(0, {ROOT!r})
+start = time.perf_counter()
+{{statement}}
+elapsed = time.perf_counter() - start
+heavy = sorted(m for m in {HEAVY_MODULES!r} if m in sys.modules)
+print(json.dumps({{{{"elapsed": elapsed, "heavy": heavy}}}}))
+"""
+
+
+def run_script(name):
+    """Run a script like `python <name>` does, but stop before it calls main()"""
+    path = os.path.join(ROOT, name)
+    return f"import runpy; runpy.run_path({path!r}, run_name='startup')"
+
+
+def sample(statement):
+    env = dict(os.environ, WEBHOOK_URL='["http://example.com"]')
+    # Load the module from its bytecode cache like an installed poller does, instead
+    # of compiling the whole script again in every sample
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    output = subprocess.run(
+        [sys.executable, "-c", PROBE.format(statement=statement)],
+        capture_output=True,
+        text=True,
+        check=True,
+        env=env,
+    ).stdout
+    # The last line is the probe's report, anything before it was printed on import
+    lines = output.strip().splitlines()
+    return json.loads(lines[-1]), lines[:-1]
+
+
+def median_elapsed(statement, runs):
+    return statistics.median(sample(statement)[0]["elapsed"] for _ in range(runs))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--target-ms", type=float, default=50.0)
+    args = parser.parse_args()
+
+    # Warm the bytecode cache and the OS file cache first
+    sample("import paper_poller")
+
+    baseline = median_elapsed("pass", args.runs)
+    imports = [sample("import paper_poller") for _ in range(args.runs)]
+    overhead = statistics.median(r["elapsed"] for r, _ in imports) - baseline
+    heavy = sorted({module for r, _ in imports for module in r["heavy"]})
+    printed = imports[0][1]
+    cron = median_elapsed(run_script("paper_poller.py"), args.runs) - baseline
+    script = median_elapsed(run_script("paper-poller.py"), args.runs) - baseline
+
+    print(f"median of {args.runs} fresh interpreters, target {args.target_ms:g} ms:")
+    print(f"  import paper_poller      {overhead * 1000:8.2f} ms")
+    print(f"  python paper_poller.py   {cron * 1000:8.2f} ms")
+    print(f"  python paper-poller.py   {script * 1000:8.2f} ms (compiled on every start)")
+    print(f"  heavy modules {', '.join(heavy) or 'none'}")
+    print(f"  output        {'; '.join(printed) or 'none'}")
+
+    failed = max(overhead, cron) * 1000 > args.target_ms or heavy or printed
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
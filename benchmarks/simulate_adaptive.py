@@ -0,0 +1,239 @@
+"""Offline simulator: fixed-interval polling against adaptive polling.
+
+Replays a build history and polls it the way the poller would, once on a fixed
+interval and once with the adaptive scheduler (AdaptiveCadence), then reports
+for every project how many polls each strategy made and how long builds waited
+between being published and being announced.
+
+A poll only sees the latest build of each version, like a real poll cycle. A
+build is announced by the first poll after its time, so its notification
+latency is the time between the two. The adaptive scheduler starts out knowing
+the builds of the --warmup days before the replayed ones, like a poller that has
+been running for a while.
+
+The history is a JSON file mapping projects to versions to build times (ISO 8601,
+as in the `time` field of the fill API). It can be recorded from the API with
+--record, otherwise a synthetic history is generated with bursts of builds
+in working hours and quiet nights and weekends.
+
+Usage:
+    python benchmarks/simulate_adaptive.py [--history history.json]
+        [--fixed 300] [--min 60] [--max 3600] [--days 30] [--warmup 14] [--seed 1]
+    python benchmarks/simulate_adaptive.py --record history.json
+        [--graphql-url https://fill.papermc.io/graphql]
+"""
+
+import argparse
+import bisect
+import json
+import os
+import random
+import sys
+from datetime import datetime, timedelta, timezone
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+
+import paper_poller
+
+HISTORY_QUERY = """
+query history($project: String!) {
+    project(id: $project) {
+        versions {
+            id
+            builds {
+                time
+            }
+        }
+    }
+}
+"""
+
+
+def record_history(url, projects):
+    import requests
+
+    history = {}
+    for project in projects:
+        response = requests.post(
+            url,
+            json={"query": HISTORY_QUERY, "variables": {"project": project}},
+            timeout=60,
+        )
+        response.raise_for_status()
+        versions = response.json()["data"]["project"]["versions"]
+        history[project] = {
+            version["id"]: [build["time"] for build in version["builds"]] for version in versions
+        }
+    return history
+
+
+def synthetic_history(days, seed):
+    """Builds in bursts during working hours (UTC), rarely at night or on weekends"""
+    rng = random.Random(seed)
+    start = datetime(2025, 1, 6, tzinfo=timezone.utc)
+    # Mean builds per working day of every version of a project
+    rates = {
+        "paper": {"1.21.4": 6.0, "1.21.3": 0.3},
+        "folia": {"1.21.4": 1.5},
+        "velocity": {"3.4.0-SNAPSHOT": 1.0},
+        "waterfall": {"1.21": 0.1},
+    }
+    history = {}
+    for project, versions in rates.items():
+        history[project] = {}
+        for version, rate in versions.items():
+            times = []
+            for day in range(days):
+                date = start + timedelta(days=day)
+                weight = 0.15 if date.weekday() >= 5 else 1.0
+                for _ in range(_poisson(rng, rate * weight)):
+                    hour = rng.gauss(15, 3) if rng.random() < 0.9 else rng.uniform(0, 24)
+                    moment = date + timedelta(hours=min(max(hour, 0), 23.99))
+                    # Builds come in bursts, a few merges pushed minutes apart
+                    for _ in range(1 + (rng.random() < 0.3) * rng.randint(1, 3)):
+                        times.append(moment)
+                        moment += timedelta(minutes=rng.uniform(2, 20))
+            history[project][version] = [
+                t.strftime("%Y-%m-%dT%H:%M:%S.000Z") for t in sorted(times)
+            ]
+    return history
+
+
+def _poisson(rng, mean):
+    count, threshold, product = 0, pow(2.718281828459045, -mean), rng.random()
+    while product > threshold:
+        count += 1
+        product *= rng.random()
+    return count
+
+
+def parse_history(history):
+    return {
+        project: {
+            version: sorted(paper_poller.convert_build_date(t).timestamp() for t in times)
+            for version, times in versions.items()
+            if times
+        }
+        for project, versions in history.items()
+    }
+
+
+def latencies(builds, polls):
+    """Seconds from each build to the first poll at or after it"""
+    waits = []
+    for times in builds.values():
+        for build in times:
+            index = bisect.bisect_left(polls, build)
+            if index < len(polls):
+                waits.append(polls[index] - build)
+    return waits
+
+
+def simulate_fixed(builds, start, end, interval):
+    polls = []
+    moment = start
+    while moment <= end:
+        polls.append(moment)
+        moment += interval
+    return polls
+
+
+def simulate_adaptive(builds, start, end, cadence, max_interval=None):
+    polls = []
+    learned = {
+        version: [t for t in times if t < start][-cadence.history_size:]
+        for version, times in builds.items()
+    }
+    quiet_polls = 0
+    moment = start
+    while moment <= end:
+        polls.append(moment)
+        observed = {}
+        for version, times in builds.items():
+            index = bisect.bisect_right(times, moment)
+            if index:
+                observed[version] = datetime.fromtimestamp(times[index - 1], timezone.utc).strftime(
+                    "%Y-%m-%dT%H:%M:%S.%fZ"
+                )
+        quiet_polls = 0 if cadence.record(learned, observed) else quiet_polls + 1
+        moment += cadence.next_interval(learned, quiet_polls, moment, max_interval=max_interval)
+    return polls
+
+
+def summarize(polls, waits):
+    waits = sorted(waits)
+    return {
+        "polls": len(polls),
+        "mean_latency": sum(waits) / len(waits) if waits else 0.0,
+        "p95_latency": waits[int(len(waits) * 0.95)] if waits else 0.0,
+        "builds": len(waits),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--history")
+    parser.add_argument("--record")
+    parser.add_argument("--graphql-url", default=paper_poller.gql_base)
+    parser.add_argument("--projects", default="paper,folia,velocity,waterfall")
+    parser.add_argument("--fixed", type=float, default=300.0)
+    parser.add_argument("--min", type=float, default=paper_poller.ADAPTIVE_MIN_INTERVAL)
+    parser.add_argument("--max", type=float, default=paper_poller.ADAPTIVE_MAX_INTERVAL)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--warmup", type=int, default=14)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    if args.record:
+        history = record_history(args.graphql_url, args.projects.split(","))
+        with open(args.record, "w") as f:
+            json.dump(history, f, indent=2)
+        print(f"Recorded the build history of {len(history)} projects to {args.record}")
+        return
+
+    if args.history:
+        with open(args.history, "r") as f:
+            history = json.load(f)
+    else:
+        history = synthetic_history(args.warmup + args.days, args.seed)
+    builds = parse_history(history)
+
+    # Replay the last --days days of the history
+    end = max(t[-1] for versions in builds.values() for t in versions.values())
+    start = end - args.days * 86400
+    cadence = paper_poller.AdaptiveCadence(args.min, args.max)
+
+    print(
+        f"{args.days} days, fixed every {args.fixed:g} s against adaptive "
+        f"between {args.min:g} and {args.max:g} s:"
+    )
+    print(
+        f"{'project':<12} {'builds':>6} {'polls':>7} {'adaptive':>8} {'saved':>6} "
+        f"{'mean s':>7} {'adaptive':>8} {'p95 s':>7} {'adaptive':>8}"
+    )
+    totals = {"fixed": 0, "adaptive": 0}
+    for project, versions in builds.items():
+        window = {
+            version: [t for t in times if start <= t <= end] for version, times in versions.items()
+        }
+        fixed_polls = simulate_fixed(window, start, end + args.fixed, args.fixed)
+        adaptive_polls = simulate_adaptive(versions, start, end + args.max, cadence)
+        fixed = summarize(fixed_polls, latencies(window, fixed_polls))
+        adaptive = summarize(adaptive_polls, latencies(window, adaptive_polls))
+        totals["fixed"] += fixed["polls"]
+        totals["adaptive"] += adaptive["polls"]
+        saved = 1 - adaptive["polls"] / fixed["polls"]
+        print(
+            f"{project:<12} {fixed['builds']:6d} {fixed['polls']:7d} {adaptive['polls']:8d} "
+            f"{saved:6.0%} {fixed['mean_latency']:7.0f} {adaptive['mean_latency']:8.0f} "
+            f"{fixed['p95_latency']:7.0f} {adaptive['p95_latency']:8.0f}"
+        )
+    print(
+        f"{'total':<12} {'':6} {totals['fixed']:7d} {totals['adaptive']:8d} "
+        f"{1 - totals['adaptive'] / totals['fixed']:6.0%}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,29 +1,47 @@
+import hashlib
 import json
 import os
+import random
 import re
+import signal
 import sys
+import threading
 import time
 import urllib.parse
+from collections import Counter, OrderedDict
+from contextlib import asynccontextmanager, contextmanager
 from datetime import datetime as dt
+from datetime import timedelta, timezone
 from enum import Enum
+from functools import lru_cache, wraps
+from typing import NamedTuple, Optional
 
-import requests
-from dotenv import load_dotenv
-from filelock import FileLock, Timeout
-from gql import Client, gql
-from gql.transport.requests import RequestsHTTPTransport
+# Importing this module has no side effects: requests, gql and the webhook
+# configuration are loaded on first use, see lazy() at the end of the module.
+# .env is read by main(), see load_env_file()
+
+# Environment variables of the settings below, mapped to the global they set and how
+# to parse them, so load_env_file() can read them again
+_settings = {}
+
+
+def setting(name, variable, default, parse=str):
+    """Read the setting name from the environment variable, or its default"""
+    _settings[variable] = (name, parse)
+    return parse(os.getenv(variable, default))
+
+
+def flag(value) -> bool:
+    return value.lower() == "true"
 
-load_dotenv()
 
 # Configuration: Check all versions or just the latest
 # Set PAPER_POLLER_CHECK_ALL_VERSIONS=true to enable multi-version checking
-CHECK_ALL_VERSIONS = (
-    os.getenv("PAPER_POLLER_CHECK_ALL_VERSIONS", "false").lower() == "true"
-)
+CHECK_ALL_VERSIONS = setting("CHECK_ALL_VERSIONS", "PAPER_POLLER_CHECK_ALL_VERSIONS", "false", flag)
 
 # Configuration: Dry run mode - process updates but don't send webhooks
 # Set PAPER_POLLER_DRY_RUN=true to enable dry run mode
-DRY_RUN = os.getenv("PAPER_POLLER_DRY_RUN", "false").lower() == "true"
+DRY_RUN = setting("DRY_RUN", "PAPER_POLLER_DRY_RUN", "false", flag)
 
 
 class Color(Enum):
@@ -51,37 +69,525 @@ headers = {
     "Pragma": "no-cache",
 }
 
-# Check the ENV for a webhook URL
-if os.getenv("WEBHOOK_URL"):
-    print(f"Using webhook URL from ENV: {os.getenv('WEBHOOK_URL')}")
-    webhook_urls = json.loads(os.getenv("WEBHOOK_URL"))
-elif os.path.exists("webhooks.json"):
-    print("Using webhook URL from webhooks.json")
-    with open("webhooks.json", "r") as f:
-        webhook_urls = json.load(f)["urls"]
-else:
-    print("No webhook URL found, using default")
-    webhook_urls = ["https://httpbin.org/post"]
-
 # Get start args
 start_args = sys.argv[1:]
-# If it includes --stdin, we'll read from stdin
 
-# Check if there's anything coming in through STDIN
-if "--stdin" in start_args:
-    # If there is, read it as a json object
-    data = json.loads(sys.stdin.read())
-    # Grab the urls element from the json object
-    webhook_urls = data["urls"]
+
+def load_webhook_urls():
+    """Read the webhook URLs from stdin, the WEBHOOK_URL env or webhooks.json"""
+    # If the args include --stdin, the config comes in through STDIN
+    if "--stdin" in start_args:
+        # Read it as a json object and grab its urls element
+        data = json.loads(sys.stdin.read())
+        return data["urls"]
+
+    # Check the ENV for a webhook URL
+    if os.getenv("WEBHOOK_URL"):
+        print(f"Using webhook URL from ENV: {os.getenv('WEBHOOK_URL')}")
+        return json.loads(os.getenv("WEBHOOK_URL"))
+    if os.path.exists("webhooks.json"):
+        print("Using webhook URL from webhooks.json")
+        with open("webhooks.json", "r") as f:
+            return json.load(f)["urls"]
+    print("No webhook URL found, using default")
+    return ["https://httpbin.org/post"]
+
+
+# Configuration: Poll all projects concurrently with the asyncio engine
+# Set PAPER_POLLER_ASYNC=true or pass --async to enable it
+USE_ASYNC = setting(
+    "USE_ASYNC", "PAPER_POLLER_ASYNC", "false", lambda value: flag(value) or "--async" in start_args
+)
+
+# Configuration: Fetch all projects in a single aliased GraphQL request
+# Set PAPER_POLLER_BATCH_QUERIES=false to send one request per project instead
+BATCH_QUERIES = setting("BATCH_QUERIES", "PAPER_POLLER_BATCH_QUERIES", "true", flag)
+
+# Configuration: Two-phase polling - probe build ids first, then fetch commits and
+# downloads only for the versions that changed
+# Set PAPER_POLLER_TWO_PHASE=false to fetch the full build details on every poll
+TWO_PHASE_POLL = setting("TWO_PHASE_POLL", "PAPER_POLLER_TWO_PHASE", "true", flag)
+
+# Configuration: Skip the whole run of a project when its upstream response did not change
+# Set PAPER_POLLER_FINGERPRINT=false to always process the full response
+FINGERPRINT_RESPONSES = setting("FINGERPRINT_RESPONSES", "PAPER_POLLER_FINGERPRINT", "true", flag)
+
+# Configuration: Catch up on builds missed between polls
+# Up to PAPER_POLLER_CATCH_UP builds are merged into one message, 0 only announces the latest
+CATCH_UP_MAX_BUILDS = setting("CATCH_UP_MAX_BUILDS", "PAPER_POLLER_CATCH_UP", "25", int)
+
+# Configuration: Send every changed version of a project in one message per run
+# Set PAPER_POLLER_COALESCE=true, messages are split where Discord's limits require it
+COALESCE_UPDATES = setting("COALESCE_UPDATES", "PAPER_POLLER_COALESCE", "false", flag)
+
+# Configuration: Cache the GraphQL schema on disk instead of introspecting every run
+# PAPER_POLLER_SCHEMA_TTL is in seconds, pass --refresh-schema to force a download
+SCHEMA_CACHE_FILE = setting("SCHEMA_CACHE_FILE", "PAPER_POLLER_SCHEMA_CACHE", "graphql_schema.json")
+SCHEMA_CACHE_TTL = setting("SCHEMA_CACHE_TTL", "PAPER_POLLER_SCHEMA_TTL", "86400", int)
+REFRESH_SCHEMA = "--refresh-schema" in start_args
+
+# Configuration: Automatic persisted queries - send the SHA-256 hash of a query instead
+# of its text, the text is only sent when the server does not know the hash yet.
+# Which servers support it is kept in PAPER_POLLER_APQ_CACHE, servers that do not are
+# tried again after PAPER_POLLER_APQ_RETRY seconds.
+# Set PAPER_POLLER_PERSISTED_QUERIES=false to always send the full query text
+PERSISTED_QUERIES = setting("PERSISTED_QUERIES", "PAPER_POLLER_PERSISTED_QUERIES", "true", flag)
+APQ_CACHE_FILE = setting("APQ_CACHE_FILE", "PAPER_POLLER_APQ_CACHE", "graphql_apq.json")
+APQ_RETRY_AFTER = setting("APQ_RETRY_AFTER", "PAPER_POLLER_APQ_RETRY", "86400", float)
+
+# Configuration: Which projects are polled, how often and in which order
+# Read from the PAPER_POLLER_PROJECTS env (JSON) or PAPER_POLLER_PROJECTS_FILE, see the
+# README. When each project was last polled is kept in PAPER_POLLER_SCHEDULE_FILE.
+PROJECTS_FILE = setting("PROJECTS_FILE", "PAPER_POLLER_PROJECTS_FILE", "projects.json")
+SCHEDULE_FILE = setting("SCHEDULE_FILE", "PAPER_POLLER_SCHEDULE_FILE", "poll_schedule.json")
+
+# Configuration: Adaptive polling - learn how often each project ships from the times of
+# its builds, poll more often right after a build and in the hours it usually ships, and
+# back off exponentially while it is quiet. Set PAPER_POLLER_ADAPTIVE=true to enable it,
+# intervals stay between PAPER_POLLER_ADAPTIVE_MIN and PAPER_POLLER_ADAPTIVE_MAX seconds.
+ADAPTIVE_POLLING = setting("ADAPTIVE_POLLING", "PAPER_POLLER_ADAPTIVE", "false", flag)
+ADAPTIVE_MIN_INTERVAL = setting("ADAPTIVE_MIN_INTERVAL", "PAPER_POLLER_ADAPTIVE_MIN", "60", float)
+ADAPTIVE_MAX_INTERVAL = setting("ADAPTIVE_MAX_INTERVAL", "PAPER_POLLER_ADAPTIVE_MAX", "3600", float)
+
+# Configuration: Daemon mode - keep one process alive and poll on an interval
+# Pass --daemon to enable it, PAPER_POLLER_INTERVAL and PAPER_POLLER_JITTER are in seconds
+DAEMON_MODE = "--daemon" in start_args
+POLL_INTERVAL = setting("POLL_INTERVAL", "PAPER_POLLER_INTERVAL", "600", float)
+POLL_JITTER = setting("POLL_JITTER", "PAPER_POLLER_JITTER", "5", float)
+
+# Configuration: How many webhooks are posted in parallel over the shared connection pool
+WEBHOOK_CONCURRENCY = setting("WEBHOOK_CONCURRENCY", "PAPER_POLLER_WEBHOOK_CONCURRENCY", "8", int)
+
+# Configuration: Which versions multi-version mode tracks
+# PAPER_POLLER_VERSION_WINDOW keeps the newest N versions, PAPER_POLLER_VERSION_MAX_AGE_DAYS
+# keeps versions with a build in the past X days, 0 disables either limit.
+# Versions are fetched newest-first in pages of PAPER_POLLER_VERSION_PAGE_SIZE.
+VERSION_WINDOW = setting("VERSION_WINDOW", "PAPER_POLLER_VERSION_WINDOW", "0", int)
+VERSION_MAX_AGE_DAYS = setting("VERSION_MAX_AGE_DAYS", "PAPER_POLLER_VERSION_MAX_AGE_DAYS", "0", float)
+VERSION_PAGE_SIZE = setting("VERSION_PAGE_SIZE", "PAPER_POLLER_VERSION_PAGE_SIZE", "10", int)
+
+# Configuration: Where the poller keeps its state between runs
+# Set PAPER_POLLER_STATE_BACKEND=sqlite to use PAPER_POLLER_STATE_DB instead of JSON files
+STATE_BACKEND = setting("STATE_BACKEND", "PAPER_POLLER_STATE_BACKEND", "json", str.lower)
+STATE_DB = setting("STATE_DB", "PAPER_POLLER_STATE_DB", "paper_poller.db")
+# With PAPER_POLLER_STATE_BACKEND=journal, compact the journal after this many records
+JOURNAL_COMPACT_EVERY = setting("JOURNAL_COMPACT_EVERY", "PAPER_POLLER_JOURNAL_COMPACT_EVERY", "200", int)
+
+# Configuration: How often a webhook post is retried after Discord answers 429
+WEBHOOK_MAX_RETRIES = setting("WEBHOOK_MAX_RETRIES", "PAPER_POLLER_WEBHOOK_RETRIES", "3", int)
+
+# Configuration: Timeouts, retries and circuit breakers for every GraphQL and webhook request
+# Requests give up after PAPER_POLLER_CONNECT_TIMEOUT seconds connecting and
+# PAPER_POLLER_READ_TIMEOUT seconds waiting for data. Timeouts, lost connections and 5xx
+# answers are retried PAPER_POLLER_RETRIES times, waiting up to PAPER_POLLER_RETRY_BACKOFF
+# seconds doubled per attempt, with full jitter. After PAPER_POLLER_BREAKER_THRESHOLD such
+# failures in a row an upstream host is skipped for PAPER_POLLER_BREAKER_COOLDOWN seconds,
+# webhook posts are only retried and never skipped.
+CONNECT_TIMEOUT = setting("CONNECT_TIMEOUT", "PAPER_POLLER_CONNECT_TIMEOUT", "5", float)
+READ_TIMEOUT = setting("READ_TIMEOUT", "PAPER_POLLER_READ_TIMEOUT", "30", float)
+REQUEST_RETRIES = setting("REQUEST_RETRIES", "PAPER_POLLER_RETRIES", "2", int)
+RETRY_BACKOFF = setting("RETRY_BACKOFF", "PAPER_POLLER_RETRY_BACKOFF", "0.5", float)
+BREAKER_THRESHOLD = setting("BREAKER_THRESHOLD", "PAPER_POLLER_BREAKER_THRESHOLD", "5", int)
+BREAKER_COOLDOWN = setting("BREAKER_COOLDOWN", "PAPER_POLLER_BREAKER_COOLDOWN", "60", float)
+
+# Configuration: Seconds a run (or a daemon cycle) may take, 0 disables the deadline
+# Once it passes no new request or version is started, finished work is saved and the
+# rest is left for the next run, so a hung upstream can't hold the lock file forever.
+RUN_DEADLINE = setting("RUN_DEADLINE", "PAPER_POLLER_RUN_DEADLINE", "300", float)
+
+# Configuration: Prometheus metrics
+# In daemon mode /metrics is served on PAPER_POLLER_METRICS_ADDR:PAPER_POLLER_METRICS_PORT,
+# a port of 0 disables it. Set PAPER_POLLER_METRICS_FILE to write the metrics after every
+# run, e.g. to a *.prom file in the directory of node_exporter's textfile collector.
+METRICS_ADDR = setting("METRICS_ADDR", "PAPER_POLLER_METRICS_ADDR", "127.0.0.1")
+METRICS_PORT = setting("METRICS_PORT", "PAPER_POLLER_METRICS_PORT", "9108", int)
+METRICS_FILE = setting("METRICS_FILE", "PAPER_POLLER_METRICS_FILE", "")
+
+# Configuration: Profile a run - pass --profile to time every phase and write a JSON
+# report to PAPER_POLLER_PROFILE_DIR. PAPER_POLLER_PROFILE_CPROFILE=true adds the top
+# functions from cProfile, PAPER_POLLER_PROFILE_TRACEMALLOC=true the top allocations.
+PROFILE = "--profile" in start_args
+PROFILE_DIR = setting("PROFILE_DIR", "PAPER_POLLER_PROFILE_DIR", "profiles")
+PROFILE_CPROFILE = setting("PROFILE_CPROFILE", "PAPER_POLLER_PROFILE_CPROFILE", "false", flag)
+PROFILE_TRACEMALLOC = setting("PROFILE_TRACEMALLOC", "PAPER_POLLER_PROFILE_TRACEMALLOC", "false", flag)
+
+# Configuration: The GraphQL endpoint builds are read from
+# Set PAPER_POLLER_GRAPHQL_URL to point the poller at a mirror or a local stand-in
+gql_base = setting("gql_base", "PAPER_POLLER_GRAPHQL_URL", "https://fill.papermc.io/graphql")
+
+# Configuration: Subscription mode - keep a GraphQL subscription open over a websocket and
+# poll a project as soon as the API announces one of its builds. Pass --subscribe to enable
+# it, it runs as a daemon on the async engine. PAPER_POLLER_SUBSCRIPTION_URL defaults to the
+# GraphQL endpoint with a ws(s):// scheme. Lost connections are retried with exponential
+# backoff of up to PAPER_POLLER_SUBSCRIPTION_BACKOFF_MAX seconds. When the server does not
+# offer subscriptions, or more than PAPER_POLLER_SUBSCRIPTION_RETRIES connects in a row fail,
+# it polls on PAPER_POLLER_INTERVAL instead and subscribes again after
+# PAPER_POLLER_SUBSCRIPTION_RETRY_AFTER seconds.
+SUBSCRIBE = "--subscribe" in start_args
+SUBSCRIPTION_URL = setting("SUBSCRIPTION_URL", "PAPER_POLLER_SUBSCRIPTION_URL", "")
+SUBSCRIPTION_RETRIES = setting("SUBSCRIPTION_RETRIES", "PAPER_POLLER_SUBSCRIPTION_RETRIES", "5", int)
+SUBSCRIPTION_BACKOFF_MAX = setting("SUBSCRIPTION_BACKOFF_MAX", "PAPER_POLLER_SUBSCRIPTION_BACKOFF_MAX", "60", float)
+SUBSCRIPTION_RETRY_AFTER = setting("SUBSCRIPTION_RETRY_AFTER", "PAPER_POLLER_SUBSCRIPTION_RETRY_AFTER", "1800", float)
+
+
+def load_cached_schema(cache_file=None, ttl=None, url=None):
+    """Return the cached introspection result, or None if missing, stale or for another server
+
+    A ttl of None accepts a cache of any age.
+    """
+    cache_file = cache_file or SCHEMA_CACHE_FILE
+    url = url or gql_base
+    try:
+        age = time.time() - os.path.getmtime(cache_file)
+        with open(cache_file, "r") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if ttl is not None and age > ttl:
+        return None
+    if data.get("url") != url:
+        return None
+    return data.get("introspection")
+
+
+def save_cached_schema(introspection, cache_file=None, url=None):
+    cache_file = cache_file or SCHEMA_CACHE_FILE
+    url = url or gql_base
+    data = {"url": url, "introspection": introspection}
+    with open(cache_file, "w") as f:
+        json.dump(data, f)
+
+
+def _define_schema_cache_client():
+    from gql import Client
+    from graphql import build_client_schema
+
+    class SchemaCacheClient(Client):
+        """gql Client that validates queries against an on-disk schema cache
+
+        The schema is only introspected when the cache is missing, older than the TTL
+        or a refresh is requested. If introspection fails, a stale cache is used instead.
+        """
+
+        def __init__(self, *, cache_file=None, ttl=None, refresh=False, **kwargs):
+            super().__init__(fetch_schema_from_transport=True, **kwargs)
+            self.cache_file = cache_file
+            self.ttl = SCHEMA_CACHE_TTL if ttl is None else ttl
+            self.refresh = refresh
+
+        def _use_schema(self, introspection):
+            self.introspection = introspection
+            self.schema = build_client_schema(introspection)
+
+        def _load_schema_cache(self):
+            if self.schema is not None or self.refresh:
+                return
+            introspection = load_cached_schema(self.cache_file, self.ttl, self.transport.url)
+            if introspection:
+                self._use_schema(introspection)
+
+        def _save_schema_cache(self, had_schema):
+            self.refresh = False
+            if had_schema or not self.introspection:
+                return
+            try:
+                save_cached_schema(self.introspection, self.cache_file, self.transport.url)
+            except OSError as e:
+                print(f"Could not write GraphQL schema cache: {e}")
+
+        def _use_stale_schema_cache(self):
+            introspection = load_cached_schema(self.cache_file, None, self.transport.url)
+            if not introspection:
+                return False
+            print("Could not fetch GraphQL schema, using stale cache")
+            self._use_schema(introspection)
+            return True
+
+        def connect_sync(self):
+            self._load_schema_cache()
+            had_schema = self.schema is not None
+            try:
+                session = super().connect_sync()
+            except Exception:
+                if had_schema or not self._use_stale_schema_cache():
+                    raise
+                session = super().connect_sync()
+            self._save_schema_cache(had_schema)
+            return session
+
+        async def connect_async(self, reconnecting=False, **kwargs):
+            self._load_schema_cache()
+            had_schema = self.schema is not None
+            try:
+                session = await super().connect_async(reconnecting, **kwargs)
+            except Exception:
+                if had_schema or not self._use_stale_schema_cache():
+                    raise
+                session = await super().connect_async(reconnecting, **kwargs)
+            self._save_schema_cache(had_schema)
+            return session
+
+    return SchemaCacheClient
+
+
+class PersistedQuerySupport:
+    """Remembers which GraphQL servers support automatic persisted queries
+
+    Unknown servers are assumed to support them. A server that does not is tried
+    again once its entry is older than retry_after seconds.
+    """
+
+    def __init__(self, cache_file=None, retry_after=None):
+        self.cache_file = cache_file or APQ_CACHE_FILE
+        self.retry_after = APQ_RETRY_AFTER if retry_after is None else retry_after
+        self._servers = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._servers is None:
+            try:
+                with open(self.cache_file, "r") as f:
+                    self._servers = json.load(f)
+            except (OSError, ValueError):
+                self._servers = {}
+        return self._servers
+
+    def supported(self, url) -> bool:
+        with self._lock:
+            entry = self._load().get(url)
+        if entry is None or entry["supported"]:
+            return True
+        return time.time() - entry["checked"] > self.retry_after
+
+    def record(self, url, supported):
+        with self._lock:
+            servers = self._load()
+            if supported and servers.get(url, {}).get("supported"):
+                return
+            servers[url] = {"supported": supported, "checked": time.time()}
+            try:
+                write_json_atomically(self.cache_file, servers)
+            except OSError as e:
+                print(f"Could not write persisted query cache: {e}")
 
 
-gql_base = "https://fill.papermc.io/graphql"
+_persisted_query_support = None
+_persisted_query_support_lock = threading.Lock()
 
-transport = RequestsHTTPTransport(url=gql_base)
-client = Client(transport=transport, fetch_schema_from_transport=True)
 
-latest_query = gql(
+def get_persisted_query_support():
+    """Return the process wide persisted query support cache, creating it on first use"""
+    global _persisted_query_support
+    with _persisted_query_support_lock:
+        if _persisted_query_support is None:
+            _persisted_query_support = PersistedQuerySupport()
+        return _persisted_query_support
+
+
+def persisted_query_extensions(query) -> dict:
+    query_hash = hashlib.sha256(query.encode("utf-8")).hexdigest()
+    return {"persistedQuery": {"version": 1, "sha256Hash": query_hash}}
+
+
+def persisted_query_error(result, status=None):
+    """Whether a hash-only request failed because of the hash
+
+    Returns "not_found" when the server does not know the hash yet, "not_supported"
+    when the server said it has no persisted queries, "rejected" when it answered
+    the request without data and a 4xx status, "unavailable" for a 5xx or 429 status,
+    "failed" for any other request without data and None when the request succeeded.
+    """
+    if not result.errors:
+        return None
+    for error in result.errors:
+        code = (error.get("extensions") or {}).get("code")
+        message = error.get("message")
+        if code == "PERSISTED_QUERY_NOT_FOUND" or message == "PersistedQueryNotFound":
+            return "not_found"
+        if code == "PERSISTED_QUERY_NOT_SUPPORTED" or message == "PersistedQueryNotSupported":
+            return "not_supported"
+    if result.data is not None:
+        return None
+    if status is not None and (status == 429 or status >= 500):
+        return "unavailable"
+    if status is not None and status >= 400:
+        return "rejected"
+    return "failed"
+
+
+def persisted_query_failure(error):
+    """The persisted_query_error() of a hash-only request that raised error
+
+    Transient errors such as a 5xx answer say nothing about persisted queries, they
+    are raised again for the retries of call_upstream().
+    """
+    from gql.transport.exceptions import TransportServerError
+
+    if is_transient_error(error):
+        raise error
+    return "rejected" if isinstance(error, TransportServerError) else "failed"
+
+
+def unavailable_error(result, status):
+    from gql.transport.exceptions import TransportServerError
+
+    return TransportServerError(f"{status} answer to a persisted query: {result.errors}", status)
+
+
+def persisted_query_exchange(request, url, support, status):
+    """The requests that send request to url as an automatic persisted query
+
+    A generator shared by the sync and async transports, which only do the I/O: it
+    yields each request to send and is sent its result, or thrown the exception it
+    raised. It returns the result of the query. status is the ContextVar holding the
+    HTTP status of the last answer.
     """
+    from gql.transport.exceptions import TransportProtocolError, TransportServerError
+
+    persisted_request = lazy("PersistedQueryRequest")
+    try:
+        result = yield persisted_request(request, include_query=False)
+        error = persisted_query_error(result, status.get())
+    except (TransportProtocolError, TransportServerError) as e:
+        error = persisted_query_failure(e)
+    if error == "unavailable":
+        raise unavailable_error(result, status.get())
+    if error is None:
+        support.record(url, True)
+        return result
+
+    if error == "not_found":
+        result = yield persisted_request(request, include_query=True)
+        support.record(url, True)
+        return result
+
+    # Not supported, or the server could not make sense of a hash-only request
+    result = yield request
+    if error == "not_supported" or (error == "rejected" and result.data is not None):
+        support.record(url, False)
+    return result
+
+
+def _define_persisted_query_request():
+    from gql import GraphQLRequest
+
+    class PersistedQueryRequest(GraphQLRequest):
+        """GraphQLRequest whose payload carries the query hash, and the text only if asked"""
+
+        def __init__(self, request, *, include_query):
+            super().__init__(request)
+            self.include_query = include_query
+
+        @property
+        def payload(self):
+            payload = super().payload
+            payload["extensions"] = persisted_query_extensions(payload["query"])
+            if not self.include_query:
+                del payload["query"]
+            return payload
+
+    return PersistedQueryRequest
+
+
+def _define_persisted_query_transport():
+    import contextvars
+
+    from gql.transport.requests import RequestsHTTPTransport
+
+    class PersistedQueryTransport(RequestsHTTPTransport):
+        """RequestsHTTPTransport that sends automatic persisted queries
+
+        Each query is first sent as its hash alone. If the server does not know the
+        hash, the query is sent again with its text so the server registers it. If the
+        server says it does not support persisted queries, or rejects the hash-only
+        request with a 4xx status, that is remembered and the plain query is sent from
+        then on. 5xx answers are raised for the retries and change nothing.
+        """
+
+        # HTTP status of the last answer, per thread and task
+        status = contextvars.ContextVar("persisted_query_status", default=None)
+
+        def __init__(self, *args, support=None, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.support = support or get_persisted_query_support()
+
+        def _prepare_result(self, response):
+            self.status.set(response.status_code)
+            return super()._prepare_result(response)
+
+        def execute(self, request, *args, **kwargs):
+            if kwargs.get("upload_files") or not self.support.supported(self.url):
+                return super().execute(request, *args, **kwargs)
+
+            exchange = persisted_query_exchange(request, self.url, self.support, self.status)
+            try:
+                sent = next(exchange)
+                while True:
+                    try:
+                        result = super().execute(sent, *args, **kwargs)
+                    except Exception as e:
+                        sent = exchange.throw(e)
+                    else:
+                        sent = exchange.send(result)
+            except StopIteration as done:
+                return done.value
+
+    return PersistedQueryTransport
+
+
+def _define_async_persisted_query_transport():
+    import contextvars
+
+    from gql.transport.aiohttp import AIOHTTPTransport
+
+    class AsyncPersistedQueryTransport(AIOHTTPTransport):
+        """AIOHTTPTransport that sends automatic persisted queries, see PersistedQueryTransport"""
+
+        # Concurrent queries share the transport, each task sees its own status
+        status = contextvars.ContextVar("async_persisted_query_status", default=None)
+
+        def __init__(self, *args, support=None, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.support = support or get_persisted_query_support()
+
+        async def _prepare_result(self, response):
+            self.status.set(response.status)
+            return await super()._prepare_result(response)
+
+        async def execute(self, request, *args, **kwargs):
+            if kwargs.get("upload_files") or not self.support.supported(self.url):
+                return await super().execute(request, *args, **kwargs)
+
+            exchange = persisted_query_exchange(request, self.url, self.support, self.status)
+            try:
+                sent = next(exchange)
+                while True:
+                    try:
+                        result = await super().execute(sent, *args, **kwargs)
+                    except Exception as e:
+                        sent = exchange.throw(e)
+                    else:
+                        sent = exchange.send(result)
+            except StopIteration as done:
+                return done.value
+
+    return AsyncPersistedQueryTransport
+
+
+def _create_client():
+    # requests takes a (connect, read) pair wherever it takes a timeout
+    timeout = (CONNECT_TIMEOUT, READ_TIMEOUT)
+    if PERSISTED_QUERIES:
+        transport = lazy("PersistedQueryTransport")(url=gql_base, timeout=timeout)
+    else:
+        from gql.transport.requests import RequestsHTTPTransport
+
+        transport = RequestsHTTPTransport(url=gql_base, timeout=timeout)
+    return lazy("SchemaCacheClient")(transport=transport, refresh=REFRESH_SCHEMA)
+
+
+latest_query_source = """
 query getLatestBuild($project: String!) {
     project(id: $project) {
         id
@@ -108,10 +614,8 @@ query getLatestBuild($project: String!) {
     }
 }
 """
-)
 
-all_versions_query = gql(
-    """
+all_versions_query_source = """
 query getAllVersionsWithBuilds($project: String!) {
     project(id: $project) {
         id
@@ -138,158 +642,2272 @@ query getAllVersionsWithBuilds($project: String!) {
     }
 }
 """
-)
 
 
-def convert_commit_hash_to_short(hash):
-    return hash[:7]
+versions_page_query_source = """
+query getVersionsPage($project: String!, $last: Int!) {
+    project(id: $project) {
+        id
+        versions(last: $last) {
+            id
+            builds(last: 1) {
+                id
+                download(name: "server:default") {
+                    name
+                    size
+                    url
+                    checksums {
+                        sha256
+                    }
+                }
+                commits {
+                    sha
+                    message
+                }
+                time
+                channel
+            }
+        }
+    }
+}
+"""
 
 
-def convert_build_date(date):
-    # format: 2022-06-14T10:40:30.563Z
-    return dt.strptime(date, "%Y-%m-%dT%H:%M:%S.%f%z")
+# Probe variants of the queries above, only what is needed to tell whether a build is new
+latest_probe_query_source = """
+query probeLatestBuild($project: String!) {
+    project(id: $project) {
+        id
+        versions(last: 1) {
+            id
+            builds(last: 1) {
+                id
+                time
+                channel
+            }
+        }
+    }
+}
+"""
 
+all_versions_probe_query_source = """
+query probeAllVersions($project: String!) {
+    project(id: $project) {
+        id
+        versions {
+            id
+            builds(last: 1) {
+                id
+                time
+                channel
+            }
+        }
+    }
+}
+"""
 
-class PaperAPI:
-    def __init__(self, base_url="https://api.papermc.io/v2", project="paper"):
-        self.headers = {
-            "User-Agent": "PaperMC Version Poller",
-            "Cache-Control": "no-cache",
-            "Pragma": "no-cache",
+versions_page_probe_query_source = """
+query probeVersionsPage($project: String!, $last: Int!) {
+    project(id: $project) {
+        id
+        versions(last: $last) {
+            id
+            builds(last: 1) {
+                id
+                time
+                channel
+            }
         }
-        self.base_url = base_url
-        self.project = project
-        self.image_url = ""
-        if self.project == "paper":
-            self.image_url = "https://assets.papermc.io/brand/papermc_logo.512.png"
-        elif self.project == "folia":
-            self.image_url = "https://assets.papermc.io/brand/folia_logo.256x139.png"
-        elif self.project == "velocity":
-            self.image_url = "https://assets.papermc.io/brand/velocity_logo.256x128.png"
+    }
+}
+"""
 
-    def up_to_date(self, version, build) -> bool:
-        # Read out {project}_poller.json file
-        try:
-            with open(f"{self.project}_poller.json", "r") as f:
-                data = json.load(f)
-        except FileNotFoundError:
-            data = {"version": "", "build": ""}
-        # Check if the version is up to date
-        if data["version"] == version and data["build"] == build:
-            return True
-        else:
-            return False
 
-    def up_to_date_for_version(self, version, build) -> bool:
-        # Read out {project}_poller.json file to check specific version
-        try:
-            with open(f"{self.project}_poller.json", "r") as f:
-                data = json.load(f)
-        except FileNotFoundError:
-            data = {"versions": {}}
+missed_builds_query_source = """
+query getMissedBuilds($project: String!, $version: String!, $last: Int!) {
+    project(id: $project) {
+        id
+        version(id: $version) {
+            id
+            builds(last: $last) {
+                id
+                commits {
+                    sha
+                    message
+                }
+            }
+        }
+    }
+}
+"""
 
-        # Check if we have versions structure
-        if "versions" not in data:
-            # Legacy format, convert it
-            if "version" in data and "build" in data:
-                return data["version"] == version and data["build"] == build
-            return False
+projects_query_source = """
+query discoverProjects {
+    projects {
+        id
+    }
+}
+"""
 
-        version_data = data["versions"].get(version, {})
-        return version_data.get("build") == build
+build_subscription_source = """
+subscription buildPublished {
+    buildPublished {
+        id
+        project {
+            id
+        }
+        version {
+            id
+        }
+    }
+}
+"""
 
-    def get_stored_data(self):
-        try:
-            with open(f"{self.project}_poller.json", "r") as f:
-                data = json.load(f)
-        except FileNotFoundError:
-            data = {"version": "", "build": "", "channel": ""}
-        return data
 
-    def get_stored_data_for_version(self, version):
-        try:
-            with open(f"{self.project}_poller.json", "r") as f:
-                data = json.load(f)
-        except FileNotFoundError:
-            data = {"versions": {}}
+def select_query(all_versions=False, paged=False, probe=False):
+    """The query for a poll mode, probe queries skip commits and downloads"""
+    if not all_versions:
+        return lazy("latest_probe_query" if probe else "latest_query")
+    if paged:
+        return lazy("versions_page_probe_query" if probe else "versions_page_query")
+    return lazy("all_versions_probe_query" if probe else "all_versions_query")
 
-        # Check if we have versions structure
-        if "versions" not in data:
-            # Legacy format
-            if "version" in data and data["version"] == version:
-                return {
-                    "build": data.get("build", ""),
-                    "channel": data.get("channel", None),
-                }
-            return {"build": "", "channel": None}
 
-        return data["versions"].get(version, {"build": "", "channel": None})
+def version_window_enabled() -> bool:
+    return VERSION_WINDOW > 0 or VERSION_MAX_AGE_DAYS > 0
 
-    def write_to_json(self, version, build, channel_name):
-        data = {"version": version, "build": build, "channel": channel_name}
-        with open(f"{self.project}_poller.json", "w") as f:
-            json.dump(data, f)
 
-    def write_version_to_json(self, version, build, channel_name):
-        # Read existing data
-        try:
-            with open(f"{self.project}_poller.json", "r") as f:
-                data = json.load(f)
-        except FileNotFoundError:
-            data = {"versions": {}}
+def version_window_first_page() -> int:
+    """Number of versions to ask for in the first page of a windowed scan"""
+    if VERSION_WINDOW > 0 and VERSION_MAX_AGE_DAYS <= 0:
+        # The window size is known up front, a single page covers it
+        return VERSION_WINDOW
+    if VERSION_WINDOW > 0:
+        return min(VERSION_WINDOW, VERSION_PAGE_SIZE)
+    return VERSION_PAGE_SIZE
 
-        # Ensure versions structure exists
-        if "versions" not in data:
-            data = {"versions": {}}
 
-        # Update the specific version
-        data["versions"][version] = {"build": build, "channel": channel_name}
+def _latest_build_time(version_data):
+    builds = version_data.get("builds") or []
+    if not builds:
+        return None
+    return convert_build_date(builds[-1]["time"])
 
-        # Keep legacy format for latest version for backward compatibility
-        data["version"] = version
-        data["build"] = build
-        data["channel"] = channel_name
 
-        with open(f"{self.project}_poller.json", "w") as f:
-            json.dump(data, f)
+def version_window_covered(versions, last) -> bool:
+    """Whether a page of the newest `last` versions holds the whole tracked window"""
+    if len(versions) < last:
+        # Every version the project has is in this page
+        return True
+    if VERSION_WINDOW > 0 and last >= VERSION_WINDOW:
+        return True
+    if VERSION_MAX_AGE_DAYS > 0 and versions:
+        # Versions are oldest first, stop once the oldest one is out of the window
+        cutoff = dt.now(timezone.utc) - timedelta(days=VERSION_MAX_AGE_DAYS)
+        oldest_build_time = _latest_build_time(versions[0])
+        return oldest_build_time is None or oldest_build_time < cutoff
+    return False
 
-    def get_changes_for_build(self, data) -> str:
-        return_string = ""
-        for change in data["commits"]:
-            commit_hash = convert_commit_hash_to_short(change["sha"])
-            full_hash = change["sha"]
-            summary = change["message"]
-            summary = summary.strip()
-            # summary = "Update DataConverter constants for 1.21.7\n\nhttps://github.com/PaperMC/DataConverter/commit/04b08a102a3d2473420edceed05420b5ccb3b771\n"
-            # Replace the first \n\n with \n\t, then all others with \n
-            summary = summary.split("\n")[0]
-            # Find all unique PR/issue numbers referenced in the summary
-            pr_numbers = set(re.findall(r"#(\d+)", summary))
-
-            # Replace each occurrence exactly once so we don't wrap already-linked numbers
-            for pr_number in pr_numbers:
-                summary = summary.replace(
-                    f"#{pr_number}",
-                    f"[#{pr_number}](https://github.com/PaperMC/{self.project}/issues/{pr_number})",
-                )
-            github_url = f"https://github.com/PaperMC/{self.project}/commit/{full_hash}"
-            # URL encode the github_url
-            github_url = urllib.parse.quote(github_url)
-            return_string += f"- [{commit_hash}](https://diffs.dev/?github_url={github_url}) {summary}\n"
-        return return_string
-
-    def get_latest_build(self):
-        query = latest_query
-        variables = {"project": self.project}
-        result = client.execute(query, variable_values=variables)
-        return result
 
-    def get_all_versions(self):
-        query = all_versions_query
-        variables = {"project": self.project}
-        result = client.execute(query, variable_values=variables)
-        return result
+def version_window_next_page(last) -> int:
+    # The API has no cursors, so each page asks for twice as many of the newest versions
+    if VERSION_WINDOW > 0:
+        return min(last * 2, VERSION_WINDOW)
+    return last * 2
+
+
+def filter_version_window(versions):
+    """Keep the versions inside the tracked window, oldest first like the API"""
+    if VERSION_WINDOW > 0:
+        versions = versions[-VERSION_WINDOW:]
+    if VERSION_MAX_AGE_DAYS > 0:
+        cutoff = dt.now(timezone.utc) - timedelta(days=VERSION_MAX_AGE_DAYS)
+        versions = [
+            version_data
+            for version_data in versions
+            if (_latest_build_time(version_data) or cutoff) > cutoff
+        ]
+    return versions
+
+
+def _project_selection(query):
+    """Return the selection set of the `project` field of a single project query"""
+    from graphql import print_ast
+
+    operation = query.document.definitions[0]
+    return print_ast(operation.selection_set.selections[0].selection_set)
+
+
+def _batch_alias(index):
+    return f"p{index}"
+
+
+@lru_cache(maxsize=8)
+def _build_batched_document(project_ids, batch_all_versions, paged, probe):
+    from gql import gql
+
+    query = select_query(batch_all_versions, paged, probe)
+    selection = _project_selection(query)
+    arguments = ", ".join(
+        f"${_batch_alias(index)}: String!" for index in range(len(project_ids))
+    )
+    if paged:
+        arguments += ", $last: Int!"
+    fields = "\n".join(
+        f"{_batch_alias(index)}: project(id: ${_batch_alias(index)}) {selection}"
+        for index in range(len(project_ids))
+    )
+    return gql(f"query getProjectsBatch({arguments}) {{\n{fields}\n}}")
+
+
+def build_batched_query(project_ids, batch_all_versions=False, last=None, probe=False):
+    """Combine the query of every project into one document using field aliases
+
+    Returns the document and its variables. Each project is aliased as p0, p1, ...
+    in the order given, since project ids are not guaranteed to be valid GraphQL names.
+    With `last`, every project only returns its newest `last` versions.
+    """
+    project_ids = tuple(project_ids)
+    paged = batch_all_versions and last is not None
+    document = _build_batched_document(project_ids, batch_all_versions, paged, probe)
+    variables = {
+        _batch_alias(index): project_id for index, project_id in enumerate(project_ids)
+    }
+    if paged:
+        variables["last"] = last
+    return document, variables
+
+
+def build_poll_query(project_ids):
+    """The batched query for the configured mode and version window"""
+    last = None
+    if CHECK_ALL_VERSIONS and version_window_enabled():
+        last = version_window_first_page()
+    return build_batched_query(project_ids, CHECK_ALL_VERSIONS, last, TWO_PHASE_POLL)
+
+
+def split_batched_result(result, project_ids):
+    """Split a batched response back into single project query results"""
+    return {
+        project_id: {"project": result.get(_batch_alias(index)) or {}}
+        for index, project_id in enumerate(project_ids)
+    }
+
+
+def _version_selection(query):
+    """Return the selection set of the `versions` field of a single project query"""
+    from graphql import print_ast
+
+    operation = query.document.definitions[0]
+    project_field = operation.selection_set.selections[0]
+    for field in project_field.selection_set.selections:
+        if field.name.value == "versions":
+            return print_ast(field.selection_set)
+    raise ValueError("Query has no versions field")
+
+
+def _version_alias(index):
+    return f"v{index}"
+
+
+@lru_cache(maxsize=16)
+def _build_details_document(version_count):
+    from gql import gql
+
+    selection = _version_selection(lazy("all_versions_query"))
+    arguments = "".join(
+        f", ${_version_alias(index)}: String!" for index in range(version_count)
+    )
+    fields = "\n".join(
+        f"{_version_alias(index)}: version(id: ${_version_alias(index)}) {selection}"
+        for index in range(version_count)
+    )
+    return gql(
+        f"query getBuildDetails($project: String!{arguments}) {{\n"
+        f"project(id: $project) {{\nid\n{fields}\n}}\n}}"
+    )
+
+
+def build_details_query(project_id, version_ids):
+    """Query the latest build of just the given versions, with commits and downloads"""
+    document = _build_details_document(len(version_ids))
+    variables = {"project": project_id}
+    for index, version_id in enumerate(version_ids):
+        variables[_version_alias(index)] = version_id
+    return document, variables
+
+
+def split_details_result(result, version_ids):
+    """Map each requested version id to its version data, None if it is gone"""
+    project = result.get("project") or {}
+    return {
+        version_id: project.get(_version_alias(index))
+        for index, version_id in enumerate(version_ids)
+    }
+
+
+def merge_build_details(gql_result, details):
+    """Swap the probed builds of changed versions for their full details
+
+    Changed versions without details are dropped, so they are neither stored nor
+    announced. The run then does not save its response fingerprint, so the next poll
+    finds their builds still missing from the state and fetches the details again.
+    """
+    versions = []
+    for version_data in gql_result["project"]["versions"]:
+        version_id = version_data["id"]
+        if version_id not in details:
+            versions.append(version_data)
+        elif details[version_id] is not None:
+            versions.append(details[version_id])
+    return {"project": {**gql_result["project"], "versions": versions}}
+
+
+# Default histogram buckets in seconds, from a fast local call to a stuck upstream
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape_label(value)}"' for name, value in zip(names, values)]
+    pairs.extend(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(labels[name] for name in self.labels)
+
+    def clear(self):
+        with self._lock:
+            self._values = {}
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.extend(self._samples(key, value))
+        return lines
+
+    def _samples(self, key, value):
+        return [f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}"]
+
+
+class CounterMetric(_Metric):
+    """A value that only goes up, per combination of label values"""
+
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+
+class GaugeMetric(_Metric):
+    """A value that is set to the latest reading"""
+
+    type = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class HistogramMetric(_Metric):
+    """Observations counted into cumulative buckets, with their sum and count"""
+
+    type = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key) or ([0] * (len(self.buckets) + 1), 0.0)
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            else:
+                counts[-1] += 1
+            self._values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels):
+        with self._lock:
+            counts, _ = self._values.get(self._key(labels)) or ([0], 0.0)
+            return sum(counts)
+
+    def _samples(self, key, value):
+        counts, total = value
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else _format_value(bound)
+            labels = _format_labels(self.labels, key, [f'le="{le}"'])
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(self.labels, key)
+        lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+        lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """Every metric of the process, rendered in the Prometheus text format"""
+
+    def __init__(self):
+        self.metrics = []
+
+    def _register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labels=()):
+        return self._register(CounterMetric(name, documentation, labels))
+
+    def gauge(self, name, documentation, labels=()):
+        return self._register(GaugeMetric(name, documentation, labels))
+
+    def histogram(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        return self._register(HistogramMetric(name, documentation, labels, buckets))
+
+    def clear(self):
+        for metric in self.metrics:
+            metric.clear()
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+graphql_request_seconds = metrics.histogram(
+    "paper_poller_graphql_request_seconds",
+    "GraphQL request latency, project is all for batched requests",
+    ("project",),
+)
+webhook_request_seconds = metrics.histogram(
+    "paper_poller_webhook_request_seconds",
+    "Webhook post latency by webhook and HTTP status, error when no response arrived",
+    ("webhook", "status"),
+)
+state_io_seconds = metrics.histogram(
+    "paper_poller_state_io_seconds",
+    "Time spent loading and saving project state",
+    ("project", "operation"),
+)
+cycle_seconds = metrics.histogram(
+    "paper_poller_cycle_seconds", "Duration of a poll cycle over every project"
+)
+last_cycle_timestamp = metrics.gauge(
+    "paper_poller_last_cycle_timestamp_seconds", "Unix time the last poll cycle finished"
+)
+updates_total = metrics.counter(
+    "paper_poller_updates_total", "New builds announced", ("project",)
+)
+rate_limited_total = metrics.counter(
+    "paper_poller_rate_limited_total", "429 responses from webhooks", ("webhook",)
+)
+errors_total = metrics.counter(
+    "paper_poller_errors_total",
+    "Errors by stage: graphql, webhook, cycle, subscription or metrics",
+    ("stage",),
+)
+retries_total = metrics.counter(
+    "paper_poller_retries_total", "Requests retried after a transient failure", ("upstream",)
+)
+circuit_open = metrics.gauge(
+    "paper_poller_circuit_open", "1 while the circuit breaker of an upstream is open", ("upstream",)
+)
+
+
+@contextmanager
+def timed_cycle():
+    """Time a poll cycle and record when it finished"""
+    with cycle_seconds.time():
+        yield
+    last_cycle_timestamp.set(time.time())
+
+
+def write_metrics_file(path):
+    """Write the metrics for a textfile collector, replacing the file atomically"""
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w") as f:
+        f.write(metrics.render())
+    os.replace(temp_path, path)
+
+
+def start_metrics_server(address=None, port=None):
+    """Serve /metrics from a background thread, returns the server"""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = metrics.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(
+        (address or METRICS_ADDR, METRICS_PORT if port is None else port), MetricsHandler
+    )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, bound_port = server.server_address[:2]
+    print(f"Serving metrics on http://{host}:{bound_port}/metrics")
+    return server
+
+
+class RunProfiler:
+    """Wall-clock and CPU timers per phase of a run, with optional cProfile and tracemalloc
+
+    Phases nest: the self time of a phase leaves out the phases it called. Webhooks
+    are posted from several threads, so self times can add up to more than the wall
+    time; the unaccounted time of the report only counts the main thread. CPU time
+    is the time of the calling thread. Coroutines don't nest and have no CPU time,
+    it would include every task that ran while they waited.
+    """
+
+    def __init__(self, use_cprofile=False, use_tracemalloc=False, top=25):
+        self.use_cprofile = use_cprofile
+        self.use_tracemalloc = use_tracemalloc
+        self.top = top
+        self.phases = {}
+        self.functions = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._cprofile = None
+        self._main_thread_self = 0.0
+        self.started_at = None
+
+    def start(self):
+        self.started_at = dt.now(timezone.utc)
+        self._start_wall = time.perf_counter()
+        self._start_cpu = time.process_time()
+        if self.use_tracemalloc:
+            import tracemalloc
+
+            tracemalloc.start()
+        if self.use_cprofile:
+            import cProfile
+
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+
+    def _record(self, table, name, wall, self_wall, cpu):
+        entry = table.get(name)
+        if entry is None:
+            entry = table[name] = {
+                "calls": 0,
+                "wall_seconds": 0.0,
+                "self_seconds": 0.0,
+                "cpu_seconds": 0.0,
+            }
+        entry["calls"] += 1
+        entry["wall_seconds"] += wall
+        entry["self_seconds"] += self_wall
+        entry["cpu_seconds"] += cpu
+
+    @contextmanager
+    def phase(self, name, function=None, coroutine=False):
+        # Other coroutines run on the same thread while one waits, so only threads nest
+        stack = [] if coroutine else getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        # Time spent in phases called from this one
+        stack.append(0.0)
+        start_cpu = 0.0 if coroutine else time.thread_time()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - start
+            cpu = 0.0 if coroutine else time.thread_time() - start_cpu
+            nested = stack.pop()
+            if stack:
+                stack[-1] += wall
+            with self._lock:
+                self._record(self.phases, name, wall, wall - nested, cpu)
+                if not coroutine and threading.current_thread() is threading.main_thread():
+                    self._main_thread_self += wall - nested
+                if function:
+                    self._record(self.functions, function, wall, wall - nested, cpu)
+
+    def _cprofile_report(self):
+        import pstats
+
+        self._cprofile.disable()
+        stats = pstats.Stats(self._cprofile)
+        rows = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)
+        return [
+            {
+                "function": f"{filename}:{line}({name})",
+                "calls": calls,
+                "total_seconds": total,
+                "cumulative_seconds": cumulative,
+            }
+            for (filename, line, name), (_, calls, total, cumulative, _) in rows[: self.top]
+        ]
+
+    def _tracemalloc_report(self):
+        import tracemalloc
+
+        snapshot = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return {
+            "peak_bytes": peak,
+            "top": [
+                {"location": str(stat.traceback), "size_bytes": stat.size, "count": stat.count}
+                for stat in snapshot.statistics("lineno")[: self.top]
+            ],
+        }
+
+    def report(self):
+        """Stop profiling and return the report of the run"""
+        wall = time.perf_counter() - self._start_wall
+        report = {
+            "started_at": self.started_at.isoformat(),
+            "argv": sys.argv,
+            "wall_seconds": wall,
+            "cpu_seconds": time.process_time() - self._start_cpu,
+            "phases": self.phases,
+            "functions": self.functions,
+            "unaccounted_seconds": wall - self._main_thread_self,
+        }
+        if self._cprofile is not None:
+            report["cprofile"] = self._cprofile_report()
+        if self.use_tracemalloc:
+            report["tracemalloc"] = self._tracemalloc_report()
+        return report
+
+    def write_report(self, directory=None):
+        """Write the report to a timestamped JSON file, returns its path"""
+        report = self.report()
+        directory = directory or PROFILE_DIR
+        os.makedirs(directory, exist_ok=True)
+        stamp = self.started_at.strftime("%Y%m%dT%H%M%S")
+        path = os.path.join(directory, f"profile-{stamp}-{os.getpid()}.json")
+        write_json_atomically(path, report)
+        return path
+
+
+active_profiler = None
+
+
+@contextmanager
+def profile_phase(name):
+    """Time a block as a phase of the active profiler, does nothing without one"""
+    profiler = active_profiler
+    if profiler is None:
+        yield
+        return
+    with profiler.phase(name):
+        yield
+
+
+def profiled(phase):
+    """Decorator timing every call of a function as a phase of the active profiler"""
+
+    def decorate(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            profiler = active_profiler
+            if profiler is None:
+                return function(*args, **kwargs)
+            with profiler.phase(phase, function.__qualname__):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorate
+
+
+def profiled_async(phase):
+    """profiled() for coroutine functions"""
+
+    def decorate(function):
+        @wraps(function)
+        async def wrapper(*args, **kwargs):
+            profiler = active_profiler
+            if profiler is None:
+                return await function(*args, **kwargs)
+            with profiler.phase(phase, function.__qualname__, coroutine=True):
+                return await function(*args, **kwargs)
+
+        return wrapper
+
+    return decorate
+
+
+class DeadlineExceeded(Exception):
+    """The run deadline passed before a request could be started"""
+
+
+class CircuitOpenError(Exception):
+    """An upstream failed too often recently and is skipped until its cooldown ends"""
+
+
+class RunDeadline:
+    """The point in time by which the current run has to be done
+
+    Every request checks it before it starts and retries stop waiting once it is near,
+    so a run ends at most one request timeout after its deadline.
+    """
+
+    def __init__(self, seconds=None):
+        seconds = RUN_DEADLINE if seconds is None else seconds
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds if seconds > 0 else None
+        # Projects left for the next run because the deadline passed
+        self.skipped = []
+
+    def remaining(self):
+        """Seconds left, None without a deadline"""
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.expires_at is not None and time.monotonic() >= self.expires_at
+
+    def check(self, what):
+        if self.expired():
+            raise DeadlineExceeded(f"Run deadline of {self.seconds:g}s passed before {what}")
+
+    def skip(self, project):
+        self.skipped.append(project.project)
+
+    def finished(self, projects):
+        """The projects that were not left for the next run"""
+        return [project for project in projects if project.project not in self.skipped]
+
+
+run_deadline = RunDeadline(0)
+
+
+def start_run_deadline(seconds=None):
+    """Start the deadline of a run or daemon cycle"""
+    global run_deadline
+    run_deadline = RunDeadline(seconds)
+    return run_deadline
+
+
+def is_transient_error(error) -> bool:
+    """True for failures a retry can fix: timeouts, lost connections and 5xx or 429 answers"""
+    from gql.transport.exceptions import (
+        TransportClosed,
+        TransportConnectionFailed,
+        TransportServerError,
+    )
+
+    if isinstance(error, (TransportServerError, WebhookServerError)):
+        return error.code is None or error.code == 429 or error.code >= 500
+    # requests exceptions and timeouts are OSErrors
+    if isinstance(error, (TransportConnectionFailed, TransportClosed, OSError)):
+        return True
+    # aiohttp's connection errors are not, and aiohttp is only loaded by the async engine
+    aiohttp = sys.modules.get("aiohttp")
+    return aiohttp is not None and isinstance(
+        error, (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError)
+    )
+
+
+class CircuitBreaker:
+    """Stops calling an upstream host after too many transient failures in a row
+
+    Once open, calls fail right away with CircuitOpenError until the cooldown has
+    passed. Then calls go through again, and the first transient failure opens the
+    breaker for another cooldown. Any answer from the upstream, even an error, closes it.
+    """
+
+    def __init__(self, name, threshold=None, cooldown=None):
+        self.name = name
+        self.threshold = max(1, BREAKER_THRESHOLD if threshold is None else threshold)
+        self.cooldown = BREAKER_COOLDOWN if cooldown is None else cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.lock = threading.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None and time.monotonic() - self.opened_at < self.cooldown
+
+    def check(self):
+        with self.lock:
+            if self.opened_at is None:
+                return
+            waited = time.monotonic() - self.opened_at
+            if waited < self.cooldown:
+                raise CircuitOpenError(
+                    f"{self.name} is skipped for {self.cooldown - waited:.0f}s "
+                    f"after {self.failures} failures in a row"
+                )
+            # Half open: let calls through, the next failure opens it again
+            self.opened_at = None
+            self.failures = self.threshold - 1
+
+    def record(self, error=None):
+        with self.lock:
+            if error is None or not is_transient_error(error):
+                self.failures = 0
+                self.opened_at = None
+                circuit_open.set(0, upstream=self.name)
+                return
+            self.failures += 1
+            if self.failures >= self.threshold and self.opened_at is None:
+                self.opened_at = time.monotonic()
+                circuit_open.set(1, upstream=self.name)
+                print(f"Circuit breaker for {self.name} opened after {self.failures} failures")
+
+
+_circuit_breakers = {}
+_circuit_breakers_lock = threading.Lock()
+
+
+def upstream_name(url) -> str:
+    """The host a URL points at, which names its circuit breaker and metrics"""
+    return urllib.parse.urlsplit(url).netloc or url
+
+
+def get_circuit_breaker(url) -> CircuitBreaker:
+    """The circuit breaker of the host a URL points at"""
+    host = upstream_name(url)
+    with _circuit_breakers_lock:
+        breaker = _circuit_breakers.get(host)
+        if breaker is None:
+            breaker = _circuit_breakers[host] = CircuitBreaker(host)
+        return breaker
+
+
+def _retrying(upstream, attempt, deadline):
+    """attempt, retried on transient errors with exponential backoff and full jitter"""
+    import backoff
+
+    def log_retry(details):
+        retries_total.inc(upstream=upstream)
+        print(
+            f"Request to {upstream} failed ({details['exception']}), "
+            f"retrying in {details['wait']:.2f}s (attempt {details['tries']})"
+        )
+
+    return backoff.on_exception(
+        backoff.expo,
+        Exception,
+        max_tries=REQUEST_RETRIES + 1,
+        max_time=deadline.remaining,
+        jitter=backoff.full_jitter,
+        giveup=lambda error: not is_transient_error(error),
+        on_backoff=log_retry,
+        logger=None,
+        factor=RETRY_BACKOFF,
+    )(attempt)
+
+
+def call_upstream(url, function, *args, deadline=None, circuit_breaker=True, **kwargs):
+    """function(*args, **kwargs) for a request to url, with retries and a circuit breaker
+
+    Raises DeadlineExceeded instead of starting a request after the run deadline.
+    deadline replaces the run deadline, RunDeadline(0) for requests without one.
+    With circuit_breaker=False the request is only retried, the breaker of its host
+    neither skips it nor counts its failures.
+    """
+    breaker = get_circuit_breaker(url) if circuit_breaker else None
+    upstream = upstream_name(url)
+    deadline = run_deadline if deadline is None else deadline
+
+    def attempt():
+        deadline.check(f"a request to {upstream}")
+        if breaker is None:
+            return function(*args, **kwargs)
+        breaker.check()
+        try:
+            result = function(*args, **kwargs)
+        except Exception as e:
+            breaker.record(e)
+            raise
+        breaker.record()
+        return result
+
+    return _retrying(upstream, attempt, deadline)()
+
+
+async def call_upstream_async(url, function, *args, deadline=None, circuit_breaker=True, **kwargs):
+    """call_upstream() for coroutine functions"""
+    breaker = get_circuit_breaker(url) if circuit_breaker else None
+    upstream = upstream_name(url)
+    deadline = run_deadline if deadline is None else deadline
+
+    async def attempt():
+        deadline.check(f"a request to {upstream}")
+        if breaker is None:
+            return await function(*args, **kwargs)
+        breaker.check()
+        try:
+            result = await function(*args, **kwargs)
+        except Exception as e:
+            breaker.record(e)
+            raise
+        breaker.record()
+        return result
+
+    return await _retrying(upstream, attempt, deadline)()
+
+
+def _query_executor(session=None):
+    """Use a warm session when one is open, otherwise the client connects per query"""
+    return session if session is not None else lazy("client")
+
+
+def _query_label(variables):
+    return variables.get("project", "all")
+
+
+def execute_query(session, query, variables):
+    """Run a GraphQL query on the session or the shared client, timing it per project"""
+    with graphql_request_seconds.time(project=_query_label(variables)):
+        try:
+            return call_upstream(
+                gql_base, _query_executor(session).execute, query, variable_values=variables
+            )
+        except Exception:
+            errors_total.inc(stage="graphql")
+            raise
+
+
+async def execute_query_async(session, query, variables):
+    with graphql_request_seconds.time(project=_query_label(variables)):
+        try:
+            return await call_upstream_async(
+                gql_base, session.execute, query, variable_values=variables
+            )
+        except Exception:
+            errors_total.inc(stage="graphql")
+            raise
+
+
+@profiled("graphql")
+def fetch_projects(projects, session=None):
+    """Fetch every project in one GraphQL request, keyed by project id"""
+    project_ids = [project.project for project in projects]
+    query, variables = build_poll_query(project_ids)
+    result = execute_query(session, query, variables)
+    return split_batched_result(result, project_ids)
+
+
+def describe_webhook_url(url):
+    """Return a printable name for a webhook URL without its secret token"""
+    parsed = urllib.parse.urlsplit(url)
+    parts = parsed.path.split("/")
+    if "webhooks" in parts:
+        # Discord style URLs: /api/webhooks/{id}/{token}
+        parts = parts[: parts.index("webhooks") + 2]
+    return f"{parsed.netloc}{'/'.join(parts)}"
+
+
+class WebhookResult(NamedTuple):
+    url: str
+    status_code: Optional[int] = None
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None and self.status_code is not None and self.status_code < 400
+
+
+class WebhookServerError(Exception):
+    """A webhook answered with a 5xx status, which is worth a retry"""
+
+    def __init__(self, response):
+        super().__init__(f"HTTP {response.status_code}")
+        self.response = response
+        self.code = response.status_code
+
+
+def _header_float(response_headers, name):
+    try:
+        return float(response_headers[name])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def get_retry_after(response):
+    """Seconds Discord asks us to wait after a 429, from the header or the JSON body"""
+    retry_after = _header_float(response.headers, "Retry-After")
+    if retry_after is None:
+        try:
+            retry_after = float(response.json().get("retry_after"))
+        except (TypeError, ValueError, AttributeError):
+            retry_after = None
+    # Fall back to one second when Discord doesn't say how long to wait
+    return 1.0 if retry_after is None else max(0.0, retry_after)
+
+
+def is_global_rate_limit(response):
+    if response.headers.get("X-RateLimit-Global", "").lower() == "true":
+        return True
+    try:
+        return bool(response.json().get("global"))
+    except (ValueError, AttributeError):
+        return False
+
+
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+
+def encode_payload(payload) -> bytes:
+    return json.dumps(payload, separators=(",", ":")).encode("utf-8")
+
+
+class RateLimitBucket:
+    """Token bucket for one Discord rate limit, kept in sync with X-RateLimit-* headers
+
+    Until the first response we know nothing, so posts go straight through. Afterwards
+    every post takes a token and only waits when the bucket is empty and not yet reset.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.limit = None
+        self.remaining = None
+        self.reset_at = 0.0
+
+    def wait_time(self, now=None) -> float:
+        now = time.monotonic() if now is None else now
+        if self.remaining is not None and self.remaining <= 0 and now < self.reset_at:
+            return self.reset_at - now
+        return 0.0
+
+    def acquire(self):
+        """Take a token, sleeping only if the bucket is empty. Returns the seconds waited"""
+        with self.lock:
+            waited = self.wait_time()
+            if waited > 0:
+                with profile_phase("sleep"):
+                    time.sleep(waited)
+            if self.remaining is not None and self.remaining <= 0:
+                # The bucket has reset, its size is unknown until Discord sends a limit
+                self.remaining = self.limit
+            if self.remaining is not None:
+                self.remaining -= 1
+            return waited
+
+    def update(self, response_headers):
+        """Sync the bucket with the rate limit headers of a response"""
+        limit = _header_float(response_headers, "X-RateLimit-Limit")
+        remaining = _header_float(response_headers, "X-RateLimit-Remaining")
+        reset_after = _header_float(response_headers, "X-RateLimit-Reset-After")
+        with self.lock:
+            if limit is not None:
+                self.limit = int(limit)
+            if remaining is not None:
+                self.remaining = int(remaining)
+            if reset_after is not None:
+                self.reset_at = time.monotonic() + reset_after
+
+    def block_for(self, seconds):
+        """Empty the bucket until the Retry-After of a 429 has passed"""
+        with self.lock:
+            self.remaining = 0
+            self.reset_at = max(self.reset_at, time.monotonic() + seconds)
+
+
+class WebhookDispatcher:
+    """Deliver webhooks over a persistent connection pool, several URLs in parallel
+
+    Connections to Discord are kept alive between posts, so only the first post to a
+    host pays for the TCP and TLS handshake. Every webhook has its own rate limit
+    bucket, and a shared bucket tracks Discord's global limit, so we only wait when
+    Discord told us a bucket is empty.
+    """
+
+    def __init__(self, max_workers=None, max_retries=None):
+        self.max_workers = max(1, max_workers or WEBHOOK_CONCURRENCY)
+        self.max_retries = WEBHOOK_MAX_RETRIES if max_retries is None else max_retries
+        self.global_bucket = RateLimitBucket()
+        self._buckets = {}
+        self._buckets_lock = threading.Lock()
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.session = requests.Session()
+        self.session.headers.update({"User-Agent": headers["User-Agent"]})
+        adapter = HTTPAdapter(
+            pool_connections=self.max_workers, pool_maxsize=self.max_workers
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    def bucket_for(self, url) -> RateLimitBucket:
+        with self._buckets_lock:
+            bucket = self._buckets.get(url)
+            if bucket is None:
+                bucket = self._buckets[url] = RateLimitBucket()
+            return bucket
+
+    def _send(self, url, payload, webhook):
+        """One POST with timeouts, raising WebhookServerError on 5xx so it is retried"""
+        import requests
+
+        start = time.perf_counter()
+        try:
+            response = self.session.post(
+                url,
+                data=payload,
+                headers=JSON_HEADERS,
+                params={"with_components": "true"},
+                timeout=(CONNECT_TIMEOUT, READ_TIMEOUT),
+            )
+        except requests.RequestException:
+            webhook_request_seconds.observe(
+                time.perf_counter() - start, webhook=webhook, status="error"
+            )
+            raise
+        webhook_request_seconds.observe(
+            time.perf_counter() - start, webhook=webhook, status=response.status_code
+        )
+        if response.status_code >= 500:
+            raise WebhookServerError(response)
+        return response
+
+    def post(self, url, payload) -> WebhookResult:
+        """Post a Components V2 payload to a single webhook, honouring rate limits
+
+        payload is either a dict or JSON already encoded by encode_payload(). The build
+        is already stored when it is posted, so neither the run deadline nor a circuit
+        breaker opened by other webhooks on the same host may skip the post, only
+        the retries apply.
+        """
+        import requests
+
+        if not isinstance(payload, bytes):
+            payload = encode_payload(payload)
+        bucket = self.bucket_for(url)
+        webhook = describe_webhook_url(url)
+        for attempt in range(self.max_retries + 1):
+            self.global_bucket.acquire()
+            bucket.acquire()
+            try:
+                response = call_upstream(
+                    url,
+                    self._send,
+                    url,
+                    payload,
+                    webhook,
+                    deadline=RunDeadline(0),
+                    circuit_breaker=False,
+                )
+            except WebhookServerError as e:
+                errors_total.inc(stage="webhook")
+                return WebhookResult(url, e.code)
+            except requests.RequestException as e:
+                errors_total.inc(stage="webhook")
+                return WebhookResult(url, error=str(e))
+
+            bucket.update(response.headers)
+            if response.status_code != 429:
+                if response.status_code >= 400:
+                    errors_total.inc(stage="webhook")
+                return WebhookResult(url, response.status_code)
+
+            rate_limited_total.inc(webhook=webhook)
+
+            retry_after = get_retry_after(response)
+            if is_global_rate_limit(response):
+                self.global_bucket.block_for(retry_after)
+            else:
+                bucket.block_for(retry_after)
+            print(
+                f"Rate limited by {webhook}, "
+                f"retrying in {retry_after:.2f}s (attempt {attempt + 1})"
+            )
+
+        errors_total.inc(stage="webhook")
+        return WebhookResult(url, 429, error="rate limited")
+
+    def map(self, send, urls):
+        """Call send(url) for every URL in parallel, returning results in URL order"""
+        from concurrent.futures import ThreadPoolExecutor
+
+        urls = list(urls)
+        if len(urls) <= 1 or self.max_workers == 1:
+            return [send(url) for url in urls]
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix="webhook"
+                )
+        return list(self._executor.map(send, urls))
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        self.session.close()
+
+
+_webhook_dispatcher = None
+_webhook_dispatcher_lock = threading.Lock()
+
+
+def get_webhook_dispatcher():
+    """Return the process wide webhook dispatcher, creating it on first use"""
+    global _webhook_dispatcher
+    with _webhook_dispatcher_lock:
+        if _webhook_dispatcher is None:
+            _webhook_dispatcher = WebhookDispatcher()
+        return _webhook_dispatcher
+
+
+def missed_build_count(stored_build, latest_build) -> int:
+    """How many builds to fetch to cover every build after stored_build
+
+    Build ids count up per version, anything else can't be caught up on.
+    """
+    try:
+        missed = int(latest_build) - int(stored_build)
+    except (TypeError, ValueError):
+        return 0
+    if missed <= 1:
+        return 0
+    return min(missed, CATCH_UP_MAX_BUILDS)
+
+
+# Components V2 messages allow 4000 characters of text, leave room for the header
+MAX_CHANGES_LENGTH = 3500
+
+
+def truncate_changes(changes, limit=MAX_CHANGES_LENGTH):
+    """Cut a changelog at a line boundary so it fits into one message"""
+    if len(changes) <= limit:
+        return changes
+    lines = changes.splitlines(keepends=True)
+    kept = ""
+    for index, line in enumerate(lines):
+        remaining = len(lines) - index
+        note = f"- ... and {remaining} more\n"
+        if len(kept) + len(line) + len(note) > limit:
+            return kept + note
+        kept += line
+    return kept
+
+
+# Limits of a single Components V2 message, nested components count too
+MAX_MESSAGE_COMPONENTS = 40
+MAX_MESSAGE_TEXT = 4000
+
+
+def count_components(components) -> int:
+    total = 0
+    for component in components:
+        total += 1 + count_components(component.get("components", []))
+        if "accessory" in component:
+            total += 1
+    return total
+
+
+def count_text(components) -> int:
+    """Characters of every text display in components"""
+    total = 0
+    for component in components:
+        if component.get("type") == 10:
+            total += len(component["content"])
+        total += count_text(component.get("components", []))
+    return total
+
+
+def pack_components(header, blocks):
+    """Spread blocks over as few messages as Discord's limits allow
+
+    Every message starts with the header components. A block that does not fit
+    next to others gets a message of its own.
+    """
+    messages = []
+    current = list(header)
+    for block in blocks:
+        candidate = current + [block]
+        too_big = (
+            count_components(candidate) > MAX_MESSAGE_COMPONENTS
+            or count_text(candidate) > MAX_MESSAGE_TEXT
+        )
+        if too_big and len(current) > len(header):
+            messages.append(current)
+            candidate = list(header) + [block]
+        current = candidate
+    if len(current) > len(header):
+        messages.append(current)
+    return messages
+
+
+def update_headline(channel_name, latest_build, latest_version, missed_builds=None):
+    if missed_builds:
+        return (
+            f"{channel_name} Builds {missed_builds[0]} to {latest_build} "
+            f"for {latest_version} are now available!"
+        )
+    return f"{channel_name} Build {latest_build} for {latest_version} is now available!"
+
+
+# Configuration: How many rendered changelog lines are kept, keyed by project and commit
+CHANGELOG_CACHE_SIZE = setting("CHANGELOG_CACHE_SIZE", "PAPER_POLLER_CHANGELOG_CACHE", "4096", int)
+
+ISSUE_REFERENCE = re.compile(r"#(\d+)")
+
+
+@lru_cache(maxsize=32)
+def _changelog_links(project):
+    """The per-project parts of every changelog line, prepared once"""
+    commit_url = urllib.parse.quote(f"https://github.com/PaperMC/{project}/commit/")
+    issue_link = rf"[#\1](https://github.com/PaperMC/{project}/issues/\1)"
+    return f"https://diffs.dev/?github_url={commit_url}", issue_link
+
+
+@lru_cache(maxsize=CHANGELOG_CACHE_SIZE)
+def render_commit_line(project, sha, message) -> str:
+    """One changelog line, with every #123 reference linked to its issue or PR"""
+    diff_url, issue_link = _changelog_links(project)
+    # Only the first line of the commit message is shown
+    summary = message.strip().split("\n", 1)[0]
+    summary = ISSUE_REFERENCE.sub(issue_link, summary)
+    return f"- [{convert_commit_hash_to_short(sha)}]({diff_url}{urllib.parse.quote(sha)}) {summary}\n"
+
+
+def render_changelog(project, commits) -> str:
+    """The changelog of a build, one line per commit
+
+    Paper, Folia and the versions of a project share many commits, so each
+    line is rendered once and cached.
+    """
+    return "".join(
+        render_commit_line(project, commit["sha"], commit["message"]) for commit in commits
+    )
+
+
+def convert_commit_hash_to_short(hash):
+    return hash[:7]
+
+
+def convert_build_date(date):
+    # format: 2022-06-14T10:40:30.563Z
+    return dt.strptime(date, "%Y-%m-%dT%H:%M:%S.%f%z")
+
+
+def write_json_atomically(path, data):
+    """Write JSON to a temporary file and rename it over path
+
+    A crash mid-write leaves the previous file intact instead of a truncated one.
+    """
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w") as f:
+        json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+
+class JsonStateBackend:
+    """Keeps the state of each project in its own {project}_poller.json file"""
+
+    def path(self, project):
+        return f"{project}_poller.json"
+
+    def load(self, project):
+        try:
+            with open(self.path(project), "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def save(self, project, data, changed_versions, replaced):
+        # A JSON file can only be rewritten as a whole
+        write_json_atomically(self.path(project), data)
+
+
+class JournalStateBackend(JsonStateBackend):
+    """Appends each change to {project}_poller.journal on top of a JSON snapshot
+
+    Saving a run appends one record per changed version instead of rewriting the
+    whole state. Loading reads the {project}_poller.json snapshot and replays the
+    journal. Once the journal holds JOURNAL_COMPACT_EVERY records it is compacted
+    into a new snapshot, which is renamed into place atomically.
+
+    Records are JSON lines with an op of:
+    - "reset": forget everything stored so far
+    - "version": (project, version, build, channel) of one version
+    - "remove": a version that left the hot state
+    - "latest": the legacy single version record
+    """
+
+    def __init__(self, compact_every=None):
+        self.compact_every = (
+            JOURNAL_COMPACT_EVERY if compact_every is None else compact_every
+        )
+        # Number of records in each journal, known once the project was loaded
+        self.journal_lengths = {}
+
+    def journal_path(self, project):
+        return f"{project}_poller.journal"
+
+    def load(self, project):
+        data = super().load(project)
+        path = self.journal_path(project)
+        records = 0
+        # Bytes up to the end of the last complete record
+        intact = 0
+        torn = False
+        try:
+            with open(path, "rb") as f:
+                for line in f:
+                    try:
+                        # A record is only complete once its newline was written
+                        if not line.endswith(b"\n"):
+                            raise ValueError("missing newline")
+                        record = json.loads(line)
+                    except ValueError:
+                        # A torn write from a crash, everything before it is intact
+                        torn = True
+                        break
+                    self._apply(data, record)
+                    records += 1
+                    intact += len(line)
+        except FileNotFoundError:
+            pass
+        if torn:
+            # Cut the torn record off, or the next append would continue its line
+            print(f"Dropping incomplete record at the end of {path}")
+            with open(path, "r+b") as f:
+                f.truncate(intact)
+                f.flush()
+                os.fsync(f.fileno())
+        self.journal_lengths[project] = records
+        return data
+
+    @staticmethod
+    def _apply(data, record):
+        op = record["op"]
+        if op == "reset":
+            data.clear()
+        elif op == "version":
+            data.setdefault("versions", {})[record["version"]] = {
+                "build": record["build"],
+                "channel": record["channel"],
+            }
+        elif op == "remove":
+            data.get("versions", {}).pop(record["version"], None)
+        elif op == "latest":
+            data["version"] = record["version"]
+            data["build"] = record["build"]
+            data["channel"] = record["channel"]
+
+    def save(self, project, data, changed_versions, replaced):
+        versions = data.get("versions", {})
+        records = []
+        if replaced:
+            records.append({"op": "reset", "project": project})
+            changed_versions = versions.keys()
+        for version in changed_versions:
+            if version in versions:
+                records.append(
+                    {
+                        "op": "version",
+                        "project": project,
+                        "version": version,
+                        "build": versions[version]["build"],
+                        "channel": versions[version]["channel"],
+                    }
+                )
+            else:
+                records.append({"op": "remove", "project": project, "version": version})
+        if "version" in data:
+            records.append(
+                {
+                    "op": "latest",
+                    "project": project,
+                    "version": data["version"],
+                    "build": data.get("build", ""),
+                    "channel": data.get("channel"),
+                }
+            )
+
+        with open(self.journal_path(project), "a") as f:
+            f.write("".join(json.dumps(record) + "\n" for record in records))
+            f.flush()
+            os.fsync(f.fileno())
+
+        length = self.journal_lengths.get(project, 0) + len(records)
+        self.journal_lengths[project] = length
+        if length >= self.compact_every:
+            self.compact(project, data)
+
+    def compact(self, project, data=None):
+        """Fold the journal into a new snapshot and start an empty journal"""
+        if data is None:
+            data = self.load(project)
+        write_json_atomically(self.path(project), data)
+        # Replaying the old journal over the new snapshot is harmless, so a crash
+        # between these two steps loses nothing
+        with open(self.journal_path(project), "w") as f:
+            f.flush()
+            os.fsync(f.fileno())
+        self.journal_lengths[project] = 0
+
+
+class SqliteStateBackend:
+    """Keeps the state of every project in one SQLite database in WAL mode
+
+    Versions are rows keyed by (project, version), so saving a run only upserts the
+    versions that changed. Existing {project}_poller.json files are imported the
+    first time a project is loaded and renamed to {project}_poller.json.migrated.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or STATE_DB
+        self.lock = threading.Lock()
+        import sqlite3
+
+        self.connection = sqlite3.connect(
+            self.path, timeout=30, check_same_thread=False
+        )
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        with self.connection:
+            # build has no type so integer and string build ids keep their type
+            self.connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS poller_versions (
+                    project TEXT NOT NULL,
+                    version TEXT NOT NULL,
+                    build NOT NULL,
+                    channel TEXT,
+                    PRIMARY KEY (project, version)
+                ) WITHOUT ROWID
+                """
+            )
+            self.connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS poller_latest (
+                    project TEXT PRIMARY KEY,
+                    version TEXT NOT NULL,
+                    build NOT NULL,
+                    channel TEXT
+                )
+                """
+            )
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS poller_migrations (project TEXT PRIMARY KEY)"
+            )
+
+    def load(self, project):
+        with self.lock:
+            self._migrate_json(project)
+            latest = self.connection.execute(
+                "SELECT version, build, channel FROM poller_latest WHERE project = ?",
+                (project,),
+            ).fetchone()
+            rows = self.connection.execute(
+                "SELECT version, build, channel FROM poller_versions WHERE project = ?",
+                (project,),
+            ).fetchall()
+
+        data = {}
+        if latest is not None:
+            data["version"], data["build"], data["channel"] = latest
+        if rows:
+            data["versions"] = {
+                version: {"build": build, "channel": channel}
+                for version, build, channel in rows
+            }
+        return data
+
+    def save(self, project, data, changed_versions, replaced):
+        with self.lock, self.connection:
+            self._write(project, data, changed_versions, replaced)
+
+    def _write(self, project, data, changed_versions, replaced):
+        versions = data.get("versions", {})
+        if replaced:
+            self.connection.execute(
+                "DELETE FROM poller_versions WHERE project = ?", (project,)
+            )
+            changed_versions = versions.keys()
+
+        if "version" in data:
+            self.connection.execute(
+                """
+                INSERT INTO poller_latest (project, version, build, channel)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (project) DO UPDATE SET
+                    version = excluded.version,
+                    build = excluded.build,
+                    channel = excluded.channel
+                """,
+                (project, data["version"], data.get("build", ""), data.get("channel")),
+            )
+        else:
+            self.connection.execute(
+                "DELETE FROM poller_latest WHERE project = ?", (project,)
+            )
+
+        self.connection.executemany(
+            """
+            INSERT INTO poller_versions (project, version, build, channel)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT (project, version) DO UPDATE SET
+                build = excluded.build,
+                channel = excluded.channel
+            """,
+            [
+                (project, version, versions[version]["build"], versions[version]["channel"])
+                for version in changed_versions
+                if version in versions
+            ],
+        )
+        # Changed versions that are gone were archived
+        self.connection.executemany(
+            "DELETE FROM poller_versions WHERE project = ? AND version = ?",
+            [
+                (project, version)
+                for version in changed_versions
+                if version not in versions
+            ],
+        )
+
+    def _migrate_json(self, project):
+        migrated = self.connection.execute(
+            "SELECT 1 FROM poller_migrations WHERE project = ?", (project,)
+        ).fetchone()
+        if migrated:
+            return
+
+        json_backend = JsonStateBackend()
+        json_path = json_backend.path(project)
+        data = json_backend.load(project)
+        with self.connection:
+            if data:
+                self._write(project, data, (), replaced=True)
+            self.connection.execute(
+                "INSERT INTO poller_migrations (project) VALUES (?)", (project,)
+            )
+        if data:
+            os.replace(json_path, f"{json_path}.migrated")
+            print(f"Migrated {json_path} to {self.path}")
+
+    def close(self):
+        self.connection.close()
+
+
+STATE_BACKENDS = {
+    "json": JsonStateBackend,
+    "sqlite": SqliteStateBackend,
+    "journal": JournalStateBackend,
+}
+
+_state_backend = None
+_state_backend_lock = threading.Lock()
+
+
+def get_state_backend():
+    """Return the configured state backend, creating it on first use"""
+    global _state_backend
+    with _state_backend_lock:
+        if _state_backend is None:
+            if STATE_BACKEND not in STATE_BACKENDS:
+                raise ValueError(f"Unknown state backend: {STATE_BACKEND}")
+            _state_backend = STATE_BACKENDS[STATE_BACKEND]()
+        return _state_backend
+
+
+def archive_path(project):
+    return f"{project}_poller_archive.json"
+
+
+def archive_versions(project, records):
+    """Move version records out of the hot state into {project}_poller_archive.json"""
+    path = archive_path(project)
+    try:
+        with open(path, "r") as f:
+            archive = json.load(f)
+    except FileNotFoundError:
+        archive = {"versions": {}}
+    archive["versions"].update(records)
+    write_json_atomically(path, archive)
+
+
+# How often each step was short-circuited in this process, keyed by step name
+short_circuit_counts = Counter()
+
+
+def log_short_circuit(project, step, reason):
+    short_circuit_counts[step] += 1
+    print(
+        f"Skipped {step} for {project}: {reason} "
+        f"({short_circuit_counts[step]} skips this process)"
+    )
+
+
+def fingerprint_path(project):
+    return f"{project}_poller_fingerprint.json"
+
+
+def response_fingerprint(gql_result):
+    """Content hash of a normalized GraphQL response and the settings used to process it"""
+    settings = [CHECK_ALL_VERSIONS, VERSION_WINDOW, VERSION_MAX_AGE_DAYS]
+    if VERSION_MAX_AGE_DAYS > 0:
+        # Versions age out of the window without the response changing
+        settings.append(dt.now(timezone.utc).date().isoformat())
+    normalized = json.dumps(
+        [settings, gql_result], sort_keys=True, separators=(",", ":"), default=str
+    )
+    return hashlib.sha256(normalized.encode()).hexdigest()
+
+
+def load_fingerprint(project):
+    try:
+        with open(fingerprint_path(project), "r") as f:
+            return json.load(f).get("fingerprint")
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def save_fingerprint(project, fingerprint):
+    write_json_atomically(fingerprint_path(project), {"fingerprint": fingerprint})
+
+
+class ProjectState:
+    """In-memory view of the stored state of one project
+
+    The state is loaded from the backend once on construction, every lookup is
+    answered from memory and changes are only written back by flush().
+    """
+
+    def __init__(self, project, backend=None):
+        self.project = project
+        self.backend = backend or get_state_backend()
+        with state_io_seconds.time(project=project, operation="load"), profile_phase("state"):
+            self.data = self.backend.load(project)
+        self.changed_versions = set()
+        self.replaced = False
+        self.archived = {}
+
+    @property
+    def dirty(self) -> bool:
+        return self.replaced or bool(self.changed_versions)
+
+    def has_versions(self) -> bool:
+        return "versions" in self.data
+
+    def latest(self):
+        """The legacy single version record"""
+        return {
+            "version": self.data.get("version", ""),
+            "build": self.data.get("build", ""),
+            "channel": self.data.get("channel", None),
+        }
+
+    def version(self, version):
+        """The stored record of one version, empty if it was never seen"""
+        if not self.has_versions():
+            # Legacy format only knows about a single version
+            if self.data.get("version") == version:
+                return {
+                    "build": self.data.get("build", ""),
+                    "channel": self.data.get("channel", None),
+                }
+            return {"build": "", "channel": None}
+        return self.data["versions"].get(version, {"build": "", "channel": None})
+
+    def set_latest(self, version, build, channel_name):
+        self.data = {"version": version, "build": build, "channel": channel_name}
+        self.replaced = True
+
+    def set_version(self, version, build, channel_name):
+        if not self.has_versions():
+            self.data = {"versions": {}}
+            self.replaced = True
+        self.data["versions"][version] = {"build": build, "channel": channel_name}
+        self.changed_versions.add(version)
+
+        # Keep legacy format for latest version for backward compatibility
+        self.data["version"] = version
+        self.data["build"] = build
+        self.data["channel"] = channel_name
+
+    def archive(self, versions):
+        """Drop versions from the hot state, they are written to the archive on flush"""
+        for version in versions:
+            record = self.data.get("versions", {}).pop(version, None)
+            if record is not None:
+                self.archived[version] = record
+                self.changed_versions.add(version)
+
+    def flush(self):
+        if not self.dirty:
+            return
+        with state_io_seconds.time(project=self.project, operation="save"), profile_phase("state"):
+            if self.archived:
+                # Archive first, so a crash in between leaves a duplicate rather than a loss
+                archive_versions(self.project, self.archived)
+            self.backend.save(self.project, self.data, self.changed_versions, self.replaced)
+        self.changed_versions = set()
+        self.replaced = False
+        self.archived = {}
+
+
+class PayloadRenderer:
+    """Renders the update messages of one project
+
+    The components every message of the project shares are built once, and each
+    build's message is encoded once and then reused for every webhook URL.
+    """
+
+    def __init__(self, project, image_url, cache_size=32):
+        self.project = project
+        self.image_url = image_url
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        # Skeleton shared by every message, never mutated once built
+        self.title = {"type": 10, "content": f"# {project.capitalize()} Update"}
+        self.accessory = self._accessory(image_url)
+        self.divider = {"type": 14, "divider": True}
+
+    @staticmethod
+    def _accessory(image_url):
+        return {"type": 11, "media": {"url": image_url}}
+
+    def build(
+        self,
+        latest_build,
+        latest_version,
+        build_time,
+        image_url,
+        changes,
+        download_url,
+        channel_name,
+        channel_changed,
+        missed_builds=None,
+    ):
+        headline = update_headline(channel_name, latest_build, latest_version, missed_builds)
+        accessory = self.accessory if image_url == self.image_url else self._accessory(image_url)
+        payload = {
+            "components": [
+                {
+                    "type": 17,
+                    "accent_color": CHANNEL_COLORS[channel_name.upper()],
+                    "components": [
+                        {
+                            "type": 9,
+                            "components": [
+                                self.title,
+                                {
+                                    "type": 10,
+                                    "content": f"{headline}\nReleased <t:{build_time}:R> (<t:{build_time}:f>)",
+                                },
+                            ],
+                            "accessory": accessory,
+                        },
+                        self.divider,
+                        {"type": 10, "content": changes},
+                    ],
+                },
+                {
+                    "type": 1,
+                    "components": [
+                        {
+                            "type": 2,
+                            "label": "Download",
+                            "style": 5,
+                            "url": download_url,
+                        }
+                    ],
+                },
+            ],
+            "flags": 1 << 15,
+            "allowed_mentions": {"parse": []},
+        }
+        # If the channel changed, add another container to the components
+        if channel_changed:
+            changed_container = {
+                "type": 10,
+                "content": f"# {self.project.capitalize()} is now {channel_name}!",
+            }
+            payload["components"].append(changed_container)
+        return payload
+
+    def render(
+        self,
+        latest_build,
+        latest_version,
+        build_time,
+        image_url,
+        changes,
+        download_url,
+        channel_name,
+        channel_changed,
+        missed_builds=None,
+    ) -> bytes:
+        """The encoded payload of a message, built on the first call only"""
+        message = (
+            latest_build,
+            latest_version,
+            build_time,
+            image_url,
+            changes,
+            download_url,
+            channel_name,
+            channel_changed,
+            tuple(missed_builds or ()),
+        )
+        with self._lock:
+            encoded = self._cache.get(message)
+            if encoded is not None:
+                self._cache.move_to_end(message)
+                return encoded
+        encoded = encode_payload(self.build(*message))
+        with self._lock:
+            self._cache[message] = encoded
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return encoded
+
+
+class PaperAPI:
+    def __init__(self, base_url="https://api.papermc.io/v2", project="paper", image_url=None):
+        self.headers = {
+            "User-Agent": "PaperMC Version Poller",
+            "Cache-Control": "no-cache",
+            "Pragma": "no-cache",
+        }
+        self.base_url = base_url
+        self.project = project
+        # Warm GraphQL session shared by the daemon, None to connect per query
+        self.session = None
+        # State loaded by state_session(), None outside of a run
+        self._state = None
+        # A daemon holding the lock keeps the state in memory between runs
+        self.keep_state = False
+        self._kept_state = None
+        # None uses the backend configured by PAPER_POLLER_STATE_BACKEND
+        self.state_backend = None
+        # Fingerprint of the last fully processed response, None until read from disk
+        self.last_fingerprint = None
+        # Latest build time of every version in the last poll, for adaptive polling
+        self.observed_builds = {}
+        if image_url is None:
+            # Projects without a registry entry get no logo
+            config = DEFAULT_PROJECTS.get(project)
+            image_url = config.image_url if config else ""
+        self.image_url = image_url
+        self.renderer = PayloadRenderer(self.project, self.image_url)
+
+    @contextmanager
+    def state_session(self):
+        """Load the state once, answer every lookup from memory and write it once at the end"""
+        if self._state is not None:
+            yield self._state
+            return
+        self._state = self._kept_state or ProjectState(self.project, self.state_backend)
+        try:
+            yield self._state
+        finally:
+            state, self._state = self._state, None
+            if self.keep_state:
+                # Unsaved changes stay dirty and are written by the next run
+                self._kept_state = state
+            # Also runs on errors, so finished updates are never announced twice
+            state.flush()
+
+    @asynccontextmanager
+    async def state_session_async(self):
+        """state_session() for async runs, loading and flushing off the event loop"""
+        import asyncio
+
+        if self._state is not None:
+            yield self._state
+            return
+        self._state = self._kept_state or await asyncio.to_thread(
+            ProjectState, self.project, self.state_backend
+        )
+        try:
+            yield self._state
+        finally:
+            state, self._state = self._state, None
+            if self.keep_state:
+                self._kept_state = state
+            await asyncio.to_thread(state.flush)
+
+    def _load_state(self):
+        # Outside of a state session every call reads the file, like before
+        if self._state is not None:
+            return self._state
+        return ProjectState(self.project, self.state_backend)
+
+    def _save_state(self, state):
+        if state is not self._state:
+            state.flush()
+
+    @profiled("state")
+    def up_to_date(self, version, build) -> bool:
+        latest = self._load_state().latest()
+        return latest["version"] == version and latest["build"] == build
+
+    @profiled("state")
+    def up_to_date_for_version(self, version, build) -> bool:
+        state = self._load_state()
+        if not state.has_versions() and "build" not in state.data:
+            return False
+        return state.version(version).get("build") == build
+
+    @profiled("state")
+    def get_stored_data(self):
+        state = self._load_state()
+        if not state.data:
+            return {"version": "", "build": "", "channel": ""}
+        return state.data
+
+    @profiled("state")
+    def get_stored_data_for_version(self, version):
+        return self._load_state().version(version)
+
+    @profiled("state")
+    def write_to_json(self, version, build, channel_name):
+        state = self._load_state()
+        state.set_latest(version, build, channel_name)
+        self._save_state(state)
+
+    @profiled("state")
+    def write_version_to_json(self, version, build, channel_name):
+        state = self._load_state()
+        state.set_version(version, build, channel_name)
+        self._save_state(state)
+
+    @profiled("changelog")
+    def get_changes_for_build(self, data) -> str:
+        return render_changelog(self.project, data["commits"])
+
+    @profiled("graphql")
+    def get_latest_build(self, probe=False):
+        query = select_query(probe=probe)
+        variables = {"project": self.project}
+        result = execute_query(self.session, query, variables)
+        return result
+
+    @profiled("graphql")
+    def get_all_versions(self, probe=False):
+        if version_window_enabled():
+            return self.get_version_window(probe=probe)
+        query = select_query(all_versions=True, probe=probe)
+        variables = {"project": self.project}
+        result = execute_query(self.session, query, variables)
+        return result
+
+    @profiled("graphql")
+    def get_versions_page(self, last, probe=False):
+        query = select_query(all_versions=True, paged=True, probe=probe)
+        variables = {"project": self.project, "last": last}
+        result = execute_query(self.session, query, variables)
+        return result
+
+    def get_version_window(self, gql_result=None, probe=False):
+        """Page through versions newest-first until the tracked window is covered
+
+        gql_result is an already fetched first page, e.g. from a batched query.
+        """
+        last = version_window_first_page()
+        if gql_result is None:
+            gql_result = self.get_versions_page(last, probe)
+        while not version_window_covered(gql_result["project"]["versions"], last):
+            last = version_window_next_page(last)
+            gql_result = self.get_versions_page(last, probe)
+        return gql_result
+
+    @profiled("graphql")
+    def get_missed_builds(self, version_id, last):
+        query = lazy("missed_builds_query")
+        variables = {"project": self.project, "version": version_id, "last": last}
+        result = execute_query(self.session, query, variables)
+        return (result["project"].get("version") or {}).get("builds", [])
+
+    def catch_up(self, version_id, build_info, stored_build):
+        """Merge the commits of builds released since stored_build into build_info
+
+        The newest build's commits come first. If the missed builds can't be fetched,
+        only the latest build is announced.
+        """
+        last = missed_build_count(stored_build, build_info["id"])
+        if last == 0:
+            return build_info
+        try:
+            builds = self.get_missed_builds(version_id, last)
+        except DeadlineExceeded:
+            # Leave the whole version for the next run instead of announcing less
+            raise
+        except Exception as e:
+            print(f"Could not fetch missed {self.project} {version_id} builds: {e}")
+            return build_info
+
+        missed = sorted(
+            (
+                build
+                for build in builds
+                if int(stored_build) < int(build["id"]) < int(build_info["id"])
+            ),
+            key=lambda build: int(build["id"]),
+            reverse=True,
+        )
+        if not missed:
+            return build_info
+
+        merged = dict(build_info)
+        merged["commits"] = list(build_info["commits"])
+        for build in missed:
+            merged["commits"].extend(build["commits"])
+        merged["missed_builds"] = [build["id"] for build in reversed(missed)]
+        return merged
+
+    @profiled("graphql")
+    def get_build_details(self, version_ids):
+        query, variables = build_details_query(self.project, version_ids)
+        result = execute_query(self.session, query, variables)
+        return split_details_result(result, version_ids)
+
+    @profiled_async("graphql")
+    async def get_latest_build_async(self, session, probe=False):
+        query = select_query(probe=probe)
+        variables = {"project": self.project}
+        result = await execute_query_async(session, query, variables)
+        return result
+
+    @profiled_async("graphql")
+    async def get_all_versions_async(self, session, probe=False):
+        if version_window_enabled():
+            return await self.get_version_window_async(session, probe=probe)
+        query = select_query(all_versions=True, probe=probe)
+        variables = {"project": self.project}
+        result = await execute_query_async(session, query, variables)
+        return result
+
+    @profiled_async("graphql")
+    async def get_versions_page_async(self, session, last, probe=False):
+        query = select_query(all_versions=True, paged=True, probe=probe)
+        variables = {"project": self.project, "last": last}
+        result = await execute_query_async(session, query, variables)
+        return result
+
+    async def get_version_window_async(self, session, gql_result=None, probe=False):
+        last = version_window_first_page()
+        if gql_result is None:
+            gql_result = await self.get_versions_page_async(session, last, probe)
+        while not version_window_covered(gql_result["project"]["versions"], last):
+            last = version_window_next_page(last)
+            gql_result = await self.get_versions_page_async(session, last, probe)
+        return gql_result
+
+    @profiled_async("graphql")
+    async def get_build_details_async(self, session, version_ids):
+        query, variables = build_details_query(self.project, version_ids)
+        result = await execute_query_async(session, query, variables)
+        return split_details_result(result, version_ids)
+
+    def versions_needing_details(self, gql_result):
+        """Versions of a probe result whose latest build is not stored yet"""
+        versions = gql_result["project"]["versions"]
+        if CHECK_ALL_VERSIONS:
+            if version_window_enabled():
+                versions = filter_version_window(versions)
+            is_up_to_date = self.up_to_date_for_version
+        else:
+            # Single version mode only looks at the first version
+            versions = versions[:1]
+            is_up_to_date = self.up_to_date
+
+        changed = []
+        for version_data in versions:
+            builds = version_data.get("builds") or []
+            # Nothing to announce, or the full details were fetched already
+            if not builds or "download" in builds[0]:
+                continue
+            if not is_up_to_date(version_data["id"], builds[0]["id"]):
+                changed.append(version_data["id"])
+        return changed
+
+    def complete_probe(self, gql_result):
+        """Second phase of a two-phase poll: fetch details only for new builds
+
+        Returns the result and whether every new build got its details.
+        """
+        try:
+            changed = self.versions_needing_details(gql_result)
+        except KeyError:
+            # Leave the error to the run mode, which reports it
+            return gql_result, True
+        if not changed:
+            log_short_circuit(self.project, "build details", "probe found no new builds")
+            return gql_result, True
+        return self._merge_details(gql_result, self.get_build_details(changed))
+
+    async def complete_probe_async(self, session, gql_result):
+        import asyncio
+
+        try:
+            changed = await asyncio.to_thread(self.versions_needing_details, gql_result)
+        except KeyError:
+            return gql_result, True
+        if not changed:
+            log_short_circuit(self.project, "build details", "probe found no new builds")
+            return gql_result, True
+        details = await self.get_build_details_async(session, changed)
+        return self._merge_details(gql_result, details)
 
+    def _merge_details(self, gql_result, details):
+        missing = [version_id for version_id, version in details.items() if version is None]
+        if missing:
+            print(f"No build details for {self.project} {', '.join(missing)} yet. ", end="")
+        return merge_build_details(gql_result, details), not missing
+
+    @profiled("webhook")
     def send_v2_webhook(
         self,
         hook_url,
@@ -301,31 +2919,99 @@ class PaperAPI:
         download_url,
         channel_name,
         channel_changed,
+        missed_builds=None,
     ):
-        payload = {
+        payload = self.renderer.render(
+            latest_build=latest_build,
+            latest_version=latest_version,
+            build_time=build_time,
+            image_url=image_url,
+            changes=changes,
+            download_url=download_url,
+            channel_name=channel_name,
+            channel_changed=channel_changed,
+            missed_builds=missed_builds,
+        )
+        # Then do a post to the webhook with ?with_components=true
+        return get_webhook_dispatcher().post(hook_url, payload)
+
+    def _process_and_send_update(self, version_id, build_info, channel_changed):
+        """Process a build and send webhook updates for it
+
+        Returns one WebhookResult per configured webhook URL.
+        """
+        build_id = build_info["id"]
+        channel_name = build_info["channel"]
+        missed_builds = build_info.get("missed_builds")
+
+        if DRY_RUN:
+            if missed_builds:
+                builds = f"Builds {missed_builds[0]} to {build_id}"
+            else:
+                builds = f"Build {build_id}"
+            print(
+                f"[DRY RUN] New build for {self.project} {version_id}. Would send update ({builds})."
+            )
+            return []
+
+        print(f"New build for {self.project} {version_id}. Sending update.")
+        updates_total.inc(project=self.project)
+
+        # Process build information
+        changes = truncate_changes(self.get_changes_for_build(build_info))
+        download_url = build_info["download"]["url"]
+        build_time = int(convert_build_date(build_info["time"]).timestamp())
+
+        message = {
+            "latest_build": build_id,
+            "latest_version": version_id,
+            "build_time": build_time,
+            "image_url": self.image_url,
+            "changes": changes,
+            "download_url": download_url,
+            "channel_name": channel_name.capitalize(),
+            "channel_changed": channel_changed,
+            "missed_builds": missed_builds,
+        }
+        # Render once up front, every URL then reuses the encoded message
+        self.renderer.render(**message)
+
+        # Send webhook to all configured URLs in parallel
+        def send(hook):
+            return self.send_v2_webhook(hook_url=hook, **message)
+
+        results = get_webhook_dispatcher().map(send, lazy("webhook_urls"))
+        self._log_failed_deliveries(results)
+        return results
+
+    @staticmethod
+    def _log_failed_deliveries(results):
+        for result in results:
+            if isinstance(result, WebhookResult) and not result.ok:
+                print(
+                    f"Webhook delivery failed for {describe_webhook_url(result.url)}: "
+                    f"{result.error or result.status_code}"
+                )
+
+    def build_version_container(self, version_id, build_info, channel_changed):
+        """One container of a coalesced update, announcing a single version"""
+        channel_name = build_info["channel"].capitalize()
+        build_time = int(convert_build_date(build_info["time"]).timestamp())
+        headline = update_headline(
+            channel_name, build_info["id"], version_id, build_info.get("missed_builds")
+        )
+        if channel_changed:
+            headline += f"\n**{version_id} is now {channel_name}!**"
+        changes = truncate_changes(self.get_changes_for_build(build_info))
+        return {
+            "type": 17,
+            "accent_color": CHANNEL_COLORS[channel_name.upper()],
             "components": [
                 {
-                    "type": 17,
-                    "accent_color": CHANNEL_COLORS[channel_name.upper()],
-                    "components": [
-                        {
-                            "type": 9,
-                            "components": [
-                                {
-                                    "type": 10,
-                                    "content": f"# {self.project.capitalize()} Update",
-                                },
-                                {
-                                    "type": 10,
-                                    "content": f"{channel_name} Build {latest_build} for {latest_version} is now available!\nReleased <t:{build_time}:R> (<t:{build_time}:f>)",
-                                },
-                            ],
-                            "accessory": {"type": 11, "media": {"url": image_url}},
-                        },
-                        {"type": 14, "divider": True},
-                        {"type": 10, "content": changes},
-                    ],
+                    "type": 10,
+                    "content": f"## {version_id}\n{headline}\nReleased <t:{build_time}:R> (<t:{build_time}:f>)",
                 },
+                {"type": 10, "content": changes or "No changes"},
                 {
                     "type": 1,
                     "components": [
@@ -333,60 +3019,79 @@ class PaperAPI:
                             "type": 2,
                             "label": "Download",
                             "style": 5,
-                            "url": download_url,
+                            "url": build_info["download"]["url"],
                         }
                     ],
                 },
             ],
-            "flags": 1 << 15,
-            "allowed_mentions": {"parse": []},
         }
-        # If the channel changed, add another container to the components
-        if channel_changed:
-            changed_container = {
-                "type": 10,
-                "content": f"# {self.project.capitalize()} is now {channel_name}!",
+
+    def build_coalesced_payloads(self, updates):
+        """Encoded payloads announcing every (version_id, build_info, channel_changed) in updates"""
+        header = [
+            {
+                "type": 9,
+                "components": [
+                    {"type": 10, "content": f"# {self.project.capitalize()} Update"},
+                    {"type": 10, "content": f"{len(updates)} versions have new builds"},
+                ],
+                "accessory": self.renderer.accessory,
             }
-            payload["components"].append(changed_container)
-        # Then do a post to the webhook with ?with_components=true
-        requests.post(hook_url, json=payload, params={"with_components": "true"})
+        ]
+        blocks = [self.build_version_container(*update) for update in updates]
+        return [
+            encode_payload(
+                {
+                    "components": components,
+                    "flags": 1 << 15,
+                    "allowed_mentions": {"parse": []},
+                }
+            )
+            for components in pack_components(header, blocks)
+        ]
 
-    def _process_and_send_update(self, version_id, build_info, channel_changed):
-        """Process a build and send webhook updates for it"""
-        build_id = build_info["id"]
-        channel_name = build_info["channel"]
+    def _send_coalesced_updates(self, updates):
+        """Announce every changed version of this run together
+
+        Returns one WebhookResult per message and webhook URL.
+        """
+        if len(updates) == 1:
+            return self._process_and_send_update(*updates[0])
 
+        payloads = self.build_coalesced_payloads(updates)
         if DRY_RUN:
             print(
-                f"[DRY RUN] New build for {self.project} {version_id}. Would send update (Build {build_id})."
+                f"[DRY RUN] {len(updates)} new builds for {self.project}. "
+                f"Would send {len(payloads)} messages."
             )
-            return
+            return []
 
-        print(f"New build for {self.project} {version_id}. Sending update.")
+        print(f"{len(updates)} new builds for {self.project}. Sending {len(payloads)} messages.")
+        updates_total.inc(len(updates), project=self.project)
+        dispatcher = get_webhook_dispatcher()
 
-        # Process build information
-        changes = self.get_changes_for_build(build_info)
-        download_url = build_info["download"]["url"]
-        build_time = int(convert_build_date(build_info["time"]).timestamp())
+        # Messages to one webhook go out in order, webhooks are still sent to in parallel
+        def send(hook):
+            return [dispatcher.post(hook, payload) for payload in payloads]
 
-        # Send webhook to all configured URLs
-        for hook in webhook_urls:
-            self.send_v2_webhook(
-                hook_url=hook,
-                latest_build=build_id,
-                latest_version=version_id,
-                build_time=build_time,
-                image_url=self.image_url,
-                changes=changes,
-                download_url=download_url,
-                channel_name=channel_name.capitalize(),
-                channel_changed=channel_changed,
-            )
+        results = []
+        for hook_results in dispatcher.map(send, lazy("webhook_urls")):
+            if isinstance(hook_results, list):
+                results.extend(hook_results)
+            else:
+                results.append(hook_results)
+        self._log_failed_deliveries(results)
+        return results
 
     def _check_version_for_update(
-        self, version_id, build_info, use_legacy_storage=False
+        self, version_id, build_info, use_legacy_storage=False, pending=None
     ):
-        """Check if a version needs an update and process it if so"""
+        """Check if a version needs an update and process it if so
+
+        With a pending list, the update is collected there instead of being sent.
+        Once the run deadline passed, DeadlineExceeded is raised before the build
+        is stored, so every stored build is also sent.
+        """
         build_id = build_info["id"]
         channel_name = build_info["channel"]
 
@@ -400,6 +3105,9 @@ class PaperAPI:
             )
 
             if not updated:
+                if stored_data.get("version") == version_id:
+                    build_info = self.catch_up(version_id, build_info, stored_data.get("build"))
+                run_deadline.check(f"announcing {self.project} {version_id}")
                 self.write_to_json(version_id, build_id, channel_name)
                 self._process_and_send_update(version_id, build_info, channel_changed)
                 return True
@@ -413,85 +3121,859 @@ class PaperAPI:
             )
 
             if not updated:
+                build_info = self.catch_up(
+                    version_id, build_info, stored_version_data.get("build")
+                )
+                run_deadline.check(f"announcing {self.project} {version_id}")
                 self.write_version_to_json(version_id, build_id, channel_name)
-                self._process_and_send_update(version_id, build_info, channel_changed)
+                if pending is not None:
+                    pending.append((version_id, build_info, channel_changed))
+                else:
+                    self._process_and_send_update(version_id, build_info, channel_changed)
                 return True
 
         return False
 
-    def run(self):
+    def run(self, gql_result=None):
         current_time = dt.now()
         print(f"[{current_time}] ", end="")
 
+        try:
+            gql_result = self._fetch_poll_result(gql_result)
+        except KeyError as e:
+            print(f"Error getting versions: {e}")
+            return
+        self.observe_builds(gql_result)
+
+        fingerprint = self._new_fingerprint(gql_result)
+        if fingerprint is None:
+            return
+
+        complete = True
+        with self.state_session():
+            if TWO_PHASE_POLL:
+                gql_result, complete = self.complete_probe(gql_result)
+            processed = self._run_mode(gql_result)
+
+        # Builds left out for missing details must not be skipped by the next poll
+        if processed and complete:
+            self._remember_fingerprint(fingerprint)
+
+    def observe_builds(self, gql_result):
+        """Remember the latest build time of every version in a poll result"""
+        observed = {}
+        for version_data in (gql_result.get("project") or {}).get("versions", []):
+            builds = version_data.get("builds") or []
+            if builds and builds[-1].get("time"):
+                observed[version_data["id"]] = builds[-1]["time"]
+        self.observed_builds = observed
+
+    def _fetch_poll_result(self, gql_result=None):
+        """Fetch the result for this run, gql_result is an already fetched (batched) result"""
         if CHECK_ALL_VERSIONS:
-            self._run_multi_version_mode()
-        else:
-            self._run_single_version_mode()
+            if gql_result is None:
+                return self.get_all_versions(probe=TWO_PHASE_POLL)
+            if version_window_enabled():
+                # A batched fetch only holds the first page of versions
+                return self.get_version_window(gql_result, probe=TWO_PHASE_POLL)
+            return gql_result
+        if gql_result is None:
+            return self.get_latest_build(probe=TWO_PHASE_POLL)
+        return gql_result
 
-    def _run_single_version_mode(self):
-        """Original behavior: check only the latest version"""
-        try:
-            gql_latest_build = self.get_latest_build()
-            latest_version = gql_latest_build["project"]["versions"][0]["id"]
-            latest_build_info = gql_latest_build["project"]["versions"][0]["builds"][0]
+    async def _fetch_poll_result_async(self, session, gql_result=None):
+        if CHECK_ALL_VERSIONS:
+            if gql_result is None:
+                return await self.get_all_versions_async(session, probe=TWO_PHASE_POLL)
+            if version_window_enabled():
+                return await self.get_version_window_async(
+                    session, gql_result, probe=TWO_PHASE_POLL
+                )
+            return gql_result
+        if gql_result is None:
+            return await self.get_latest_build_async(session, probe=TWO_PHASE_POLL)
+        return gql_result
 
-            # Check and process update using extracted function
-            update_sent = self._check_version_for_update(
-                latest_version, latest_build_info, use_legacy_storage=True
-            )
+    def _new_fingerprint(self, gql_result):
+        """Fingerprint of gql_result, None when it matches the last processed response
+
+        With fingerprinting disabled this returns an empty string, so runs go ahead.
+        """
+        if not FINGERPRINT_RESPONSES:
+            return ""
+        fingerprint = response_fingerprint(gql_result)
+        if self.last_fingerprint is None:
+            self.last_fingerprint = load_fingerprint(self.project)
+        if fingerprint == self.last_fingerprint:
+            log_short_circuit(self.project, "run", "response unchanged since the last poll")
+            return None
+        return fingerprint
 
-            if not update_sent:
-                print(f"Up to date for {self.project}")
+    def _remember_fingerprint(self, fingerprint):
+        if fingerprint and fingerprint != self.last_fingerprint:
+            save_fingerprint(self.project, fingerprint)
+            self.last_fingerprint = fingerprint
 
+    def _run_mode(self, gql_result):
+        if CHECK_ALL_VERSIONS:
+            return self._run_multi_version_mode(gql_result)
+        return self._run_single_version_mode(gql_result)
+
+    async def run_async(self, session, gql_result=None):
+        """Fetch this project over a shared async GraphQL session, then process it"""
+        import asyncio
+
+        try:
+            gql_result = await self._fetch_poll_result_async(session, gql_result)
         except KeyError as e:
-            print(f"Error getting latest build: {e}")
+            print(f"Error getting versions: {e}")
+            return
+        self.observe_builds(gql_result)
+
+        fingerprint = self._new_fingerprint(gql_result)
+        if fingerprint is None:
             return
+
+        complete = True
+        async with self.state_session_async():
+            if TWO_PHASE_POLL:
+                gql_result, complete = await self.complete_probe_async(session, gql_result)
+            # State files and webhooks are blocking I/O, keep them off the event loop
+            processed = await asyncio.to_thread(self._run_mode, gql_result)
+
+        if processed and complete:
+            await asyncio.to_thread(self._remember_fingerprint, fingerprint)
+
+    def _archive_versions_outside(self, window_versions):
+        """Move stored versions that left the tracked window to the archive file"""
+        state = self._load_state()
+        window_ids = {version_data["id"] for version_data in window_versions}
+        stale = [v for v in state.data.get("versions", {}) if v not in window_ids]
+        if stale:
+            state.archive(stale)
+            self._save_state(state)
+            print(f"Archived {len(stale)} {self.project} versions outside the window. ", end="")
+
+    def _run_single_version_mode(self, gql_latest_build=None):
+        """Original behavior: check only the latest version
+
+        Returns whether the result could be processed.
+        """
+        with self.state_session():
+            try:
+                if gql_latest_build is None:
+                    gql_latest_build = self.get_latest_build()
+                latest_version = gql_latest_build["project"]["versions"][0]["id"]
+                latest_build_info = gql_latest_build["project"]["versions"][0]["builds"][0]
+
+                # Check and process update using extracted function
+                update_sent = self._check_version_for_update(
+                    latest_version, latest_build_info, use_legacy_storage=True
+                )
+
+                if not update_sent:
+                    print(f"Up to date for {self.project}")
+
+            except KeyError as e:
+                print(f"Error getting latest build: {e}")
+                return False
+        return True
+
+    def _run_multi_version_mode(self, gql_all_versions=None):
+        """New behavior: check all versions for updates
+
+        Returns whether the result could be processed.
+        """
+        with self.state_session():
+            try:
+                # Get all versions to check for updates
+                if gql_all_versions is None:
+                    gql_all_versions = self.get_all_versions()
+                all_versions = gql_all_versions["project"]["versions"]
+                if version_window_enabled():
+                    all_versions = filter_version_window(all_versions)
+                    self._archive_versions_outside(all_versions)
+
+                updates_sent = 0
+                cut_short = False
+                # With COALESCE_UPDATES every update of this run goes out together
+                pending = [] if COALESCE_UPDATES else None
+
+                # Check each version for updates
+                for version_data in all_versions:
+                    version_id = version_data["id"]
+                    builds = version_data.get("builds", [])
+                    try:
+                        run_deadline.check(f"checking {self.project} {version_id}")
+
+                        # Skip versions with no builds
+                        if not builds:
+                            continue
+
+                        build_info = builds[0]
+
+                        # Check and process update using extracted function
+                        if self._check_version_for_update(
+                            version_id, build_info, use_legacy_storage=False, pending=pending
+                        ):
+                            updates_sent += 1
+                    except DeadlineExceeded:
+                        # What was checked so far is saved when the state session ends, and
+                        # the updates stored so far are still sent below
+                        print(f"Run deadline passed, leaving other {self.project} versions. ", end="")
+                        run_deadline.skip(self)
+                        cut_short = True
+                        break
+
+                if pending:
+                    self._send_coalesced_updates(pending)
+
+                if updates_sent == 0:
+                    print(f"Up to date for all {self.project} versions")
+                else:
+                    print(f"Sent {updates_sent} updates for {self.project}")
+
+            except KeyError as e:
+                print(f"Error getting versions: {e}")
+                return False
+        # A run cut short must not remember the response, or the rest would be skipped
+        return not cut_short
+
+
+def _async_client():
+    import aiohttp
+
+    session_args = {
+        "timeout": aiohttp.ClientTimeout(sock_connect=CONNECT_TIMEOUT, sock_read=READ_TIMEOUT)
+    }
+    if PERSISTED_QUERIES:
+        async_transport = lazy("AsyncPersistedQueryTransport")(
+            url=gql_base, client_session_args=session_args
+        )
+    else:
+        async_transport = lazy("AIOHTTPTransport")(url=gql_base, client_session_args=session_args)
+    return lazy("SchemaCacheClient")(transport=async_transport, refresh=REFRESH_SCHEMA)
+
+
+async def run_projects_async(projects, session=None):
+    """Poll every project at the same time over one shared async GraphQL transport"""
+    import asyncio
+
+    if session is None:
+        async with _async_client() as session:
+            return await run_projects_async(projects, session)
+
+    print(f"[{dt.now()}] Polling {len(projects)} projects concurrently")
+    with timed_cycle():
+        batched_results = {}
+        if BATCH_QUERIES and projects:
+            try:
+                project_ids = [project.project for project in projects]
+                query, variables = build_poll_query(project_ids)
+                result = await execute_query_async(session, query, variables)
+                batched_results = split_batched_result(result, project_ids)
+            except Exception as e:
+                print(f"Batched query failed, fetching projects one by one: {e}")
+
+        results = await asyncio.gather(
+            *(
+                project.run_async(session, batched_results.get(project.project))
+                for project in projects
+            ),
+            return_exceptions=True,
+        )
+
+    # One failing project must not hide the results of the others
+    for project, result in zip(projects, results):
+        if isinstance(result, DeadlineExceeded):
+            run_deadline.skip(project)
+            print(f"{result}, leaving {project.project} for the next run")
+        elif isinstance(result, Exception):
+            errors_total.inc(stage="cycle")
+            print(f"Error polling {project.project}: {result}")
+
+
+def run_projects(projects, session=None):
+    """Poll every project one after another, sharing a single batched fetch"""
+    with timed_cycle():
+        batched_results = {}
+        if BATCH_QUERIES and projects:
+            try:
+                batched_results = fetch_projects(projects, session)
+            except Exception as e:
+                print(f"Batched query failed, fetching projects one by one: {e}")
+
+        for project in projects:
+            if run_deadline.expired():
+                run_deadline.skip(project)
+                print(f"Run deadline passed, leaving {project.project} for the next run")
+                continue
+            project.session = session
+            try:
+                project.run(batched_results.get(project.project))
+            except DeadlineExceeded as e:
+                run_deadline.skip(project)
+                print(f"{e}, leaving {project.project} for the next run")
+            except Exception as e:
+                # One failing project must not keep the others from being polled
+                errors_total.inc(stage="cycle")
+                print(f"Error polling {project.project}: {e}")
+
+
+class ProjectConfig(NamedTuple):
+    id: str
+    enabled: bool = True
+    # Seconds between polls, 0 polls the project on every run
+    interval: float = 0.0
+    # Projects with a higher priority are polled first
+    priority: int = 0
+    image_url: str = ""
+
+
+DEFAULT_PROJECTS = {
+    "paper": ProjectConfig(
+        "paper", priority=30, image_url="https://assets.papermc.io/brand/papermc_logo.512.png"
+    ),
+    "folia": ProjectConfig(
+        "folia", priority=20, image_url="https://assets.papermc.io/brand/folia_logo.256x139.png"
+    ),
+    "velocity": ProjectConfig(
+        "velocity",
+        priority=20,
+        image_url="https://assets.papermc.io/brand/velocity_logo.256x128.png",
+    ),
+    # End of life, new builds are rare
+    "waterfall": ProjectConfig("waterfall", interval=6 * 3600),
+}
+
+
+def _project_config(project_id, settings, base):
+    unknown = set(settings) - set(ProjectConfig._fields) - {"id"}
+    if unknown:
+        raise ValueError(f"Unknown settings for project {project_id!r}: {', '.join(sorted(unknown))}")
+    merged = {**base._asdict(), **settings}
+    return ProjectConfig(
+        id=project_id,
+        enabled=bool(merged["enabled"]),
+        interval=float(merged["interval"]),
+        priority=int(merged["priority"]),
+        image_url=str(merged["image_url"]),
+    )
+
+
+def load_project_config():
+    """Read the registry config from the PAPER_POLLER_PROJECTS env or the projects file"""
+    if os.getenv("PAPER_POLLER_PROJECTS"):
+        return json.loads(os.getenv("PAPER_POLLER_PROJECTS"))
+    if os.path.exists(PROJECTS_FILE):
+        with open(PROJECTS_FILE, "r") as f:
+            return json.load(f)
+    return {}
+
+
+class ProjectRegistry:
+    """The projects to poll, from the built-in defaults, the config and discovery
+
+    Entries under "projects" in the config change the built-in projects or add new
+    ones. Settings under "defaults" apply to added and discovered projects. With
+    "discover": true, every project the GraphQL API lists is polled too.
+    """
+
+    def __init__(self, config=None):
+        config = load_project_config() if config is None else config
+        self.defaults = _project_config("", config.get("defaults", {}), ProjectConfig(""))
+        self.discover = bool(config.get("discover", False))
+        self.projects = dict(DEFAULT_PROJECTS)
+        for project_id, settings in config.get("projects", {}).items():
+            base = self.projects.get(project_id) or self.defaults
+            self.projects[project_id] = _project_config(project_id, settings, base)
+
+    def discover_projects(self, session=None):
+        """Add the projects the GraphQL API knows about that are not configured yet"""
+        result = execute_query(session, lazy("projects_query"), {})
+        added = []
+        for project in result["projects"]:
+            if project["id"] not in self.projects:
+                self.projects[project["id"]] = self.defaults._replace(id=project["id"])
+                added.append(project["id"])
+        return added
+
+    def enabled(self):
+        """Enabled projects, highest priority first"""
+        configs = [config for config in self.projects.values() if config.enabled]
+        return sorted(configs, key=lambda config: (-config.priority, config.id))
+
+    def create_projects(self):
+        return [
+            PaperAPI(project=config.id, image_url=config.image_url) for config in self.enabled()
+        ]
+
+
+class AdaptiveCadence:
+    """Picks the next poll interval of a project from the times of its past builds
+
+    Every poll without a new build doubles the interval, starting again from the
+    minimum after a build. The interval never exceeds a quarter of the median gap
+    between builds of the project's busiest version, and is halved in the hours of
+    the day (UTC) in which the project ships half again as often as on average.
+    """
+
+    history_size = 50
+    active_divisor = 8
+    min_gaps = 3
+    min_builds_for_hours = 10
+
+    def __init__(self, min_interval=None, max_interval=None):
+        self.min_interval = ADAPTIVE_MIN_INTERVAL if min_interval is None else min_interval
+        self.max_interval = ADAPTIVE_MAX_INTERVAL if max_interval is None else max_interval
+
+    @staticmethod
+    def median_gap(version_builds):
+        """Median seconds between builds of the version that ships most often"""
+        medians = []
+        for times in version_builds.values():
+            gaps = sorted(b - a for a, b in zip(times, times[1:]) if b > a)
+            if len(gaps) >= AdaptiveCadence.min_gaps:
+                medians.append(gaps[len(gaps) // 2])
+        return min(medians) if medians else None
+
+    def is_active_hour(self, version_builds, now):
+        times = [t for version_times in version_builds.values() for t in version_times]
+        if len(times) < self.min_builds_for_hours:
+            return False
+        hour = dt.fromtimestamp(now, timezone.utc).hour
+        in_hour = sum(1 for t in times if dt.fromtimestamp(t, timezone.utc).hour == hour)
+        return in_hour * 24 >= 1.5 * len(times)
+
+    def next_interval(self, version_builds, quiet_polls, now, max_interval=None):
+        """Seconds until the next poll
+
+        version_builds maps each version to the times of its builds, oldest first.
+        quiet_polls is the number of polls in a row that found no new build.
+        """
+        low = self.min_interval
+        high = max(low, max_interval or self.max_interval)
+        interval = low * 2 ** min(quiet_polls, 32)
+        median_gap = self.median_gap(version_builds)
+        last_build = max((times[-1] for times in version_builds.values() if times), default=None)
+        if median_gap is not None and now - last_build < 2 * median_gap:
+            # Another build is likely to follow soon
+            interval = min(interval, median_gap / 4)
+        if self.is_active_hour(version_builds, now):
+            interval = min(interval, high / self.active_divisor)
+        return min(max(interval, low), high)
+
+    def record(self, version_builds, observed_builds):
+        """Add the build times of a poll to version_builds, True if any build is new"""
+        new_build = False
+        for version_id, build_time in observed_builds.items():
+            timestamp = convert_build_date(build_time).timestamp()
+            times = version_builds.setdefault(version_id, [])
+            if not times or timestamp > times[-1]:
+                times.append(timestamp)
+                del times[: -self.history_size]
+                new_build = True
+        return new_build
+
+
+class PollSchedule:
+    """When each project was last polled, so projects with an interval wait their turn
+
+    A project is due once its interval has passed, give or take 5% so that cron or
+    daemon jitter does not make it skip a whole run. With adaptive polling the
+    interval comes from the project's build cadence, and the configured interval of
+    a project caps it.
+    """
+
+    def __init__(self, registry, path=None, cadence=None):
+        self.registry = registry
+        self.path = path or SCHEDULE_FILE
+        if cadence is None and ADAPTIVE_POLLING:
+            cadence = AdaptiveCadence()
+        self.cadence = cadence
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            data = {}
+        if data and "last_polled" not in data:
+            # Schedule files before adaptive polling only held the poll times
+            data = {"last_polled": data}
+        self.last_polled = data.get("last_polled", {})
+        self.quiet_polls = data.get("quiet_polls", {})
+        self.builds = data.get("builds", {})
+
+    @property
+    def adaptive(self) -> bool:
+        return self.cadence is not None
+
+    def interval(self, project_id, now=None) -> float:
+        config = self.registry.projects.get(project_id)
+        configured = config.interval if config else 0.0
+        if self.cadence is None:
+            return configured
+        now = time.time() if now is None else now
+        return self.cadence.next_interval(
+            self.builds.get(project_id, {}),
+            self.quiet_polls.get(project_id, 0),
+            now,
+            max_interval=configured or None,
+        )
+
+    def seconds_until_due(self, project_id, now=None) -> float:
+        if project_id not in self.last_polled:
+            return 0.0
+        now = time.time() if now is None else now
+        due_at = self.last_polled[project_id] + self.interval(project_id, now) * 0.95
+        return max(0.0, due_at - now)
+
+    def is_due(self, project_id, now=None) -> bool:
+        return self.seconds_until_due(project_id, now) <= 0
+
+    def due(self, projects, now=None):
+        return [project for project in projects if self.is_due(project.project, now)]
+
+    def mark_polled(self, projects, now=None):
+        now = time.time() if now is None else now
+        for project in projects:
+            self.last_polled[project.project] = now
+            if self.cadence is not None:
+                version_builds = self.builds.setdefault(project.project, {})
+                if self.cadence.record(version_builds, project.observed_builds):
+                    self.quiet_polls[project.project] = 0
+                else:
+                    self.quiet_polls[project.project] = self.quiet_polls.get(project.project, 0) + 1
+        data = {"last_polled": self.last_polled}
+        if self.cadence is not None:
+            data.update({"quiet_polls": self.quiet_polls, "builds": self.builds})
+        try:
+            write_json_atomically(self.path, data)
+        except OSError as e:
+            print(f"Could not write poll schedule: {e}")
+
+
+def create_registry(session=None):
+    """Load the project registry, discovering projects when the config asks for it"""
+    registry = ProjectRegistry()
+    if registry.discover:
+        try:
+            added = registry.discover_projects(session)
+        except Exception as e:
+            print(f"Project discovery failed, polling the configured projects: {e}")
+        else:
+            if added:
+                print(f"Discovered projects: {', '.join(added)}")
+    return registry
+
+
+class PollerDaemon:
+    """Keep one process alive and run poll cycles on a configurable interval
+
+    The GraphQL client, its HTTP connections, the PaperAPI instances and their loaded
+    state stay warm between cycles. The session is opened by the first cycle, with the
+    same retries and circuit breaker as queries, and a cycle that cannot connect is
+    retried on the next one. With a schedule, each cycle only polls the projects that
+    are due. SIGINT and SIGTERM stop the daemon once the current cycle is done.
+    """
+
+    def __init__(self, projects, interval=None, jitter=None, schedule=None):
+        self.projects = projects
+        self.interval = POLL_INTERVAL if interval is None else interval
+        self.jitter = POLL_JITTER if jitter is None else jitter
+        self.schedule = schedule
+        self.stop_event = threading.Event()
+        self.cycles = 0
+        # Warm GraphQL session, opened by the first cycle that manages to connect
+        self.session = None
+        # The daemon holds the lock, so nothing else changes the state files under it
+        for project in projects:
+            project.keep_state = True
+
+    def due_projects(self):
+        if self.schedule is None:
+            return self.projects
+        return self.schedule.due(self.projects)
+
+    def _polled(self, projects):
+        # Projects the cycle deadline cut off are due again right away
+        projects = run_deadline.finished(projects)
+        if self.schedule is not None and projects:
+            self.schedule.mark_polled(projects)
+
+    def next_delay(self):
+        """Seconds until the next cycle, spread by jitter so runs don't align
+
+        With adaptive polling, the next cycle starts early when a project is due sooner.
+        """
+        delay = self.interval
+        if self.schedule is not None and self.schedule.adaptive:
+            delay = min(
+                [delay] + [self.schedule.seconds_until_due(p.project) for p in self.projects]
+            )
+            # Jitter must not make a busy project wait longer than its interval
+            return max(0.0, delay - random.uniform(0, self.jitter))
+        return max(0.0, delay + random.uniform(-self.jitter, self.jitter))
+
+    def stop(self, signum=None, frame=None):
+        if signum is not None:
+            print(f"Received signal {signum}, stopping after the current cycle")
+        self.stop_event.set()
+
+    def install_signal_handlers(self):
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, self.stop)
+
+    def _finish_cycle(self, max_cycles):
+        """Count a finished cycle and wait for the next one, False once stopping"""
+        self.cycles += 1
+        if max_cycles is not None and self.cycles >= max_cycles:
+            return False
+        return not self.stop_event.wait(self.next_delay())
+
+    def run_forever(self, max_cycles=None):
+        import asyncio
+
+        if USE_ASYNC:
+            asyncio.run(self._run_forever_async(max_cycles))
+        else:
+            self._run_forever_sync(max_cycles)
+        print(f"Daemon stopped after {self.cycles} cycles")
+
+    def _run_forever_sync(self, max_cycles):
+        client = lazy("client")
+        try:
+            while not self.stop_event.is_set():
+                projects = self.due_projects()
+                start_run_deadline()
+                try:
+                    if self.session is None:
+                        self.session = call_upstream(gql_base, client.connect_sync)
+                    run_projects(projects, self.session)
+                    self._polled(projects)
+                except Exception as e:
+                    errors_total.inc(stage="cycle")
+                    print(f"Error during poll cycle: {e}")
+                if not self._finish_cycle(max_cycles):
+                    break
         finally:
-            # Wait 2 seconds to not hit discord API rate limits
-            time.sleep(2)
+            if self.session is not None:
+                self.session = None
+                client.close_sync()
+
+    async def _poll_async(self, projects, client):
+        """Run one cycle, opening the session of client first if it is not open yet"""
+        start_run_deadline()
+        try:
+            if self.session is None:
+                self.session = await call_upstream_async(gql_base, client.connect_async)
+            await run_projects_async(projects, self.session)
+            self._polled(projects)
+        except Exception as e:
+            errors_total.inc(stage="cycle")
+            print(f"Error during poll cycle: {e}")
 
-    def _run_multi_version_mode(self):
-        """New behavior: check all versions for updates"""
+    @asynccontextmanager
+    async def _async_client(self):
+        """An async client for the cycles to connect, closed when the daemon stops"""
+        client = _async_client()
         try:
-            # Get all versions to check for updates
-            gql_all_versions = self.get_all_versions()
-            all_versions = gql_all_versions["project"]["versions"]
+            yield client
+        finally:
+            if self.session is not None:
+                self.session = None
+                await client.close_async()
+
+    async def _run_forever_async(self, max_cycles):
+        import asyncio
+
+        async with self._async_client() as client:
+            while not self.stop_event.is_set():
+                await self._poll_async(self.due_projects(), client)
+                # Waiting on the event in a thread lets signal handlers wake us up
+                if not await asyncio.to_thread(self._finish_cycle, max_cycles):
+                    break
+
+
+def websocket_url(url):
+    """The websocket URL of a GraphQL endpoint served over http(s)"""
+    return re.sub(r"^http", "ws", url)
+
+
+def subscription_unavailable(error) -> bool:
+    """True when an error means the server does not offer the subscription at all
+
+    The server refusing the websocket upgrade, speaking another protocol or rejecting
+    the subscription document will not change by reconnecting, unlike lost connections,
+    timeouts and overloaded servers.
+    """
+    from gql.transport.exceptions import TransportProtocolError, TransportQueryError
+
+    if isinstance(error, (TransportQueryError, TransportProtocolError)):
+        return True
+    # websockets raises InvalidStatus with the HTTP response when the upgrade is refused
+    status = getattr(getattr(error.__cause__, "response", None), "status_code", None)
+    return status is not None and status not in (408, 429, 500, 502, 503, 504)
+
+
+class SubscriptionDaemon(PollerDaemon):
+    """Poll projects as soon as the API announces new builds over a GraphQL subscription
+
+    Every build event starts a poll cycle of its project, so state, catch-up and
+    webhooks work exactly as when polling. Each connect starts with a cycle of all
+    projects, which picks up builds published while the daemon was not subscribed.
+    A lost connection is retried with exponential backoff and full jitter. When the
+    server does not offer subscriptions, or connects keep failing, the daemon polls
+    on its interval for retry_after seconds and then tries to subscribe again.
+    """
+
+    # How often a running subscription checks whether the daemon was stopped
+    stop_check_interval = 0.5
+
+    def __init__(
+        self,
+        projects,
+        interval=None,
+        jitter=None,
+        schedule=None,
+        url=None,
+        max_retries=None,
+        backoff_max=None,
+        retry_after=None,
+    ):
+        super().__init__(projects, interval, jitter, schedule)
+        self.url = url or SUBSCRIPTION_URL or websocket_url(gql_base)
+        self.max_retries = SUBSCRIPTION_RETRIES if max_retries is None else max_retries
+        self.backoff_max = SUBSCRIPTION_BACKOFF_MAX if backoff_max is None else backoff_max
+        self.retry_after = SUBSCRIPTION_RETRY_AFTER if retry_after is None else retry_after
+        self.failures = 0
+        self.max_cycles = None
+
+    def reconnect_delay(self):
+        """Seconds to wait before the next connect, with full jitter"""
+        return random.uniform(0, min(self.backoff_max, 2.0**self.failures))
+
+    def projects_for_event(self, result):
+        """The polled projects a build event is about, all of them if it does not say"""
+        event = result.get("buildPublished") or {}
+        project_id = (event.get("project") or {}).get("id")
+        if project_id is None:
+            return self.projects
+        return [project for project in self.projects if project.project == project_id]
+
+    def run_forever(self, max_cycles=None):
+        import asyncio
+
+        self.max_cycles = max_cycles
+        asyncio.run(self._run_subscribed())
+        print(f"Daemon stopped after {self.cycles} cycles")
+
+    async def _cycle(self, projects, client):
+        await self._poll_async(projects, client)
+        self.cycles += 1
+        if self.max_cycles is not None and self.cycles >= self.max_cycles:
+            self.stop_event.set()
 
-            updates_sent = 0
+    async def _unless_stopped(self, coroutine):
+        """Run coroutine to the end, or cancel it once the daemon is stopped"""
+        import asyncio
 
-            # Check each version for updates
-            for version_data in all_versions:
-                version_id = version_data["id"]
-                builds = version_data.get("builds", [])
+        task = asyncio.ensure_future(coroutine)
+        while not task.done():
+            if self.stop_event.is_set():
+                task.cancel()
+            await asyncio.wait({task}, timeout=self.stop_check_interval)
+        if task.cancelled():
+            return None
+        return task.result()
 
-                # Skip versions with no builds
-                if not builds:
+    async def _listen(self, client):
+        """Subscribe to build events and poll the projects they are about"""
+        from gql import Client
+        from gql.transport.websockets import WebsocketsTransport
+
+        transport = WebsocketsTransport(url=self.url)
+        async with Client(transport=transport) as subscriber:
+            self.connected_at = time.monotonic()
+            print(f"Subscribed to new builds at {self.url}")
+            await self._cycle(self.projects, client)
+            async for result in subscriber.subscribe(lazy("build_subscription")):
+                projects = self.projects_for_event(result)
+                if projects:
+                    await self._cycle(projects, client)
+        raise ConnectionError("the server ended the subscription")
+
+    async def _poll_instead(self, client):
+        """Poll on the daemon interval until it is time to subscribe again"""
+        import asyncio
+
+        deadline = time.monotonic() + self.retry_after
+        while not self.stop_event.is_set():
+            await self._cycle(self.due_projects(), client)
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            await asyncio.to_thread(self.stop_event.wait, min(self.next_delay(), remaining))
+
+    async def _run_subscribed(self):
+        import asyncio
+
+        async with self._async_client() as client:
+            while not self.stop_event.is_set():
+                self.connected_at = None
+                try:
+                    await self._unless_stopped(self._listen(client))
                     continue
+                except Exception as e:
+                    error = e
+                # A connection that stayed up for a while was not part of a failing streak
+                if self.connected_at and time.monotonic() - self.connected_at >= self.backoff_max:
+                    self.failures = 0
+                self.failures += 1
+                if subscription_unavailable(error) or self.failures > self.max_retries:
+                    errors_total.inc(stage="subscription")
+                    print(
+                        f"Subscriptions unavailable ({error}), polling every "
+                        f"{self.interval:g} seconds for {self.retry_after:g} seconds instead"
+                    )
+                    self.failures = 0
+                    await self._poll_instead(client)
+                else:
+                    delay = self.reconnect_delay()
+                    print(f"Subscription lost ({error}), reconnecting in {delay:.1f} seconds")
+                    await asyncio.to_thread(self.stop_event.wait, delay)
 
-                build_info = builds[0]
 
-                # Check and process update using extracted function
-                if self._check_version_for_update(
-                    version_id, build_info, use_legacy_storage=False
-                ):
-                    updates_sent += 1
-                    # Add small delay between versions to avoid rate limits
-                    time.sleep(1)
-
-            if updates_sent == 0:
-                print(f"Up to date for all {self.project} versions")
-            else:
-                print(f"Sent {updates_sent} updates for {self.project}")
+def load_env_file(path=None):
+    """Read .env into the environment and apply the settings it adds
 
-        except KeyError as e:
-            print(f"Error getting versions: {e}")
-            return
-        finally:
-            # Wait 2 seconds to not hit discord API rate limits
-            time.sleep(2)
+    The settings are read on import, before .env could be loaded. Only the settings
+    whose variables .env adds are read again, all others keep their current value.
+    """
+    global render_commit_line
+    from dotenv import load_dotenv
+
+    environment = dict(os.environ)
+    load_dotenv(path)
+    for variable, (name, parse) in _settings.items():
+        if os.environ.get(variable) != environment.get(variable):
+            globals()[name] = parse(os.environ[variable])
+    if render_commit_line.cache_parameters()["maxsize"] != CHANGELOG_CACHE_SIZE:
+        render_commit_line = lru_cache(maxsize=CHANGELOG_CACHE_SIZE)(render_commit_line.__wrapped__)
 
 
 def main():
+    global active_profiler
+    import asyncio
+
+    from filelock import FileLock, Timeout
+
+    load_env_file()
+    if PROFILE:
+        active_profiler = RunProfiler(PROFILE_CPROFILE, PROFILE_TRACEMALLOC)
+        active_profiler.start()
+
+    # Resolve the webhook config up front, --stdin must be read before polling
+    lazy("webhook_urls")
     lock_file = "paper_poller.lock"
     lock = FileLock(lock_file, timeout=10)
 
@@ -502,22 +3984,66 @@ def main():
         print("Multi-version checking enabled - will check all Minecraft versions")
     else:
         print("Single-version checking enabled - will check only the latest version")
+    if USE_ASYNC:
+        print("Async engine enabled - will poll all projects concurrently")
+    if SUBSCRIBE:
+        print("Subscription mode enabled - will poll projects as soon as they publish builds")
+    elif DAEMON_MODE:
+        print(f"Daemon mode enabled - will poll every {POLL_INTERVAL:g} seconds")
+    if PROFILE:
+        print(f"Profiling enabled - will write a report to {PROFILE_DIR}")
 
+    polled = False
     try:
         with lock:
-            paper = PaperAPI()
-            paper.run()
-            folia = PaperAPI(project="folia")
-            folia.run()
-            velocity = PaperAPI(project="velocity")
-            velocity.run()
-            waterfall = PaperAPI(project="waterfall")
-            waterfall.run()
+            polled = True
+            deadline = start_run_deadline()
+            registry = create_registry()
+            projects = registry.create_projects()
+            schedule = PollSchedule(registry)
+            if DAEMON_MODE or SUBSCRIBE:
+                if METRICS_PORT:
+                    try:
+                        start_metrics_server()
+                    except OSError as e:
+                        # E.g. the port is taken, polling matters more than the endpoint
+                        errors_total.inc(stage="metrics")
+                        print(
+                            f"Could not serve metrics on {METRICS_ADDR}:{METRICS_PORT}: {e}, "
+                            "polling without the metrics endpoint"
+                        )
+                daemon_class = SubscriptionDaemon if SUBSCRIBE else PollerDaemon
+                daemon = daemon_class(projects, schedule=schedule)
+                daemon.install_signal_handlers()
+                daemon.run_forever()
+            else:
+                projects = schedule.due(projects)
+                if not projects:
+                    print("No project is due for a poll")
+                elif USE_ASYNC:
+                    asyncio.run(run_projects_async(projects))
+                    schedule.mark_polled(deadline.finished(projects))
+                else:
+                    run_projects(projects)
+                    schedule.mark_polled(deadline.finished(projects))
     except Timeout:
         print("Lock file is locked, exiting")
     except Exception as e:
+        errors_total.inc(stage="cycle")
         print(f"Error during execution: {e}")
     finally:
+        # A run that found the lock taken must not replace the metrics of the one holding it
+        if METRICS_FILE and polled:
+            try:
+                write_metrics_file(METRICS_FILE)
+            except OSError as e:
+                print(f"Could not write metrics file: {e}")
+        if active_profiler is not None:
+            profiler, active_profiler = active_profiler, None
+            try:
+                print(f"Wrote profile report to {profiler.write_report()}")
+            except OSError as e:
+                print(f"Could not write profile report: {e}")
         try:
             if lock.is_locked:
                 lock.release()
@@ -525,5 +4051,60 @@ def main():
             pass
 
 
+def _query_factory(source):
+    def parse():
+        from gql import gql
+
+        return gql(source)
+
+    return parse
+
+
+def _import_aiohttp_transport():
+    from gql.transport.aiohttp import AIOHTTPTransport
+
+    return AIOHTTPTransport
+
+
+# Module attributes that are only created on first use, through lazy() or __getattr__
+_LAZY_ATTRIBUTES = {
+    "webhook_urls": load_webhook_urls,
+    "SchemaCacheClient": _define_schema_cache_client,
+    "AIOHTTPTransport": _import_aiohttp_transport,
+    "PersistedQueryRequest": _define_persisted_query_request,
+    "PersistedQueryTransport": _define_persisted_query_transport,
+    "AsyncPersistedQueryTransport": _define_async_persisted_query_transport,
+    "client": _create_client,
+    "latest_query": _query_factory(latest_query_source),
+    "all_versions_query": _query_factory(all_versions_query_source),
+    "versions_page_query": _query_factory(versions_page_query_source),
+    "latest_probe_query": _query_factory(latest_probe_query_source),
+    "all_versions_probe_query": _query_factory(all_versions_probe_query_source),
+    "versions_page_probe_query": _query_factory(versions_page_probe_query_source),
+    "missed_builds_query": _query_factory(missed_builds_query_source),
+    "projects_query": _query_factory(projects_query_source),
+    "build_subscription": _query_factory(build_subscription_source),
+}
+_lazy_lock = threading.RLock()
+
+
+def lazy(name):
+    """The module attribute `name`, created on first use unless it was already set"""
+    try:
+        return globals()[name]
+    except KeyError:
+        pass
+    with _lazy_lock:
+        if name not in globals():
+            globals()[name] = _LAZY_ATTRIBUTES[name]()
+        return globals()[name]
+
+
+def __getattr__(name):
+    if name in _LAZY_ATTRIBUTES:
+        return lazy(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
 if __name__ == "__main__":
     main()
@@ -20,29 +20,184 @@ spec.loader.exec_module(paper_poller_main)
 # Export all public items
 __all__ = [
     "PaperAPI",
+    "ProjectState",
+    "JsonStateBackend",
+    "SqliteStateBackend",
+    "JournalStateBackend",
+    "write_json_atomically",
+    "get_state_backend",
+    "STATE_BACKEND",
+    "VERSION_WINDOW",
+    "VERSION_MAX_AGE_DAYS",
+    "VERSION_PAGE_SIZE",
+    "filter_version_window",
+    "TWO_PHASE_POLL",
+    "select_query",
+    "build_details_query",
+    "merge_build_details",
+    "FINGERPRINT_RESPONSES",
+    "response_fingerprint",
+    "short_circuit_counts",
+    "CATCH_UP_MAX_BUILDS",
+    "missed_build_count",
+    "truncate_changes",
+    "COALESCE_UPDATES",
+    "count_components",
+    "count_text",
+    "pack_components",
+    "PayloadRenderer",
+    "encode_payload",
+    "render_changelog",
+    "render_commit_line",
     "convert_commit_hash_to_short",
     "convert_build_date",
-    "get_spigot_drama",
     "Color",
     "COLORS",
     "CHANNEL_COLORS",
     "CHECK_ALL_VERSIONS",
     "DRY_RUN",
-    "webhook_urls",
-    "client",
+    "USE_ASYNC",
+    "BATCH_QUERIES",
+    "DAEMON_MODE",
+    "POLL_INTERVAL",
+    "POLL_JITTER",
+    "WEBHOOK_CONCURRENCY",
+    "WEBHOOK_MAX_RETRIES",
+    "RateLimitBucket",
+    "WebhookResult",
+    "WebhookDispatcher",
+    "get_webhook_dispatcher",
+    "describe_webhook_url",
+    "load_cached_schema",
+    "save_cached_schema",
+    "PERSISTED_QUERIES",
+    "MetricsRegistry",
+    "metrics",
+    "start_metrics_server",
+    "write_metrics_file",
+    "PROFILE",
+    "RunProfiler",
+    "profiled",
+    "profile_phase",
+    "PersistedQuerySupport",
+    "get_persisted_query_support",
+    "persisted_query_error",
+    "build_batched_query",
+    "split_batched_result",
+    "fetch_projects",
+    "run_projects",
+    "run_projects_async",
+    "PollerDaemon",
+    "ProjectConfig",
+    "DEFAULT_PROJECTS",
+    "ProjectRegistry",
+    "PollSchedule",
+    "AdaptiveCadence",
+    "SubscriptionDaemon",
+    "subscription_unavailable",
+    "CircuitBreaker",
+    "CircuitOpenError",
+    "DeadlineExceeded",
+    "RunDeadline",
+    "is_transient_error",
+    "create_registry",
     "main",
+    "load_env_file",
 ]
 
 # Make everything available at module level
 PaperAPI = paper_poller_main.PaperAPI
+ProjectState = paper_poller_main.ProjectState
+JsonStateBackend = paper_poller_main.JsonStateBackend
+SqliteStateBackend = paper_poller_main.SqliteStateBackend
+JournalStateBackend = paper_poller_main.JournalStateBackend
+write_json_atomically = paper_poller_main.write_json_atomically
+get_state_backend = paper_poller_main.get_state_backend
+STATE_BACKEND = paper_poller_main.STATE_BACKEND
+VERSION_WINDOW = paper_poller_main.VERSION_WINDOW
+VERSION_MAX_AGE_DAYS = paper_poller_main.VERSION_MAX_AGE_DAYS
+VERSION_PAGE_SIZE = paper_poller_main.VERSION_PAGE_SIZE
+filter_version_window = paper_poller_main.filter_version_window
+TWO_PHASE_POLL = paper_poller_main.TWO_PHASE_POLL
+select_query = paper_poller_main.select_query
+build_details_query = paper_poller_main.build_details_query
+merge_build_details = paper_poller_main.merge_build_details
+FINGERPRINT_RESPONSES = paper_poller_main.FINGERPRINT_RESPONSES
+response_fingerprint = paper_poller_main.response_fingerprint
+short_circuit_counts = paper_poller_main.short_circuit_counts
+CATCH_UP_MAX_BUILDS = paper_poller_main.CATCH_UP_MAX_BUILDS
+missed_build_count = paper_poller_main.missed_build_count
+truncate_changes = paper_poller_main.truncate_changes
+COALESCE_UPDATES = paper_poller_main.COALESCE_UPDATES
+count_components = paper_poller_main.count_components
+count_text = paper_poller_main.count_text
+pack_components = paper_poller_main.pack_components
+PayloadRenderer = paper_poller_main.PayloadRenderer
+encode_payload = paper_poller_main.encode_payload
+render_changelog = paper_poller_main.render_changelog
+render_commit_line = paper_poller_main.render_commit_line
 convert_commit_hash_to_short = paper_poller_main.convert_commit_hash_to_short
 convert_build_date = paper_poller_main.convert_build_date
-get_spigot_drama = paper_poller_main.get_spigot_drama
 Color = paper_poller_main.Color
 COLORS = paper_poller_main.COLORS
 CHANNEL_COLORS = paper_poller_main.CHANNEL_COLORS
 CHECK_ALL_VERSIONS = paper_poller_main.CHECK_ALL_VERSIONS
 DRY_RUN = paper_poller_main.DRY_RUN
-webhook_urls = paper_poller_main.webhook_urls
-client = paper_poller_main.client
+USE_ASYNC = paper_poller_main.USE_ASYNC
+BATCH_QUERIES = paper_poller_main.BATCH_QUERIES
+DAEMON_MODE = paper_poller_main.DAEMON_MODE
+POLL_INTERVAL = paper_poller_main.POLL_INTERVAL
+POLL_JITTER = paper_poller_main.POLL_JITTER
+WEBHOOK_CONCURRENCY = paper_poller_main.WEBHOOK_CONCURRENCY
+WEBHOOK_MAX_RETRIES = paper_poller_main.WEBHOOK_MAX_RETRIES
+RateLimitBucket = paper_poller_main.RateLimitBucket
+WebhookResult = paper_poller_main.WebhookResult
+WebhookDispatcher = paper_poller_main.WebhookDispatcher
+get_webhook_dispatcher = paper_poller_main.get_webhook_dispatcher
+describe_webhook_url = paper_poller_main.describe_webhook_url
+load_cached_schema = paper_poller_main.load_cached_schema
+save_cached_schema = paper_poller_main.save_cached_schema
+PERSISTED_QUERIES = paper_poller_main.PERSISTED_QUERIES
+MetricsRegistry = paper_poller_main.MetricsRegistry
+metrics = paper_poller_main.metrics
+start_metrics_server = paper_poller_main.start_metrics_server
+write_metrics_file = paper_poller_main.write_metrics_file
+PROFILE = paper_poller_main.PROFILE
+RunProfiler = paper_poller_main.RunProfiler
+profiled = paper_poller_main.profiled
+profile_phase = paper_poller_main.profile_phase
+PersistedQuerySupport = paper_poller_main.PersistedQuerySupport
+get_persisted_query_support = paper_poller_main.get_persisted_query_support
+persisted_query_error = paper_poller_main.persisted_query_error
+build_batched_query = paper_poller_main.build_batched_query
+split_batched_result = paper_poller_main.split_batched_result
+fetch_projects = paper_poller_main.fetch_projects
+run_projects = paper_poller_main.run_projects
+run_projects_async = paper_poller_main.run_projects_async
+PollerDaemon = paper_poller_main.PollerDaemon
+ProjectConfig = paper_poller_main.ProjectConfig
+DEFAULT_PROJECTS = paper_poller_main.DEFAULT_PROJECTS
+ProjectRegistry = paper_poller_main.ProjectRegistry
+PollSchedule = paper_poller_main.PollSchedule
+AdaptiveCadence = paper_poller_main.AdaptiveCadence
+SubscriptionDaemon = paper_poller_main.SubscriptionDaemon
+subscription_unavailable = paper_poller_main.subscription_unavailable
+CircuitBreaker = paper_poller_main.CircuitBreaker
+CircuitOpenError = paper_poller_main.CircuitOpenError
+DeadlineExceeded = paper_poller_main.DeadlineExceeded
+RunDeadline = paper_poller_main.RunDeadline
+is_transient_error = paper_poller_main.is_transient_error
+create_registry = paper_poller_main.create_registry
 main = paper_poller_main.main
+load_env_file = paper_poller_main.load_env_file
+
+
+def __getattr__(name):
+    # webhook_urls, client, the GraphQL documents and transports are created on first use,
+    # so they are not in __all__ and are looked up on the main script when accessed
+    return getattr(paper_poller_main, name)
+
+
+if __name__ == "__main__":
+    # `python paper_poller.py` loads paper-poller.py from its bytecode cache
+    main()
@@ -125,11 +125,24 @@ def sample_all_versions_response():
     }
 
 
+@pytest.fixture
+def main_module(tmp_path, monkeypatch):
+    """The poller module in dry run mode without a version window, run from tmp_path."""
+    import paper_poller
+
+    monkeypatch.chdir(tmp_path)
+    main_module = paper_poller.paper_poller_main
+    monkeypatch.setattr(main_module, "DRY_RUN", True)
+    monkeypatch.setattr(main_module, "VERSION_WINDOW", 0)
+    monkeypatch.setattr(main_module, "VERSION_MAX_AGE_DAYS", 0)
+    return main_module
+
+
 @pytest.fixture
 def mock_gql_client(mocker):
     """Mock GQL client for testing."""
     mock_client = MagicMock()
-    mocker.patch("paper_poller.client", mock_client)
+    mocker.patch("paper_poller.paper_poller_main.client", mock_client)
     return mock_client
 
 
@@ -157,13 +170,19 @@ def clean_env(monkeypatch):
 
 @pytest.fixture
 def mock_webhook_response(mocker):
-    """Mock requests.post for webhook testing."""
-    mock_post = mocker.patch("requests.post")
+    """Mock the pooled webhook session post for webhook testing."""
+    mock_post = mocker.patch("requests.Session.post")
     mock_post.return_value.status_code = 200
+    mock_post.return_value.headers = {}
     return mock_post
 
 
-@pytest.fixture
-def sample_spigot_drama():
-    """Sample spigot drama response."""
-    return {"response": "There's no drama :("}
+@pytest.fixture(autouse=True)
+def fresh_upstreams(monkeypatch):
+    """Retry without waiting, start with closed circuit breakers and no run deadline."""
+    import paper_poller
+
+    main_module = paper_poller.paper_poller_main
+    monkeypatch.setattr(main_module, "RETRY_BACKOFF", 0.0)
+    monkeypatch.setattr(main_module, "_circuit_breakers", {})
+    monkeypatch.setattr(main_module, "run_deadline", main_module.RunDeadline(0))
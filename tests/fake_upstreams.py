@@ -0,0 +1,439 @@
+"""Local stand-ins for the upstream services, shared by tests and benchmarks."""
+
+import hashlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PERSISTED_QUERY_NOT_FOUND = {
+    "message": "PersistedQueryNotFound",
+    "extensions": {"code": "PERSISTED_QUERY_NOT_FOUND"},
+}
+PERSISTED_QUERY_NOT_SUPPORTED = {
+    "message": "PersistedQueryNotSupported",
+    "extensions": {"code": "PERSISTED_QUERY_NOT_SUPPORTED"},
+}
+
+
+class FakeServer:
+    """An HTTP server on a free localhost port, running in a background thread
+
+    Subclasses implement answer(path, body) and return a status and a JSON document,
+    or None for an empty body. Every request path and body is kept in `requests`.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.requests = []
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    @property
+    def bytes_received(self):
+        with self._lock:
+            return sum(len(body) for _, body in self.requests)
+
+    def answer(self, path, body):
+        raise NotImplementedError
+
+    def start(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                with fake._lock:
+                    fake.requests.append((self.path, body))
+                if fake.latency:
+                    time.sleep(fake.latency)
+                status, document = fake.answer(self.path, body)
+                data = b"" if document is None else json.dumps(document).encode("utf-8")
+                with fake._lock:
+                    fake.bytes_sent += len(data)
+                try:
+                    self.send_response(status)
+                    if data:
+                        self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client gave up waiting, like a poller hitting its read timeout
+                    pass
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+        return False
+
+
+class FakeGraphQLServer(FakeServer):
+    """A GraphQL endpoint that answers every query with respond(payload)
+
+    An exception raised by respond is answered as a GraphQL error.
+    persisted_queries picks how it treats automatic persisted queries:
+    "supported" keeps a registry of hashes like Apollo Server, "not_supported"
+    rejects them with PERSISTED_QUERY_NOT_SUPPORTED, "ignored" behaves like a
+    server that has never heard of them and needs the query text and "unavailable"
+    answers them with a 503 like an overloaded server.
+    """
+
+    def __init__(self, respond=None, persisted_queries="supported", latency=0.0):
+        super().__init__(latency=latency)
+        self.respond = respond or (lambda payload: {})
+        self.persisted_queries = persisted_queries
+        self.registered = {}
+
+    @property
+    def payloads(self):
+        with self._lock:
+            return [json.loads(body) for _, body in self.requests]
+
+    def answer(self, path, body):
+        payload = json.loads(body)
+        query = payload.get("query")
+        persisted = (payload.get("extensions") or {}).get("persistedQuery")
+
+        if persisted and self.persisted_queries == "not_supported":
+            return 200, {"errors": [PERSISTED_QUERY_NOT_SUPPORTED]}
+        if persisted and self.persisted_queries == "unavailable":
+            return 503, {"errors": [{"message": "Service Unavailable"}]}
+        if persisted and self.persisted_queries == "supported":
+            query_hash = persisted["sha256Hash"]
+            if query is None:
+                query = self.registered.get(query_hash)
+                if query is None:
+                    return 200, {"errors": [PERSISTED_QUERY_NOT_FOUND]}
+            elif hashlib.sha256(query.encode("utf-8")).hexdigest() != query_hash:
+                return 400, {"errors": [{"message": "provided sha does not match query"}]}
+            else:
+                self.registered[query_hash] = query
+
+        if query is None:
+            return 400, {"errors": [{"message": "Must provide query string."}]}
+        return 200, self.execute(dict(payload, query=query))
+
+    def execute(self, payload):
+        try:
+            return {"data": self.respond(payload)}
+        except Exception as e:
+            return {"data": None, "errors": [{"message": str(e)}]}
+
+
+FILL_SCHEMA = """
+type Query {
+    project(id: String!): Project
+    projects: [Project!]!
+}
+
+type Project {
+    id: String!
+    versions(last: Int): [Version!]!
+    version(id: String!): Version
+}
+
+type Version {
+    id: String!
+    builds(last: Int): [Build!]!
+}
+
+type Build {
+    id: Int!
+    time: String!
+    channel: Channel!
+    download(name: String!): Download
+    commits: [Commit!]!
+}
+
+type Download {
+    name: String!
+    size: Int!
+    url: String!
+    checksums: Checksums!
+}
+
+type Checksums {
+    sha256: String!
+}
+
+type Commit {
+    sha: String!
+    message: String!
+}
+
+enum Channel {
+    ALPHA
+    BETA
+    STABLE
+    RECOMMENDED
+}
+"""
+
+
+def _last(items, last):
+    return items[-last:] if last else items
+
+
+class FakeFillServer(FakeGraphQLServer):
+    """A stand-in for the PaperMC fill GraphQL API with synthetic projects
+
+    Queries, aliases and introspection are executed against a copy of the
+    parts of the real schema the poller uses. Every project gets `versions`
+    versions of `builds` builds with `commits` commits each, oldest first
+    like the real API.
+    """
+
+    PROJECTS = ("paper", "folia", "velocity", "waterfall")
+
+    def __init__(
+        self,
+        versions=3,
+        builds=5,
+        commits=3,
+        persisted_queries="supported",
+        latency=0.0,
+        projects=PROJECTS,
+    ):
+        super().__init__(persisted_queries=persisted_queries, latency=latency)
+        from graphql import build_schema
+
+        self.commits = commits
+        self.schema = build_schema(FILL_SCHEMA)
+        self.schema.query_type.fields["project"].resolve = (
+            lambda root, info, id: self.projects.get(id)
+        )
+        self.schema.query_type.fields["projects"].resolve = lambda root, info: list(
+            self.projects.values()
+        )
+        project_fields = self.schema.get_type("Project").fields
+        project_fields["versions"].resolve = lambda project, info, last=None: _last(
+            project["versions"], last
+        )
+        project_fields["version"].resolve = lambda project, info, id: next(
+            (version for version in project["versions"] if version["id"] == id), None
+        )
+        self.schema.get_type("Version").fields["builds"].resolve = (
+            lambda version, info, last=None: _last(version["builds"], last)
+        )
+        self.schema.get_type("Build").fields["download"].resolve = (
+            lambda build, info, name: build["download"]
+        )
+
+        self.projects = {
+            project: {
+                "id": project,
+                "versions": [{"id": f"1.{index}", "builds": []} for index in range(versions)],
+            }
+            for project in projects
+        }
+        for project in self.projects.values():
+            for version in project["versions"]:
+                self._add_builds(project["id"], version, builds)
+
+    def _add_builds(self, project_id, version, count):
+        from datetime import datetime, timezone
+
+        now = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.000Z")
+        for _ in range(count):
+            build_id = len(version["builds"]) + 1
+            name = f"{project_id}-{version['id']}-{build_id}.jar"
+            version["builds"].append(
+                {
+                    "id": build_id,
+                    "time": now,
+                    "channel": "STABLE",
+                    "download": {
+                        "name": name,
+                        "size": 50_000_000,
+                        "url": f"https://fill-data.papermc.io/v1/objects/{name}",
+                        "checksums": {"sha256": hashlib.sha256(name.encode()).hexdigest()},
+                    },
+                    "commits": [
+                        {
+                            "sha": hashlib.sha1(f"{name}:{index}".encode()).hexdigest(),
+                            "message": f"Fix #{build_id * 100 + index} in {version['id']}\n\nDetails",
+                        }
+                        for index in range(self.commits)
+                    ],
+                }
+            )
+
+    def release(self, builds=1):
+        """Add builds to the latest version of every project"""
+        for project in self.projects.values():
+            self._add_builds(project["id"], project["versions"][-1], builds)
+
+    def execute(self, payload):
+        from graphql import graphql_sync
+
+        result = graphql_sync(
+            self.schema,
+            payload["query"],
+            variable_values=payload.get("variables"),
+            operation_name=payload.get("operationName"),
+        )
+        return result.formatted
+
+
+class FakeDiscordServer(FakeServer):
+    """A sink for Discord webhooks that accepts every message with 204 No Content"""
+
+    def answer(self, path, body):
+        return 204, None
+
+    def webhook_urls(self, count):
+        return [f"{self.url}api/webhooks/{index}/token" for index in range(count)]
+
+
+class FakeSubscriptionServer:
+    """A GraphQL websocket endpoint speaking graphql-transport-ws, in a background thread
+
+    publish() sends a buildPublished event to every open subscription. mode picks how
+    it treats clients: "supported" accepts the subscription, "not_supported" refuses
+    the websocket upgrade with 404 like a server without subscriptions, and
+    "unknown_field" answers the subscription with a GraphQL validation error.
+    """
+
+    def __init__(self, mode="supported"):
+        self.mode = mode
+        self.connections = 0
+        self.subscriptions = {}
+        self._loop = None
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.sockets[0].getsockname()[:2]
+        return f"ws://{host}:{port}/graphql"
+
+    def _run(self, coroutine):
+        import asyncio
+
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result(timeout=10)
+
+    async def _process_request(self, connection, request):
+        from http import HTTPStatus
+
+        if self.mode == "not_supported":
+            return connection.respond(HTTPStatus.NOT_FOUND, "Not Found\n")
+        return None
+
+    async def _handle(self, websocket):
+        from websockets.exceptions import ConnectionClosed
+
+        self.connections += 1
+        subscriptions = self.subscriptions.setdefault(websocket, set())
+        try:
+            async for message in websocket:
+                message = json.loads(message)
+                kind, message_id = message.get("type"), message.get("id")
+                if kind == "connection_init":
+                    await websocket.send(json.dumps({"type": "connection_ack"}))
+                elif kind == "ping":
+                    await websocket.send(json.dumps({"type": "pong"}))
+                elif kind == "subscribe":
+                    if self.mode == "unknown_field":
+                        error = {"message": 'Cannot query field "buildPublished" on type "Subscription".'}
+                        await websocket.send(
+                            json.dumps({"id": message_id, "type": "error", "payload": [error]})
+                        )
+                    else:
+                        subscriptions.add(message_id)
+                elif kind == "complete":
+                    subscriptions.discard(message_id)
+        except ConnectionClosed:
+            pass
+        finally:
+            self.subscriptions.pop(websocket, None)
+
+    async def _start(self):
+        from websockets.asyncio.server import serve
+
+        self._server = await serve(
+            self._handle,
+            "127.0.0.1",
+            0,
+            subprotocols=["graphql-transport-ws"],
+            process_request=self._process_request,
+        )
+
+    async def _broadcast(self, event):
+        for websocket, subscriptions in list(self.subscriptions.items()):
+            for message_id in list(subscriptions):
+                message = {
+                    "id": message_id,
+                    "type": "next",
+                    "payload": {"data": {"buildPublished": event}},
+                }
+                await websocket.send(json.dumps(message))
+
+    async def _drop(self):
+        for websocket in list(self.subscriptions):
+            await websocket.close()
+
+    async def _stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    def publish(self, project, version="1.0", build=1):
+        event = {"id": build, "project": {"id": project}, "version": {"id": version}}
+        self._run(self._broadcast(event))
+
+    def drop(self):
+        """Close every open connection, like a server restart"""
+        self._run(self._drop())
+
+    def wait_for_subscriptions(self, count=1, timeout=10.0):
+        """Block until `count` subscriptions are open, False on timeout"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if sum(len(ids) for ids in list(self.subscriptions.values())) >= count:
+                return True
+            time.sleep(0.01)
+        return False
+
+    def start(self):
+        import asyncio
+
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+        self._run(self._start())
+        return self
+
+    def stop(self):
+        self._run(self._stop())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+        return False
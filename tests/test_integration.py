@@ -3,6 +3,7 @@
 import json
 import os
 import sys
+import threading
 import time
 from unittest.mock import MagicMock, Mock, patch
 
@@ -22,8 +23,8 @@ os.environ["PAPER_POLLER_CHECK_ALL_VERSIONS"] = "false"
 class TestSingleVersionMode:
     """Integration tests for single version mode."""
 
-    @patch("paper_poller.client")
-    @patch("requests.post")
+    @patch("paper_poller.paper_poller_main.client")
+    @patch("requests.Session.post")
     @patch("time.sleep")  # Mock sleep to speed up tests
     def test_run_single_version_mode_up_to_date(
         self,
@@ -53,16 +54,15 @@ class TestSingleVersionMode:
 
         # Verify no webhook was sent (we're already up to date)
         mock_post.assert_not_called()
-        assert mock_sleep.called
+        # Nothing was sent, so there is no rate limit to wait for
+        mock_sleep.assert_not_called()
 
-    @patch("paper_poller.client")
-    @patch("requests.post")
-    @patch("paper_poller.get_spigot_drama")
+    @patch("paper_poller.paper_poller_main.client")
+    @patch("requests.Session.post")
     @patch("time.sleep")
     def test_run_single_version_mode_new_build(
         self,
         mock_sleep,
-        mock_drama,
         mock_post,
         mock_client,
         tmp_path,
@@ -74,7 +74,6 @@ class TestSingleVersionMode:
 
         # Setup mocks
         mock_client.execute.return_value = sample_latest_build_response
-        mock_drama.return_value = {"response": "No drama"}
         mock_post.return_value.status_code = 200
 
         # Create existing state file with old build
@@ -95,15 +94,13 @@ class TestSingleVersionMode:
             data = json.load(f)
         assert data["build"] == "123"
 
-    @patch("paper_poller.client")
-    @patch("requests.post")
-    @patch("paper_poller.webhook_urls", ["http://test.webhook.com"])
-    @patch("paper_poller.get_spigot_drama")
+    @patch("paper_poller.paper_poller_main.client")
+    @patch("requests.Session.post")
+    @patch("paper_poller.paper_poller_main.webhook_urls", ["http://test.webhook.com"])
     @patch("time.sleep")
     def test_run_single_version_mode_channel_change(
         self,
         mock_sleep,
-        mock_drama,
         mock_post,
         mock_client,
         tmp_path,
@@ -115,30 +112,29 @@ class TestSingleVersionMode:
 
         # Setup mocks
         mock_client.execute.return_value = sample_latest_build_response
-        mock_drama.return_value = {"response": "No drama"}
         mock_post.return_value.status_code = 200
 
-        # Create existing state with different channel
+        # Create existing state with an older build on a different channel
         api = PaperAPI()
-        api.write_to_json("1.21.1", "123", "BETA")
+        api.write_to_json("1.21.1", "122", "BETA")
 
         # Run the check
         api._run_single_version_mode()
 
         # Verify webhook was sent with channel change
         assert mock_post.call_count == 1
-        payload = mock_post.call_args.kwargs["json"]
+        payload = json.loads(mock_post.call_args.kwargs["data"])
 
         # Check that channel changed notification is in payload
-        # Look for content components that might indicate channel change
-        assert len(payload["components"]) > 0
+        contents = [c.get("content") for c in payload["components"] if c.get("type") == 10]
+        assert "# Paper is now Stable!" in contents
 
 
 class TestMultiVersionMode:
     """Integration tests for multi-version mode."""
 
-    @patch("paper_poller.client")
-    @patch("requests.post")
+    @patch("paper_poller.paper_poller_main.client")
+    @patch("requests.Session.post")
     @patch("time.sleep")
     def test_run_multi_version_mode_all_up_to_date(
         self,
@@ -167,19 +163,17 @@ class TestMultiVersionMode:
         # Run the check
         api._run_multi_version_mode()
 
-        # Should call sleep for rate limiting
-        assert mock_sleep.called
+        # Nothing was sent, so there is no rate limit to wait for
+        mock_sleep.assert_not_called()
         # No webhooks should be sent since all versions are up to date
         mock_post.assert_not_called()
 
-    @patch("paper_poller.client")
-    @patch("requests.post")
-    @patch("paper_poller.get_spigot_drama")
+    @patch("paper_poller.paper_poller_main.client")
+    @patch("requests.Session.post")
     @patch("time.sleep")
     def test_run_multi_version_mode_multiple_updates(
         self,
         mock_sleep,
-        mock_drama,
         mock_post,
         mock_client,
         tmp_path,
@@ -191,7 +185,6 @@ class TestMultiVersionMode:
 
         # Setup mocks
         mock_client.execute.return_value = sample_all_versions_response
-        mock_drama.return_value = {"response": "No drama"}
         mock_post.return_value.status_code = 200
 
         # Create existing state with old builds
@@ -215,8 +208,8 @@ class TestMultiVersionMode:
         assert data["versions"]["1.21.1"]["build"] == "123"
         assert data["versions"]["1.21"]["build"] == "120"
 
-    @patch("paper_poller.client")
-    @patch("requests.post")
+    @patch("paper_poller.paper_poller_main.client")
+    @patch("requests.Session.post")
     @patch("time.sleep")
     def test_run_multi_version_mode_skips_empty_builds(
         self,
@@ -242,15 +235,15 @@ class TestMultiVersionMode:
         # Run the check - should not crash on empty builds
         api._run_multi_version_mode()
 
-        # Should complete without error
-        assert mock_sleep.called
+        # Should complete without error or fixed rate limit sleeps
+        mock_sleep.assert_not_called()
 
 
 class TestDryRunMode:
     """Integration tests for dry run mode."""
 
-    @patch("paper_poller.client")
-    @patch("requests.post")
+    @patch("paper_poller.paper_poller_main.client")
+    @patch("requests.Session.post")
     @patch("time.sleep")
     def test_dry_run_no_webhooks_sent(
         self,
@@ -305,7 +298,7 @@ class TestDryRunMode:
 class TestErrorHandling:
     """Integration tests for error handling."""
 
-    @patch("paper_poller.client")
+    @patch("paper_poller.paper_poller_main.client")
     @patch("time.sleep")
     def test_run_handles_graphql_errors(
         self, mock_sleep, mock_client, tmp_path, monkeypatch, capsys
@@ -342,8 +335,8 @@ class TestErrorHandling:
         # The test is mainly about checking the error doesn't cause data corruption
         assert True
 
-    @patch("paper_poller.client")
-    @patch("requests.post")
+    @patch("paper_poller.paper_poller_main.client")
+    @patch("requests.Session.post")
     @patch("time.sleep")
     def test_run_handles_missing_data(
         self, mock_sleep, mock_post, mock_client, tmp_path, monkeypatch
@@ -370,16 +363,14 @@ class TestErrorHandling:
 class TestCheckVersionForUpdate:
     """Tests for _check_version_for_update method."""
 
-    @patch("requests.post")
-    @patch("paper_poller.webhook_urls", ["http://test.webhook.com"])
-    @patch("paper_poller.get_spigot_drama")
+    @patch("requests.Session.post")
+    @patch("paper_poller.paper_poller_main.webhook_urls", ["http://test.webhook.com"])
     def test_check_version_legacy_storage(
-        self, mock_drama, mock_post, tmp_path, monkeypatch, sample_build_info
+        self, mock_post, tmp_path, monkeypatch, sample_build_info
     ):
         """Test _check_version_for_update with legacy storage."""
         monkeypatch.chdir(tmp_path)
 
-        mock_drama.return_value = {"response": "No drama"}
         mock_post.return_value.status_code = 200
 
         api = PaperAPI()
@@ -392,16 +383,14 @@ class TestCheckVersionForUpdate:
         assert result is True
         assert mock_post.call_count == 1
 
-    @patch("requests.post")
-    @patch("paper_poller.webhook_urls", ["http://test.webhook.com"])
-    @patch("paper_poller.get_spigot_drama")
+    @patch("requests.Session.post")
+    @patch("paper_poller.paper_poller_main.webhook_urls", ["http://test.webhook.com"])
     def test_check_version_version_specific_storage(
-        self, mock_drama, mock_post, tmp_path, monkeypatch, sample_build_info
+        self, mock_post, tmp_path, monkeypatch, sample_build_info
     ):
         """Test _check_version_for_update with version-specific storage."""
         monkeypatch.chdir(tmp_path)
 
-        mock_drama.return_value = {"response": "No drama"}
         mock_post.return_value.status_code = 200
 
         api = PaperAPI()
@@ -419,3 +408,2046 @@ class TestCheckVersionForUpdate:
             data = json.load(f)
         assert "versions" in data
         assert "1.21.1" in data["versions"]
+
+
+class TestAsyncEngine:
+    """Integration tests for the asyncio polling engine."""
+
+    @staticmethod
+    def _make_session(response, delay=0.0):
+        """Build a fake async GraphQL session that answers after a delay."""
+        import asyncio
+
+        calls = []
+
+        class FakeSession:
+            async def execute(self, query, variable_values=None):
+                calls.append(variable_values["project"])
+                await asyncio.sleep(delay)
+                return response
+
+        return FakeSession(), calls
+
+    @patch("requests.Session.post")
+    @patch("time.sleep")
+    def test_run_async_single_version_mode(
+        self,
+        mock_sleep,
+        mock_post,
+        tmp_path,
+        monkeypatch,
+        sample_latest_build_response,
+    ):
+        """Test run_async fetches through the session and stores the build."""
+        import asyncio
+
+        import paper_poller
+
+        monkeypatch.chdir(tmp_path)
+        monkeypatch.setattr(
+            paper_poller.paper_poller_main, "CHECK_ALL_VERSIONS", False
+        )
+        monkeypatch.setattr(paper_poller.paper_poller_main, "DRY_RUN", True)
+
+        session, calls = self._make_session(sample_latest_build_response)
+        api = PaperAPI()
+        asyncio.run(api.run_async(session))
+
+        assert calls == ["paper"]
+        with open("paper_poller.json", "r") as f:
+            data = json.load(f)
+        assert data["build"] == "123"
+        mock_post.assert_not_called()
+
+    @patch("time.sleep")
+    def test_projects_are_polled_concurrently(
+        self, mock_sleep, tmp_path, monkeypatch, sample_all_versions_response
+    ):
+        """Test a cycle takes about as long as the slowest single project."""
+        import asyncio
+
+        import paper_poller
+
+        monkeypatch.chdir(tmp_path)
+        monkeypatch.setattr(paper_poller.paper_poller_main, "CHECK_ALL_VERSIONS", True)
+        monkeypatch.setattr(paper_poller.paper_poller_main, "DRY_RUN", True)
+
+        session, calls = self._make_session(sample_all_versions_response, delay=0.2)
+        projects = [PaperAPI(project=name) for name in ("paper", "folia", "velocity")]
+
+        async def poll_all():
+            await asyncio.gather(*(project.run_async(session) for project in projects))
+
+        start = time.monotonic()
+        asyncio.run(poll_all())
+        elapsed = time.monotonic() - start
+
+        assert sorted(calls) == ["folia", "paper", "velocity"]
+        # Sequential polling would take at least 0.6 seconds
+        assert elapsed < 0.5
+        for name in ("paper", "folia", "velocity"):
+            assert os.path.exists(f"{name}_poller.json")
+
+    @patch("time.sleep")
+    def test_run_projects_async_reports_failures(
+        self, mock_sleep, tmp_path, monkeypatch, sample_latest_build_response, capsys
+    ):
+        """Test one failing project does not stop the others."""
+        import asyncio
+
+        import paper_poller
+
+        monkeypatch.chdir(tmp_path)
+        main_module = paper_poller.paper_poller_main
+        monkeypatch.setattr(main_module, "CHECK_ALL_VERSIONS", False)
+        monkeypatch.setattr(main_module, "DRY_RUN", True)
+        monkeypatch.setattr(main_module, "BATCH_QUERIES", False)
+
+        class FakeSession:
+            async def execute(self, query, variable_values=None):
+                if variable_values["project"] == "folia":
+                    raise Exception("GraphQL Error")
+                return sample_latest_build_response
+
+        class FakeClient:
+            def __init__(self, *args, **kwargs):
+                pass
+
+            async def __aenter__(self):
+                return FakeSession()
+
+            async def __aexit__(self, *args):
+                return False
+
+        monkeypatch.setattr(main_module, "SchemaCacheClient", FakeClient)
+        monkeypatch.setattr(main_module, "AIOHTTPTransport", Mock())
+
+        projects = [PaperAPI(), PaperAPI(project="folia")]
+        asyncio.run(paper_poller.run_projects_async(projects))
+
+        captured = capsys.readouterr()
+        assert "Error polling folia: GraphQL Error" in captured.out
+        assert os.path.exists("paper_poller.json")
+        assert not os.path.exists("folia_poller.json")
+
+
+class TestBatchedQueries:
+    """Integration tests for fetching every project in one aliased request."""
+
+    def test_build_batched_query_aliases_each_project(self):
+        """Test each project gets its own aliased field and variable."""
+        from graphql import print_ast
+
+        from paper_poller import build_batched_query
+
+        query, variables = build_batched_query(["paper", "folia"])
+        document = print_ast(query.document)
+
+        assert variables == {"p0": "paper", "p1": "folia"}
+        assert "p0: project(id: $p0)" in document
+        assert "p1: project(id: $p1)" in document
+        assert "versions(last: 1)" in document
+
+    def test_build_batched_query_all_versions(self):
+        """Test multi-version batches request every version."""
+        from graphql import print_ast
+
+        from paper_poller import build_batched_query
+
+        query, _ = build_batched_query(["paper"], batch_all_versions=True)
+        document = print_ast(query.document)
+
+        assert "versions {" in document
+        assert "versions(last: 1)" not in document
+
+    def test_split_batched_result(self, sample_latest_build_response):
+        """Test a batched response is split into per-project results."""
+        from paper_poller import split_batched_result
+
+        result = {"p0": sample_latest_build_response["project"], "p1": None}
+        split = split_batched_result(result, ["paper", "folia"])
+
+        assert split["paper"] == sample_latest_build_response
+        assert split["folia"] == {"project": {}}
+
+    @patch("time.sleep")
+    def test_run_projects_sends_one_request(
+        self, mock_sleep, tmp_path, monkeypatch, sample_latest_build_response
+    ):
+        """Test a full cycle sends a single upstream request."""
+        import paper_poller
+
+        monkeypatch.chdir(tmp_path)
+        main_module = paper_poller.paper_poller_main
+        monkeypatch.setattr(main_module, "CHECK_ALL_VERSIONS", False)
+        monkeypatch.setattr(main_module, "DRY_RUN", True)
+        monkeypatch.setattr(main_module, "BATCH_QUERIES", True)
+
+        project_data = sample_latest_build_response["project"]
+        mock_client = MagicMock()
+        mock_client.execute.return_value = {
+            "p0": project_data,
+            "p1": project_data,
+            "p2": project_data,
+        }
+        monkeypatch.setattr(main_module, "client", mock_client)
+
+        projects = [PaperAPI(project=name) for name in ("paper", "folia", "velocity")]
+        paper_poller.run_projects(projects)
+
+        assert mock_client.execute.call_count == 1
+        for name in ("paper", "folia", "velocity"):
+            with open(f"{name}_poller.json", "r") as f:
+                assert json.load(f)["build"] == "123"
+
+    @patch("time.sleep")
+    def test_run_projects_falls_back_when_batch_fails(
+        self, mock_sleep, tmp_path, monkeypatch, sample_latest_build_response
+    ):
+        """Test projects are fetched one by one if the batched request fails."""
+        import paper_poller
+
+        monkeypatch.chdir(tmp_path)
+        main_module = paper_poller.paper_poller_main
+        monkeypatch.setattr(main_module, "CHECK_ALL_VERSIONS", False)
+        monkeypatch.setattr(main_module, "DRY_RUN", True)
+        monkeypatch.setattr(main_module, "BATCH_QUERIES", True)
+
+        mock_client = MagicMock()
+        mock_client.execute.side_effect = [
+            Exception("Batch rejected"),
+            sample_latest_build_response,
+        ]
+        monkeypatch.setattr(main_module, "client", mock_client)
+
+        paper_poller.run_projects([PaperAPI()])
+
+        assert mock_client.execute.call_count == 2
+        assert os.path.exists("paper_poller.json")
+
+
+class TestSchemaCache:
+    """Integration tests for the on-disk GraphQL schema cache."""
+
+    SDL = """
+    type Query {
+        project(id: String!): Project
+    }
+
+    type Project {
+        id: String!
+    }
+    """
+
+    @classmethod
+    def _make_transport(cls, fail=False):
+        """Build a sync transport that answers introspection from a local schema."""
+        from gql.transport import Transport
+        from graphql import ExecutionResult, build_schema, introspection_from_schema
+
+        introspection = introspection_from_schema(build_schema(cls.SDL))
+
+        class FakeTransport(Transport):
+            url = "http://graphql.local/graphql"
+
+            def __init__(self):
+                self.introspections = 0
+
+            def connect(self):
+                pass
+
+            def close(self):
+                pass
+
+            def execute(self, request, *args, **kwargs):
+                self.introspections += 1
+                if fail:
+                    raise Exception("Introspection failed")
+                return ExecutionResult(data=introspection)
+
+        return FakeTransport()
+
+    def test_schema_is_fetched_once_and_cached(self, tmp_path):
+        """Test a cold start reads the schema from the cache file."""
+        from paper_poller import SchemaCacheClient
+
+        cache_file = str(tmp_path / "schema.json")
+
+        first_transport = self._make_transport()
+        with SchemaCacheClient(transport=first_transport, cache_file=cache_file):
+            pass
+        assert first_transport.introspections == 1
+        assert os.path.exists(cache_file)
+
+        second_transport = self._make_transport()
+        second = SchemaCacheClient(transport=second_transport, cache_file=cache_file)
+        with second:
+            pass
+        assert second_transport.introspections == 0
+        assert second.schema.get_type("Project") is not None
+
+    def test_stale_cache_is_refreshed(self, tmp_path):
+        """Test a cache older than the TTL is downloaded again."""
+        from paper_poller import SchemaCacheClient
+
+        cache_file = str(tmp_path / "schema.json")
+        with SchemaCacheClient(transport=self._make_transport(), cache_file=cache_file):
+            pass
+        old = time.time() - 3600
+        os.utime(cache_file, (old, old))
+
+        transport = self._make_transport()
+        with SchemaCacheClient(transport=transport, cache_file=cache_file, ttl=60):
+            pass
+        assert transport.introspections == 1
+
+    def test_manual_refresh_ignores_cache(self, tmp_path):
+        """Test refresh=True always downloads the schema."""
+        from paper_poller import SchemaCacheClient
+
+        cache_file = str(tmp_path / "schema.json")
+        with SchemaCacheClient(transport=self._make_transport(), cache_file=cache_file):
+            pass
+
+        transport = self._make_transport()
+        with SchemaCacheClient(transport=transport, cache_file=cache_file, refresh=True):
+            pass
+        assert transport.introspections == 1
+
+    def test_stale_cache_used_when_introspection_fails(self, tmp_path):
+        """Test an expired cache is still better than no schema at all."""
+        from paper_poller import SchemaCacheClient
+
+        cache_file = str(tmp_path / "schema.json")
+        with SchemaCacheClient(transport=self._make_transport(), cache_file=cache_file):
+            pass
+
+        transport = self._make_transport(fail=True)
+        client = SchemaCacheClient(transport=transport, cache_file=cache_file, ttl=0)
+        with client:
+            pass
+        assert transport.introspections == 1
+        assert client.schema is not None
+
+    def test_cache_for_other_server_is_ignored(self, tmp_path):
+        """Test a cache written for a different URL is not used."""
+        from paper_poller import load_cached_schema, save_cached_schema
+
+        cache_file = str(tmp_path / "schema.json")
+        save_cached_schema({"__schema": {}}, cache_file, url="http://other/graphql")
+
+        assert load_cached_schema(cache_file, url="http://graphql.local/graphql") is None
+        assert load_cached_schema(cache_file, url="http://other/graphql") == {
+            "__schema": {}
+        }
+
+
+class TestDaemonMode:
+    """Integration tests for the long-running daemon mode."""
+
+    def test_runs_cycles_on_shared_session(self, monkeypatch):
+        """Test each cycle reuses the same warm GraphQL session."""
+        import paper_poller
+
+        main_module = paper_poller.paper_poller_main
+        monkeypatch.setattr(main_module, "USE_ASYNC", False)
+        mock_client = MagicMock()
+        monkeypatch.setattr(main_module, "client", mock_client)
+        mock_run = Mock()
+        monkeypatch.setattr(main_module, "run_projects", mock_run)
+
+        projects = [PaperAPI()]
+        daemon = paper_poller.PollerDaemon(projects, interval=0, jitter=0)
+        daemon.run_forever(max_cycles=3)
+
+        session = mock_client.connect_sync.return_value
+        assert daemon.cycles == 3
+        assert mock_run.call_count == 3
+        assert all(c.args == (projects, session) for c in mock_run.call_args_list)
+        assert mock_client.connect_sync.call_count == 1
+        mock_client.close_sync.assert_called_once()
+
+    def test_failed_connect_is_retried_by_the_next_cycle(self, monkeypatch, capsys):
+        """Test a daemon that cannot connect at startup keeps running and connects later."""
+        import paper_poller
+
+        main_module = paper_poller.paper_poller_main
+        monkeypatch.setattr(main_module, "USE_ASYNC", False)
+        monkeypatch.setattr(main_module, "REQUEST_RETRIES", 1)
+        session = object()
+        mock_client = MagicMock()
+        mock_client.connect_sync.side_effect = [
+            ConnectionError("DNS down"),
+            ConnectionError("DNS down"),
+            session,
+        ]
+        monkeypatch.setattr(main_module, "client", mock_client)
+        mock_run = Mock()
+        monkeypatch.setattr(main_module, "run_projects", mock_run)
+
+        daemon = paper_poller.PollerDaemon([PaperAPI()], interval=0, jitter=0)
+        daemon.run_forever(max_cycles=3)
+
+        # The first cycle retried once and gave up, the second connected on its first try
+        assert mock_client.connect_sync.call_count == 3
+        assert [c.args[1] for c in mock_run.call_args_list] == [session, session]
+        assert "Error during poll cycle: DNS down" in capsys.readouterr().out
+
+    def test_state_stays_loaded_between_cycles(self, tmp_path, monkeypatch):
+        """Test the daemon loads the state of a project once, not on every cycle."""
+        import paper_poller
+
+        main_module = paper_poller.paper_poller_main
+        monkeypatch.chdir(tmp_path)
+        monkeypatch.setattr(main_module, "USE_ASYNC", False)
+        monkeypatch.setattr(main_module, "client", MagicMock())
+        loads = []
+        real_load = main_module.JsonStateBackend.load
+
+        def counting_load(self, project):
+            loads.append(project)
+            return real_load(self, project)
+
+        monkeypatch.setattr(main_module.JsonStateBackend, "load", counting_load)
+
+        def run_projects(projects, session=None):
+            for project in projects:
+                with project.state_session():
+                    project.write_to_json("1.21.1", str(len(loads) + 100), "STABLE")
+
+        monkeypatch.setattr(main_module, "run_projects", run_projects)
+
+        project = PaperAPI()
+        paper_poller.PollerDaemon([project], interval=0, jitter=0).run_forever(max_cycles=3)
+
+        assert loads == ["paper"]
+        assert PaperAPI().get_stored_data()["build"] == "101"
+
+    def test_cycle_errors_do_not_stop_daemon(self, monkeypatch, capsys):
+        """Test a failing cycle is logged and the next one still runs."""
+        import paper_poller
+
+        main_module = paper_poller.paper_poller_main
+        monkeypatch.setattr(main_module, "USE_ASYNC", False)
+        monkeypatch.setattr(main_module, "client", MagicMock())
+        mock_run = Mock(side_effect=[Exception("Upstream down"), None])
+        monkeypatch.setattr(main_module, "run_projects", mock_run)
+
+        daemon = paper_poller.PollerDaemon([PaperAPI()], interval=0, jitter=0)
+        daemon.run_forever(max_cycles=2)
+
+        assert mock_run.call_count == 2
+        assert "Error during poll cycle: Upstream down" in capsys.readouterr().out
+
+    def test_signal_stops_daemon_while_waiting(self, monkeypatch):
+        """Test a shutdown signal interrupts the wait between cycles."""
+        import signal
+        import threading
+
+        import paper_poller
+
+        main_module = paper_poller.paper_poller_main
+        monkeypatch.setattr(main_module, "USE_ASYNC", False)
+        monkeypatch.setattr(main_module, "client", MagicMock())
+        monkeypatch.setattr(main_module, "run_projects", Mock())
+
+        daemon = paper_poller.PollerDaemon([PaperAPI()], interval=60, jitter=0)
+        threading.Timer(0.1, daemon.stop, args=(signal.SIGTERM, None)).start()
+
+        start = time.monotonic()
+        daemon.run_forever()
+
+        assert time.monotonic() - start < 5
+        assert daemon.cycles == 1
+
+    def test_async_daemon_reuses_session(self, monkeypatch):
+        """Test the async engine keeps one async session for every cycle."""
+        import paper_poller
+
+        main_module = paper_poller.paper_poller_main
+        monkeypatch.setattr(main_module, "USE_ASYNC", True)
+
+        session = object()
+        sessions_opened = []
+
+        class FakeClient:
+            async def connect_async(self):
+                sessions_opened.append(session)
+                return session
+
+            async def close_async(self):
+                sessions_opened.remove(session)
+
+        seen_sessions = []
+
+        async def fake_run_projects_async(projects, active_session=None):
+            seen_sessions.append(active_session)
+
+        monkeypatch.setattr(main_module, "_async_client", FakeClient)
+        monkeypatch.setattr(main_module, "run_projects_async", fake_run_projects_async)
+
+        daemon = paper_poller.PollerDaemon([PaperAPI()], interval=0, jitter=0)
+        daemon.run_forever(max_cycles=2)
+
+        assert seen_sessions == [session, session]
+        # Opened once, and closed when the daemon stopped
+        assert sessions_opened == []
+
+    def test_next_delay_within_jitter(self):
+        """Test the delay between cycles stays within the jitter bounds."""
+        import paper_poller
+
+        daemon = paper_poller.PollerDaemon([], interval=30, jitter=5)
+        delays = [daemon.next_delay() for _ in range(100)]
+        assert all(25 <= delay <= 35 for delay in delays)
+        assert paper_poller.PollerDaemon([], interval=1, jitter=5).next_delay() >= 0
+
+
+class TestStateLoadedOncePerRun:
+    """Integration tests for the in-memory state layer."""
+
+    @staticmethod
+    def _versions_response(count, build_id):
+        return {
+            "project": {
+                "id": "paper",
+                "versions": [
+                    {
+                        "id": f"1.{index}",
+                        "builds": [
+                            {
+                                "id": build_id,
+                                "channel": "STABLE",
+                                "download": {"url": "https://example.com/paper.jar"},
+                                "commits": [],
+                                "time": "2025-10-12T12:00:00.000Z",
+                            }
+                        ],
+                    }
+                    for index in range(count)
+                ],
+            }
+        }
+
+    def test_multi_version_run_reads_and_writes_once(
+        self, tmp_path, monkeypatch, mocker
+    ):
+        """Test a run with many changed versions parses and writes the file once."""
+        import paper_poller
+
+        monkeypatch.chdir(tmp_path)
+        monkeypatch.setattr(paper_poller.paper_poller_main, "DRY_RUN", True)
+
+        api = PaperAPI()
+        for index in range(20):
+            api.write_version_to_json(f"1.{index}", "1", "STABLE")
+
+        load_spy = mocker.spy(json, "load")
+        dump_spy = mocker.spy(json, "dump")
+        api.get_all_versions = Mock(return_value=self._versions_response(20, "2"))
+        api._run_multi_version_mode()
+
+        assert load_spy.call_count == 1
+        assert dump_spy.call_count == 1
+        with open("paper_poller.json", "r") as f:
+            data = json.load(f)
+        assert all(v["build"] == "2" for v in data["versions"].values())
+        assert len(data["versions"]) == 20
+
+    def test_up_to_date_run_does_not_write(self, tmp_path, monkeypatch, mocker):
+        """Test nothing is written back when nothing changed."""
+        import paper_poller
+
+        monkeypatch.chdir(tmp_path)
+        monkeypatch.setattr(paper_poller.paper_poller_main, "DRY_RUN", True)
+
+        api = PaperAPI()
+        for index in range(5):
+            api.write_version_to_json(f"1.{index}", "2", "STABLE")
+
+        dump_spy = mocker.spy(json, "dump")
+        api.get_all_versions = Mock(return_value=self._versions_response(5, "2"))
+        api._run_multi_version_mode()
+
+        dump_spy.assert_not_called()
+
+    def test_state_is_written_when_run_fails(self, tmp_path, monkeypatch):
+        """Test updates recorded before an error are still saved."""
+        import paper_poller
+
+        monkeypatch.chdir(tmp_path)
+        monkeypatch.setattr(paper_poller.paper_poller_main, "DRY_RUN", False)
+
+        api = PaperAPI()
+        api.get_all_versions = Mock(return_value=self._versions_response(2, "2"))
+        api._process_and_send_update = Mock(
+            side_effect=[None, RuntimeError("Webhook crashed")]
+        )
+
+        with pytest.raises(RuntimeError):
+            api._run_multi_version_mode()
+
+        with open("paper_poller.json", "r") as f:
+            data = json.load(f)
+        assert set(data["versions"]) == {"1.0", "1.1"}
+
+    def test_state_session_is_reentrant(self, tmp_path, monkeypatch):
+        """Test lookups inside a session see writes made in the same session."""
+        monkeypatch.chdir(tmp_path)
+
+        api = PaperAPI()
+        with api.state_session():
+            api.write_version_to_json("1.21.1", "123", "STABLE")
+            assert not os.path.exists("paper_poller.json")
+            with api.state_session():
+                assert api.up_to_date_for_version("1.21.1", "123") is True
+            assert not os.path.exists("paper_poller.json")
+
+        assert os.path.exists("paper_poller.json")
+        assert api.up_to_date_for_version("1.21.1", "123") is True
+
+
+def _version_entry(version, build, days_ago):
+    """A version with one build, as returned by the versions page query."""
+    build_time = time.strftime(
+        "%Y-%m-%dT%H:%M:%S.000Z", time.gmtime(time.time() - days_ago * 86400)
+    )
+    return {
+        "id": version,
+        "builds": [
+            {
+                "id": build,
+                "channel": "STABLE",
+                "download": {
+                    "name": f"paper-{version}-{build}.jar",
+                    "size": 50000000,
+                    "url": f"https://example.com/paper-{version}-{build}.jar",
+                    "checksums": {"sha256": "abcdef1234567890"},
+                },
+                "commits": [],
+                "time": build_time,
+            }
+        ],
+    }
+
+
+class TestVersionWindow:
+    """Integration tests for the tracked-version window."""
+
+    @pytest.fixture
+    def main_module(self, main_module, monkeypatch):
+        monkeypatch.setattr(main_module, "CHECK_ALL_VERSIONS", True)
+        monkeypatch.setattr(main_module, "VERSION_PAGE_SIZE", 2)
+        return main_module
+
+    def test_build_batched_query_pages_versions(self):
+        """Test a windowed batch asks for the newest versions only."""
+        from graphql import print_ast
+
+        from paper_poller import build_batched_query
+
+        query, variables = build_batched_query(["paper"], batch_all_versions=True, last=5)
+        document = print_ast(query.document)
+
+        assert variables == {"p0": "paper", "last": 5}
+        assert "versions(last: $last)" in document
+
+    def test_count_window_fetches_one_page(self, main_module, monkeypatch):
+        """Test a count-only window is covered by a single request."""
+        monkeypatch.setattr(main_module, "VERSION_WINDOW", 3)
+        versions = [_version_entry(v, "1", 1) for v in ("1.20", "1.21", "1.21.1")]
+        mock_client = MagicMock()
+        mock_client.execute.return_value = {"project": {"id": "paper", "versions": versions}}
+        monkeypatch.setattr(main_module, "client", mock_client)
+
+        result = PaperAPI().get_all_versions()
+
+        assert mock_client.execute.call_count == 1
+        assert mock_client.execute.call_args.kwargs["variable_values"]["last"] == 3
+        assert result["project"]["versions"] == versions
+
+    def test_age_window_pages_until_covered(self, main_module, monkeypatch):
+        """Test paging stops once the oldest version falls out of the age window."""
+        monkeypatch.setattr(main_module, "VERSION_MAX_AGE_DAYS", 30)
+        recent = [_version_entry("1.21", "1", 5), _version_entry("1.21.1", "1", 1)]
+        older = [_version_entry("1.19", "1", 400), _version_entry("1.20", "1", 10)]
+        mock_client = MagicMock()
+        mock_client.execute.side_effect = [
+            {"project": {"id": "paper", "versions": recent}},
+            {"project": {"id": "paper", "versions": older + recent}},
+        ]
+        monkeypatch.setattr(main_module, "client", mock_client)
+
+        result = PaperAPI().get_all_versions()
+
+        pages = [c.kwargs["variable_values"]["last"] for c in mock_client.execute.call_args_list]
+        assert pages == [2, 4]
+        window = main_module.filter_version_window(result["project"]["versions"])
+        assert [v["id"] for v in window] == ["1.20", "1.21", "1.21.1"]
+
+    def test_versions_outside_window_are_archived(self, main_module, monkeypatch, capsys):
+        """Test stored versions that left the window move to the archive file."""
+        monkeypatch.setattr(main_module, "VERSION_WINDOW", 2)
+        api = PaperAPI()
+        for version in ("1.19", "1.20", "1.21"):
+            api.write_version_to_json(version, "1", "STABLE")
+
+        versions = [_version_entry("1.20", "1", 10), _version_entry("1.21", "2", 1)]
+        api._run_multi_version_mode({"project": {"id": "paper", "versions": versions}})
+
+        with open("paper_poller.json", "r") as f:
+            assert set(json.load(f)["versions"]) == {"1.20", "1.21"}
+        with open("paper_poller_archive.json", "r") as f:
+            assert json.load(f)["versions"] == {"1.19": {"build": "1", "channel": "STABLE"}}
+        assert "Archived 1 paper versions" in capsys.readouterr().out
+
+    def test_batched_first_page_is_continued(self, main_module, monkeypatch):
+        """Test run() pages on from a batched first page that does not cover the window."""
+        monkeypatch.setattr(main_module, "VERSION_WINDOW", 4)
+        monkeypatch.setattr(main_module, "VERSION_MAX_AGE_DAYS", 30)
+        first_page = [_version_entry("1.21", "1", 5), _version_entry("1.21.1", "1", 1)]
+        full_page = [_version_entry("1.19", "1", 40), _version_entry("1.20", "1", 10)] + first_page
+        mock_client = MagicMock()
+        mock_client.execute.return_value = {"project": {"id": "paper", "versions": full_page}}
+        monkeypatch.setattr(main_module, "client", mock_client)
+
+        api = PaperAPI()
+        api.run({"project": {"id": "paper", "versions": first_page}})
+
+        assert mock_client.execute.call_count == 1
+        assert mock_client.execute.call_args.kwargs["variable_values"]["last"] == 4
+        with open("paper_poller.json", "r") as f:
+            assert set(json.load(f)["versions"]) == {"1.20", "1.21", "1.21.1"}
+
+
+class TestTwoPhasePoll:
+    """Integration tests for probing build ids before fetching build details."""
+
+    @pytest.fixture
+    def main_module(self, main_module, monkeypatch):
+        monkeypatch.setattr(main_module, "TWO_PHASE_POLL", True)
+        return main_module
+
+    @staticmethod
+    def _probe(*versions):
+        """A probe response, versions are (version, build) pairs, oldest first."""
+        return {
+            "project": {
+                "id": "paper",
+                "versions": [
+                    {
+                        "id": version,
+                        "builds": [
+                            {"id": build, "time": "2025-10-12T12:00:00.000Z", "channel": "STABLE"}
+                        ],
+                    }
+                    for version, build in versions
+                ],
+            }
+        }
+
+    def test_build_details_query_aliases_each_version(self):
+        """Test the details query asks for every changed version by id."""
+        from graphql import print_ast
+
+        import paper_poller
+
+        main_module = paper_poller.paper_poller_main
+        query, variables = main_module.build_details_query("paper", ["1.21", "1.21.1"])
+        document = print_ast(query.document)
+
+        assert variables == {"project": "paper", "v0": "1.21", "v1": "1.21.1"}
+        assert "v0: version(id: $v0)" in document
+        assert "v1: version(id: $v1)" in document
+        assert "commits" in document
+
+    def test_probe_query_skips_details(self, main_module):
+        """Test the probe query leaves out commits and downloads."""
+        from graphql import print_ast
+
+        document = print_ast(main_module.select_query(probe=True).document)
+
+        assert "commits" not in document
+        assert "download" not in document
+
+    def test_up_to_date_probe_sends_one_query(self, main_module, monkeypatch):
+        """Test nothing but the probe is fetched when the build is already stored."""
+        monkeypatch.setattr(main_module, "CHECK_ALL_VERSIONS", False)
+        mock_client = MagicMock()
+        mock_client.execute.return_value = self._probe(("1.21.1", "123"))
+        monkeypatch.setattr(main_module, "client", mock_client)
+
+        api = PaperAPI()
+        api.write_to_json("1.21.1", "123", "STABLE")
+        api.run()
+
+        assert mock_client.execute.call_count == 1
+        assert mock_client.execute.call_args.args[0] is main_module.latest_probe_query
+
+    def test_new_build_fetches_details(
+        self, main_module, monkeypatch, sample_latest_build_response
+    ):
+        """Test a new build is announced with the details from the second query."""
+        monkeypatch.setattr(main_module, "CHECK_ALL_VERSIONS", False)
+        version_data = sample_latest_build_response["project"]["versions"][0]
+        mock_client = MagicMock()
+        mock_client.execute.side_effect = [
+            self._probe(("1.21.1", "123")),
+            {"project": {"id": "paper", "v0": version_data}},
+        ]
+        monkeypatch.setattr(main_module, "client", mock_client)
+
+        api = PaperAPI()
+        api._process_and_send_update = Mock(return_value=[])
+        api.run()
+
+        assert mock_client.execute.call_args.kwargs["variable_values"] == {
+            "project": "paper",
+            "v0": "1.21.1",
+        }
+        build_info = api._process_and_send_update.call_args.args[1]
+        assert build_info["commits"] == version_data["builds"][0]["commits"]
+        assert api.get_stored_data()["build"] == "123"
+
+    def test_multi_version_fetches_only_changed_versions(
+        self, main_module, monkeypatch, sample_all_versions_response
+    ):
+        """Test details are only requested for the versions with a new build."""
+        monkeypatch.setattr(main_module, "CHECK_ALL_VERSIONS", True)
+        details = {
+            version_data["id"]: version_data
+            for version_data in sample_all_versions_response["project"]["versions"]
+        }
+        mock_client = MagicMock()
+        mock_client.execute.side_effect = [
+            self._probe(("1.21", "120"), ("1.21.1", "123")),
+            {"project": {"id": "paper", "v0": details["1.21.1"]}},
+        ]
+        monkeypatch.setattr(main_module, "client", mock_client)
+
+        api = PaperAPI()
+        api.write_version_to_json("1.21", "120", "RECOMMENDED")
+        api.run()
+
+        assert mock_client.execute.call_args.kwargs["variable_values"] == {
+            "project": "paper",
+            "v0": "1.21.1",
+        }
+        assert api.up_to_date_for_version("1.21.1", "123") is True
+
+    def test_version_without_details_is_not_stored(self, main_module, monkeypatch):
+        """Test a build whose details are missing is retried on the next poll."""
+        monkeypatch.setattr(main_module, "CHECK_ALL_VERSIONS", True)
+        mock_client = MagicMock()
+        mock_client.execute.side_effect = [
+            self._probe(("1.21.1", "123")),
+            {"project": {"id": "paper", "v0": None}},
+        ]
+        monkeypatch.setattr(main_module, "client", mock_client)
+
+        api = PaperAPI()
+        api.run()
+
+        assert api.up_to_date_for_version("1.21.1", "123") is False
+
+    def test_version_without_details_is_announced_by_the_next_poll(
+        self, main_module, monkeypatch, sample_all_versions_response
+    ):
+        """Test a run missing build details is not fingerprinted, so the next poll sends it."""
+        monkeypatch.setattr(main_module, "CHECK_ALL_VERSIONS", True)
+        monkeypatch.setattr(main_module, "FINGERPRINT_RESPONSES", True)
+        version_data = sample_all_versions_response["project"]["versions"][0]
+        probe = self._probe(("1.21.1", "123"))
+        mock_client = MagicMock()
+        mock_client.execute.side_effect = [
+            probe,
+            {"project": {"id": "paper", "v0": None}},
+            probe,
+            {"project": {"id": "paper", "v0": version_data}},
+        ]
+        monkeypatch.setattr(main_module, "client", mock_client)
+
+        api = PaperAPI()
+        api._process_and_send_update = Mock(return_value=[])
+        api.run()
+
+        assert not os.path.exists("paper_poller_fingerprint.json")
+        api._process_and_send_update.assert_not_called()
+
+        # The same probe again, this time the details are there
+        api.run()
+
+        assert mock_client.execute.call_count == 4
+        assert api._process_and_send_update.call_args.args[0] == "1.21.1"
+        assert api.up_to_date_for_version("1.21.1", "123") is True
+        assert os.path.exists("paper_poller_fingerprint.json")
+
+    def test_async_run_fetches_details(
+        self, main_module, monkeypatch, sample_latest_build_response
+    ):
+        """Test the async engine runs both phases over its session."""
+        import asyncio
+
+        monkeypatch.setattr(main_module, "CHECK_ALL_VERSIONS", False)
+        version_data = sample_latest_build_response["project"]["versions"][0]
+        session = MagicMock()
+
+        async def execute(query, variable_values=None):
+            if "v0" in variable_values:
+                return {"project": {"id": "paper", "v0": version_data}}
+            return self._probe(("1.21.1", "123"))
+
+        session.execute = execute
+        api = PaperAPI()
+        asyncio.run(api.run_async(session))
+
+        assert api.get_stored_data()["build"] == "123"
+
+
+class TestResponseFingerprint:
+    """Integration tests for skipping runs whose upstream response did not change."""
+
+    @pytest.fixture
+    def main_module(self, main_module, monkeypatch):
+        monkeypatch.setattr(main_module, "FINGERPRINT_RESPONSES", True)
+        monkeypatch.setattr(main_module, "CHECK_ALL_VERSIONS", True)
+        return main_module
+
+    def test_fingerprint_ignores_key_order(self, main_module):
+        """Test equal responses hash the same however their keys are ordered."""
+        first = {"project": {"id": "paper", "versions": []}}
+        second = {"project": {"versions": [], "id": "paper"}}
+
+        assert main_module.response_fingerprint(first) == main_module.response_fingerprint(
+            second
+        )
+
+    def test_unchanged_response_skips_state(
+        self, main_module, monkeypatch, mocker, capsys, sample_all_versions_response
+    ):
+        """Test a repeated response exits before the state is loaded."""
+        api = PaperAPI()
+        api.run(sample_all_versions_response)
+        load = mocker.spy(main_module.JsonStateBackend, "load")
+        capsys.readouterr()
+
+        api.run(sample_all_versions_response)
+
+        load.assert_not_called()
+        assert "Skipped run for paper: response unchanged" in capsys.readouterr().out
+
+    def test_fingerprint_survives_restarts(
+        self, main_module, capsys, sample_all_versions_response
+    ):
+        """Test a cron run picks up the fingerprint stored by the previous run."""
+        PaperAPI().run(sample_all_versions_response)
+        assert os.path.exists("paper_poller_fingerprint.json")
+        capsys.readouterr()
+
+        PaperAPI().run(sample_all_versions_response)
+
+        assert "Skipped run for paper" in capsys.readouterr().out
+
+    def test_changed_response_is_processed(
+        self, main_module, capsys, sample_all_versions_response
+    ):
+        """Test a new build in the response goes through the full run."""
+        api = PaperAPI()
+        api.run(sample_all_versions_response)
+
+        changed = json.loads(json.dumps(sample_all_versions_response))
+        changed["project"]["versions"][0]["builds"][0]["id"] = "124"
+        capsys.readouterr()
+        api.run(changed)
+
+        assert "New build for paper 1.21.1" in capsys.readouterr().out
+        assert api.up_to_date_for_version("1.21.1", "124") is True
+
+    def test_failed_run_is_not_fingerprinted(self, main_module):
+        """Test a response that could not be processed is retried next time."""
+        api = PaperAPI()
+        api.run({"project": {}})
+
+        assert not os.path.exists("paper_poller_fingerprint.json")
+        assert api.last_fingerprint is None
+
+
+class TestCatchUp:
+    """Integration tests for announcing builds missed between polls."""
+
+    @patch("requests.Session.post")
+    def test_missed_builds_are_sent_in_one_message(
+        self, mock_post, tmp_path, monkeypatch, sample_all_versions_response
+    ):
+        """Test a gap of builds results in a single message listing every commit."""
+        import paper_poller
+
+        monkeypatch.chdir(tmp_path)
+        main_module = paper_poller.paper_poller_main
+        monkeypatch.setattr(main_module, "DRY_RUN", False)
+        monkeypatch.setattr(main_module, "webhook_urls", ["https://discord.com/api/webhooks/1/a"])
+        mock_post.return_value.status_code = 204
+        mock_post.return_value.headers = {}
+
+        mock_client = MagicMock()
+        mock_client.execute.return_value = {
+            "project": {
+                "id": "paper",
+                "version": {
+                    "id": "1.21.1",
+                    "builds": [
+                        {"id": "121", "commits": [{"sha": "121abcdef", "message": "Missed fix"}]},
+                        {"id": "122", "commits": [{"sha": "122abcdef", "message": "Missed feature"}]},
+                        {"id": "123", "commits": []},
+                    ],
+                },
+            }
+        }
+        monkeypatch.setattr(main_module, "client", mock_client)
+
+        api = PaperAPI()
+        api.write_version_to_json("1.21.1", "120", "STABLE")
+        api.write_version_to_json("1.21", "120", "RECOMMENDED")
+        api._run_multi_version_mode(sample_all_versions_response)
+
+        assert mock_client.execute.call_args.kwargs["variable_values"] == {
+            "project": "paper",
+            "version": "1.21.1",
+            "last": 3,
+        }
+        assert mock_post.call_count == 1
+        payload = mock_post.call_args.kwargs["data"].decode()
+        assert "Missed fix" in payload
+        assert "Missed feature" in payload
+        assert "Builds 121 to 123" in payload
+        assert api.up_to_date_for_version("1.21.1", "123") is True
+
+
+class TestCoalescedMultiVersionUpdates:
+    """Integration tests for coalescing multi-version updates."""
+
+    @patch("requests.Session.post")
+    def test_changed_versions_share_one_post(
+        self, mock_post, tmp_path, monkeypatch, sample_all_versions_response
+    ):
+        """Test every changed version of a run goes out in one post per webhook."""
+        import paper_poller
+
+        monkeypatch.chdir(tmp_path)
+        main_module = paper_poller.paper_poller_main
+        monkeypatch.setattr(main_module, "DRY_RUN", False)
+        monkeypatch.setattr(main_module, "COALESCE_UPDATES", True)
+        monkeypatch.setattr(
+            main_module,
+            "webhook_urls",
+            ["https://discord.com/api/webhooks/1/a", "https://discord.com/api/webhooks/2/b"],
+        )
+        mock_post.return_value.status_code = 204
+        mock_post.return_value.headers = {}
+
+        api = PaperAPI()
+        api.write_version_to_json("1.21.1", "122", "STABLE")
+        api.write_version_to_json("1.21", "119", "RECOMMENDED")
+        api._run_multi_version_mode(sample_all_versions_response)
+
+        assert mock_post.call_count == 2
+        payload = json.loads(mock_post.call_args.kwargs["data"])
+        containers = [c for c in payload["components"] if c["type"] == 17]
+        assert len(containers) == 2
+        assert api.up_to_date_for_version("1.21", "120") is True
+
+
+class TestPersistedQueries:
+    """Integration tests for automatic persisted queries against a local GraphQL server."""
+
+    @staticmethod
+    def _poll(server, support, response=None):
+        from gql import Client
+
+        import paper_poller
+
+        main_module = paper_poller.paper_poller_main
+        transport = main_module.lazy("PersistedQueryTransport")(url=server.url, support=support)
+        if response is not None:
+            server.respond = lambda payload: response
+        with Client(transport=transport) as session:
+            return session.execute(
+                main_module.lazy("latest_query"), variable_values={"project": "paper"}
+            )
+
+    def test_known_hash_is_sent_without_the_query(self, tmp_path, sample_latest_build_response):
+        """Test the query text is sent once to register it, then only its hash."""
+        from paper_poller import PersistedQuerySupport
+        from tests.fake_upstreams import FakeGraphQLServer
+
+        support = PersistedQuerySupport(str(tmp_path / "apq.json"))
+        with FakeGraphQLServer() as server:
+            first = self._poll(server, support, sample_latest_build_response)
+            registered = len(server.requests)
+            second = self._poll(server, support, sample_latest_build_response)
+            payloads = server.payloads
+
+        assert first == second == sample_latest_build_response
+        assert registered == 2
+        assert "query" not in payloads[0] and "query" in payloads[1]
+        assert len(payloads) == 3 and "query" not in payloads[2]
+        assert payloads[2]["extensions"]["persistedQuery"]["version"] == 1
+        assert payloads[2]["variables"] == {"project": "paper"}
+        assert len(server.requests[2][1]) < len(server.requests[1][1]) / 2
+
+    @pytest.mark.parametrize("mode", ["not_supported", "ignored"])
+    def test_unsupported_server_is_remembered(self, tmp_path, mode, sample_latest_build_response):
+        """Test servers without persisted queries get the plain query from then on."""
+        from paper_poller import PersistedQuerySupport
+        from tests.fake_upstreams import FakeGraphQLServer
+
+        cache_file = str(tmp_path / "apq.json")
+        with FakeGraphQLServer(persisted_queries=mode) as server:
+            first = self._poll(server, PersistedQuerySupport(cache_file), sample_latest_build_response)
+            assert len(server.requests) == 2
+
+            # A new process reads the answer back from the cache file
+            second = self._poll(server, PersistedQuerySupport(cache_file), sample_latest_build_response)
+            payloads = server.payloads
+
+        assert first == second == sample_latest_build_response
+        assert len(payloads) == 3
+        assert "extensions" not in payloads[2] and "query" in payloads[2]
+        with open(cache_file, "r") as f:
+            assert json.load(f)[server.url]["supported"] is False
+
+    def test_server_errors_are_not_cached_as_unsupported(self, tmp_path):
+        """Test a 5xx answer to a hash-only request is raised and leaves the cache alone."""
+        from gql.transport.exceptions import TransportServerError
+
+        from paper_poller import PersistedQuerySupport
+        from tests.fake_upstreams import FakeGraphQLServer
+
+        support = PersistedQuerySupport(str(tmp_path / "apq.json"))
+        with FakeGraphQLServer(persisted_queries="unavailable") as server:
+            with pytest.raises(TransportServerError) as error:
+                self._poll(server, support)
+            payloads = server.payloads
+
+        assert error.value.code == 503
+        # Not followed by the plain query, the retries send the hash again
+        assert len(payloads) == 1
+        assert support.supported(server.url) is True
+        assert not os.path.exists(tmp_path / "apq.json")
+
+    def test_async_server_errors_are_not_cached_as_unsupported(self, tmp_path):
+        """Test the async transport also raises a 5xx answer instead of caching it."""
+        import asyncio
+
+        from gql import Client
+        from gql.transport.exceptions import TransportServerError
+
+        import paper_poller
+        from paper_poller import PersistedQuerySupport
+        from tests.fake_upstreams import FakeGraphQLServer
+
+        main_module = paper_poller.paper_poller_main
+        support = PersistedQuerySupport(str(tmp_path / "apq.json"))
+
+        async def poll(url):
+            transport = main_module.lazy("AsyncPersistedQueryTransport")(url=url, support=support)
+            async with Client(transport=transport) as session:
+                return await session.execute(
+                    main_module.lazy("latest_query"), variable_values={"project": "paper"}
+                )
+
+        with FakeGraphQLServer(persisted_queries="unavailable") as server:
+            with pytest.raises(TransportServerError) as error:
+                asyncio.run(poll(server.url))
+
+        assert error.value.code == 503
+        assert support.supported(server.url) is True
+
+    def test_unsupported_server_is_retried_later(self, tmp_path, sample_latest_build_response):
+        """Test a server that rejected persisted queries is asked again after the retry delay."""
+        from paper_poller import PersistedQuerySupport
+        from tests.fake_upstreams import FakeGraphQLServer
+
+        support = PersistedQuerySupport(str(tmp_path / "apq.json"), retry_after=0)
+        with FakeGraphQLServer(persisted_queries="not_supported") as server:
+            self._poll(server, support, sample_latest_build_response)
+            server.persisted_queries = "supported"
+            self._poll(server, support, sample_latest_build_response)
+            self._poll(server, support, sample_latest_build_response)
+            payloads = server.payloads
+
+        assert "query" not in payloads[-1]
+        assert support.supported(server.url) is True
+
+    def test_query_errors_are_not_cached_as_unsupported(self, tmp_path):
+        """Test a failing query on a persisted query server keeps it marked as supported."""
+        from gql.transport.exceptions import TransportQueryError
+
+        from paper_poller import PersistedQuerySupport
+        from tests.fake_upstreams import FakeGraphQLServer
+
+        def fail(payload):
+            raise ValueError("Project not found")
+
+        support = PersistedQuerySupport(str(tmp_path / "apq.json"))
+        with FakeGraphQLServer(respond=fail) as server:
+            # Registers the hash, then fails again with the hash alone
+            for _ in range(2):
+                with pytest.raises(TransportQueryError):
+                    self._poll(server, support)
+
+        assert support.supported(server.url) is True
+        with open(tmp_path / "apq.json", "r") as f:
+            assert json.load(f)[server.url]["supported"] is True
+
+
+class TestFakeUpstreams:
+    """End-to-end poll cycles against the local fake GraphQL API and Discord sink."""
+
+    def test_poll_cycle_announces_only_new_builds(self, tmp_path, monkeypatch):
+        """Test a cycle over real HTTP announces every project, then only new releases."""
+        import paper_poller
+        from tests.fake_upstreams import FakeDiscordServer, FakeFillServer
+
+        monkeypatch.chdir(tmp_path)
+        main_module = paper_poller.paper_poller_main
+        monkeypatch.setattr(main_module, "DRY_RUN", False)
+        monkeypatch.setattr(main_module, "CHECK_ALL_VERSIONS", False)
+        monkeypatch.setattr(main_module, "APQ_CACHE_FILE", str(tmp_path / "apq.json"))
+        monkeypatch.setattr(main_module, "_persisted_query_support", None)
+
+        with FakeFillServer(versions=2, builds=3) as graphql, FakeDiscordServer() as discord:
+            monkeypatch.setattr(main_module, "gql_base", graphql.url)
+            monkeypatch.setattr(main_module, "client", main_module._create_client())
+            monkeypatch.setattr(main_module, "webhook_urls", discord.webhook_urls(2))
+            projects = [PaperAPI(project=project) for project in FakeFillServer.PROJECTS]
+
+            paper_poller.run_projects(projects)
+            assert len(discord.requests) == 8
+
+            paper_poller.run_projects(projects)
+            assert len(discord.requests) == 8
+
+            graphql.release(2)
+            paper_poller.run_projects(projects)
+            new_posts = [json.loads(body) for _, body in discord.requests[8:]]
+
+        assert len(new_posts) == 8
+        assert "paper-1.1-5.jar" in json.dumps(new_posts)
+        assert os.path.exists("graphql_schema.json")
+
+
+class TestMetrics:
+    """Integration tests for the metrics collected during a poll cycle."""
+
+    @pytest.fixture(autouse=True)
+    def clear_metrics(self):
+        import paper_poller
+
+        paper_poller.metrics.clear()
+        yield
+        paper_poller.metrics.clear()
+
+    def test_cycle_records_latency_and_updates(self, tmp_path, monkeypatch):
+        """Test a cycle against the fake upstreams fills every metric it touches."""
+        import paper_poller
+        from tests.fake_upstreams import FakeDiscordServer, FakeFillServer
+
+        monkeypatch.chdir(tmp_path)
+        main_module = paper_poller.paper_poller_main
+        monkeypatch.setattr(main_module, "DRY_RUN", False)
+        monkeypatch.setattr(main_module, "CHECK_ALL_VERSIONS", False)
+        monkeypatch.setattr(main_module, "APQ_CACHE_FILE", str(tmp_path / "apq.json"))
+        monkeypatch.setattr(main_module, "_persisted_query_support", None)
+
+        with FakeFillServer(versions=1, builds=2) as graphql, FakeDiscordServer() as discord:
+            monkeypatch.setattr(main_module, "gql_base", graphql.url)
+            monkeypatch.setattr(main_module, "client", main_module._create_client())
+            monkeypatch.setattr(main_module, "webhook_urls", discord.webhook_urls(1))
+            webhook = main_module.describe_webhook_url(discord.webhook_urls(1)[0])
+            projects = [PaperAPI(project=project) for project in FakeFillServer.PROJECTS]
+            paper_poller.run_projects(projects)
+
+        assert main_module.cycle_seconds.count() == 1
+        assert main_module.graphql_request_seconds.count(project="all") == 1
+        assert main_module.graphql_request_seconds.count(project="paper") == 1
+        assert main_module.webhook_request_seconds.count(webhook=webhook, status=204) == 4
+        assert main_module.state_io_seconds.count(project="paper", operation="save") == 1
+        assert main_module.updates_total.value(project="folia") == 1
+        assert main_module.errors_total.value(stage="webhook") == 0
+        assert "token" not in paper_poller.metrics.render()
+
+    @patch("requests.Session.post")
+    def test_rate_limits_and_failures_are_counted(self, mock_post, monkeypatch):
+        """Test 429 answers and failed deliveries show up in the counters."""
+        import paper_poller
+
+        main_module = paper_poller.paper_poller_main
+        monkeypatch.setattr(main_module, "_webhook_dispatcher", None)
+        rate_limited = Mock(status_code=429, headers={"Retry-After": "0"})
+        rate_limited.json.return_value = {}
+        mock_post.return_value = rate_limited
+
+        url = "https://discord.com/api/webhooks/1/secret"
+        result = main_module.get_webhook_dispatcher().post(url, {"content": "hi"})
+
+        webhook = "discord.com/api/webhooks/1"
+        assert not result.ok
+        assert main_module.rate_limited_total.value(webhook=webhook) == main_module.WEBHOOK_MAX_RETRIES + 1
+        assert main_module.errors_total.value(stage="webhook") == 1
+
+    def test_metrics_endpoint_serves_text_format(self):
+        """Test the daemon's metrics endpoint answers with the Prometheus text format."""
+        import urllib.error
+        import urllib.request
+
+        import paper_poller
+
+        paper_poller.paper_poller_main.updates_total.inc(project="paper")
+        server = paper_poller.start_metrics_server("127.0.0.1", 0)
+        try:
+            base = f"http://127.0.0.1:{server.server_address[1]}"
+            with urllib.request.urlopen(f"{base}/metrics") as response:
+                body = response.read().decode()
+                content_type = response.headers["Content-Type"]
+            with pytest.raises(urllib.error.HTTPError):
+                urllib.request.urlopen(f"{base}/other")
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        assert content_type.startswith("text/plain; version=0.0.4")
+        assert 'paper_poller_updates_total{project="paper"} 1' in body
+
+    def test_daemon_polls_when_metrics_port_is_taken(self, tmp_path, monkeypatch, capsys):
+        """Test a metrics port already in use is logged and the daemon still polls."""
+        import socket
+
+        import paper_poller
+
+        monkeypatch.chdir(tmp_path)
+        main_module = paper_poller.paper_poller_main
+        monkeypatch.setattr(main_module, "DAEMON_MODE", True)
+        monkeypatch.setattr(main_module, "SUBSCRIBE", False)
+        monkeypatch.setattr(main_module, "METRICS_ADDR", "127.0.0.1")
+        cycles = []
+        monkeypatch.setattr(
+            main_module.PollerDaemon, "run_forever", lambda self: cycles.append(self)
+        )
+
+        with socket.socket() as taken:
+            taken.bind(("127.0.0.1", 0))
+            taken.listen()
+            monkeypatch.setattr(main_module, "METRICS_PORT", taken.getsockname()[1])
+            main_module.main()
+
+        out = capsys.readouterr().out
+        assert "Could not serve metrics on 127.0.0.1" in out
+        assert "Error during execution" not in out
+        assert len(cycles) == 1
+        assert 'paper_poller_errors_total{stage="metrics"} 1' in paper_poller.metrics.render()
+
+    def test_cron_run_writes_textfile(self, tmp_path, monkeypatch):
+        """Test main() writes the metrics for the textfile collector after a run."""
+        import paper_poller
+
+        monkeypatch.chdir(tmp_path)
+        main_module = paper_poller.paper_poller_main
+        monkeypatch.setattr(main_module, "METRICS_FILE", str(tmp_path / "paper_poller.prom"))
+        monkeypatch.setattr(main_module, "DAEMON_MODE", False)
+        monkeypatch.setattr(main_module, "USE_ASYNC", False)
+        monkeypatch.setattr(main_module, "run_projects", lambda projects: None)
+
+        main_module.main()
+
+        with open(tmp_path / "paper_poller.prom", "r") as f:
+            assert "# TYPE paper_poller_cycle_seconds histogram" in f.read()
+        assert not os.path.exists(tmp_path / "paper_poller.prom.tmp")
+
+
+class TestProfileMode:
+    """Integration tests for the --profile run report."""
+
+    @patch("requests.Session.post")
+    def test_report_times_every_phase(
+        self, mock_post, tmp_path, monkeypatch, sample_all_versions_response
+    ):
+        """Test a profiled run reports GraphQL, state, changelog and webhook phases."""
+        import paper_poller
+
+        monkeypatch.chdir(tmp_path)
+        main_module = paper_poller.paper_poller_main
+        monkeypatch.setattr(main_module, "DRY_RUN", False)
+        monkeypatch.setattr(main_module, "CHECK_ALL_VERSIONS", True)
+        monkeypatch.setattr(main_module, "TWO_PHASE_POLL", False)
+        monkeypatch.setattr(main_module, "FINGERPRINT_RESPONSES", False)
+        monkeypatch.setattr(main_module, "webhook_urls", ["https://discord.com/api/webhooks/1/a"])
+        mock_client = Mock()
+        mock_client.execute.return_value = sample_all_versions_response
+        monkeypatch.setattr(main_module, "client", mock_client)
+        mock_post.return_value.status_code = 204
+        mock_post.return_value.headers = {}
+
+        profiler = paper_poller.RunProfiler(use_cprofile=True, use_tracemalloc=True, top=5)
+        monkeypatch.setattr(main_module, "active_profiler", profiler)
+        profiler.start()
+        PaperAPI().run()
+        path = profiler.write_report(str(tmp_path / "profiles"))
+
+        with open(path, "r") as f:
+            report = json.load(f)
+        assert set(report["phases"]) == {"graphql", "state", "changelog", "webhook"}
+        assert report["functions"]["PaperAPI.get_all_versions"]["calls"] == 1
+        assert report["phases"]["changelog"]["calls"] == 2
+        for phase in report["phases"].values():
+            assert 0 <= phase["self_seconds"] <= phase["wall_seconds"]
+        assert report["unaccounted_seconds"] >= 0
+        assert len(report["cprofile"]) == 5
+        assert report["tracemalloc"]["peak_bytes"] > 0
+
+    def test_nested_phases_are_not_counted_twice(self):
+        """Test the self time of a phase leaves out the phases it called."""
+        import paper_poller
+
+        profiler = paper_poller.RunProfiler()
+        profiler.start()
+        with profiler.phase("outer"):
+            with profiler.phase("inner"):
+                time.sleep(0.02)
+        report = profiler.report()
+
+        assert report["phases"]["outer"]["wall_seconds"] >= 0.02
+        assert report["phases"]["outer"]["self_seconds"] < 0.01
+        assert report["phases"]["inner"]["self_seconds"] >= 0.02
+
+    def test_profile_flag_writes_report(self, tmp_path, monkeypatch, capsys):
+        """Test main() with --profile writes one JSON report for the run."""
+        import paper_poller
+
+        monkeypatch.chdir(tmp_path)
+        main_module = paper_poller.paper_poller_main
+        monkeypatch.setattr(main_module, "PROFILE", True)
+        monkeypatch.setattr(main_module, "DAEMON_MODE", False)
+        monkeypatch.setattr(main_module, "USE_ASYNC", False)
+        monkeypatch.setattr(main_module, "run_projects", lambda projects: None)
+
+        main_module.main()
+
+        reports = os.listdir(tmp_path / "profiles")
+        assert len(reports) == 1 and reports[0].endswith(".json")
+        assert "Wrote profile report to" in capsys.readouterr().out
+        assert main_module.active_profiler is None
+
+
+class TestProjectRegistry:
+    """Integration tests for the configurable project registry and poll schedule."""
+
+    def test_defaults_match_the_known_projects(self):
+        """Test the built-in registry polls the four PaperMC projects, Paper first."""
+        from paper_poller import ProjectRegistry
+
+        registry = ProjectRegistry({})
+        assert [config.id for config in registry.enabled()] == [
+            "paper",
+            "folia",
+            "velocity",
+            "waterfall",
+        ]
+        assert registry.projects["waterfall"].interval > 0
+        assert registry.create_projects()[1].image_url.endswith("folia_logo.256x139.png")
+
+    def test_config_overrides_and_adds_projects(self):
+        """Test config entries change built-in projects and add new ones with the defaults."""
+        from paper_poller import ProjectRegistry
+
+        registry = ProjectRegistry(
+            {
+                "defaults": {"interval": 3600},
+                "projects": {
+                    "waterfall": {"enabled": False},
+                    "velocity": {"priority": 50},
+                    "adventure": {"image_url": "https://example.com/adventure.png"},
+                },
+            }
+        )
+
+        enabled = {config.id: config for config in registry.enabled()}
+        assert list(enabled) == ["velocity", "paper", "folia", "adventure"]
+        assert enabled["velocity"].image_url.endswith("velocity_logo.256x128.png")
+        assert enabled["adventure"].interval == 3600
+        assert enabled["paper"].interval == 0
+
+    def test_unknown_setting_is_rejected(self):
+        """Test a typo in the config fails loudly instead of being ignored."""
+        from paper_poller import ProjectRegistry
+
+        with pytest.raises(ValueError, match="intervall"):
+            ProjectRegistry({"projects": {"paper": {"intervall": 60}}})
+
+    def test_config_is_read_from_env(self, monkeypatch):
+        """Test the registry config can be passed as JSON in PAPER_POLLER_PROJECTS."""
+        from paper_poller import ProjectRegistry
+
+        monkeypatch.setenv("PAPER_POLLER_PROJECTS", '{"projects": {"folia": {"enabled": false}}}')
+        assert "folia" not in [config.id for config in ProjectRegistry().enabled()]
+
+    def test_discovery_adds_unconfigured_projects(self, tmp_path, monkeypatch):
+        """Test projects listed by the GraphQL API are added with the default settings."""
+        import paper_poller
+        from paper_poller import ProjectRegistry
+        from tests.fake_upstreams import FakeFillServer
+
+        main_module = paper_poller.paper_poller_main
+        monkeypatch.chdir(tmp_path)
+        monkeypatch.setattr(main_module, "APQ_CACHE_FILE", str(tmp_path / "apq.json"))
+        monkeypatch.setattr(main_module, "_persisted_query_support", None)
+
+        registry = ProjectRegistry({"discover": True, "defaults": {"priority": -1}})
+        with FakeFillServer(versions=1, builds=1, projects=("paper", "adventure")) as graphql:
+            monkeypatch.setattr(main_module, "gql_base", graphql.url)
+            monkeypatch.setattr(main_module, "client", main_module._create_client())
+            assert registry.discover_projects() == ["adventure"]
+
+        assert [config.id for config in registry.enabled()][-1] == "adventure"
+
+    def test_schedule_skips_projects_until_due(self, tmp_path):
+        """Test a project with an interval is only due again once it has passed."""
+        from paper_poller import PollSchedule, ProjectRegistry
+
+        registry = ProjectRegistry({"projects": {"folia": {"interval": 600}}})
+        projects = registry.create_projects()
+        path = str(tmp_path / "schedule.json")
+
+        schedule = PollSchedule(registry, path)
+        assert len(schedule.due(projects, now=1000)) == 4
+        schedule.mark_polled(projects, now=1000)
+
+        # A new run reads the schedule back from disk
+        schedule = PollSchedule(registry, path)
+        due = [project.project for project in schedule.due(projects, now=1300)]
+        assert due == ["paper", "velocity"]
+        due = [project.project for project in schedule.due(projects, now=1590)]
+        assert due == ["paper", "folia", "velocity"]
+
+    def test_main_polls_only_due_projects(self, tmp_path, monkeypatch):
+        """Test main() builds projects from the registry and records when they were polled."""
+        import paper_poller
+
+        monkeypatch.chdir(tmp_path)
+        main_module = paper_poller.paper_poller_main
+        monkeypatch.setattr(main_module, "DAEMON_MODE", False)
+        monkeypatch.setattr(main_module, "USE_ASYNC", False)
+        monkeypatch.setattr(main_module, "PROJECTS_FILE", str(tmp_path / "projects.json"))
+        monkeypatch.setattr(main_module, "SCHEDULE_FILE", str(tmp_path / "schedule.json"))
+        with open(tmp_path / "projects.json", "w") as f:
+            json.dump({"projects": {"velocity": {"enabled": False}}}, f)
+        polled = []
+        monkeypatch.setattr(
+            main_module,
+            "run_projects",
+            lambda projects: polled.append([project.project for project in projects]),
+        )
+
+        main_module.main()
+        main_module.main()
+
+        assert polled == [["paper", "folia", "waterfall"], ["paper", "folia"]]
+
+
+class TestAdaptivePolling:
+    """Integration tests for polling each project at the pace of its builds."""
+
+    HOUR = 3600.0
+
+    def test_quiet_project_backs_off_exponentially(self):
+        """Test every poll without a build doubles the interval, up to the maximum."""
+        from paper_poller import AdaptiveCadence
+
+        cadence = AdaptiveCadence(60, 3600)
+        intervals = [cadence.next_interval({}, quiet, now=0) for quiet in range(8)]
+        assert intervals == [60, 120, 240, 480, 960, 1920, 3600, 3600]
+        assert cadence.next_interval({}, 8, now=0, max_interval=600) == 600
+
+    def test_polls_faster_after_a_build_and_in_active_hours(self):
+        """Test a burst of builds and the usual release hours shorten the interval."""
+        from paper_poller import AdaptiveCadence
+
+        cadence = AdaptiveCadence(60, 3600)
+        # One build every 20 minutes, all of them between 14:00 and 15:00 UTC
+        day = 86400.0
+        burst = [14 * self.HOUR + n * 1200 for n in range(3)]
+        builds = {"1.21.4": [d * day + t for d in range(4) for t in burst]}
+
+        # Right after a build another one is likely, at 15:00 too
+        last = builds["1.21.4"][-1]
+        assert cadence.next_interval(builds, 10, now=last + 60) == 1200 / 4
+        # Long after the burst it backs off, but less in the hours it usually ships
+        assert cadence.next_interval(builds, 10, now=last + day - 600) == 3600 / 8
+        assert cadence.next_interval(builds, 10, now=last + day - 6 * self.HOUR) == 3600
+
+    def test_schedule_learns_builds_across_runs(self, tmp_path):
+        """Test the schedule keeps build times and quiet polls in its file."""
+        from paper_poller import AdaptiveCadence, PollSchedule, ProjectRegistry
+
+        registry = ProjectRegistry({"projects": {"waterfall": {"interval": 600}}})
+        projects = registry.create_projects()
+        path = str(tmp_path / "schedule.json")
+        cadence = AdaptiveCadence(60, 3600)
+
+        for project in projects:
+            project.observed_builds = {"1.0": "2025-01-01T12:00:00.000Z"}
+        schedule = PollSchedule(registry, path, cadence)
+        schedule.mark_polled(projects, now=1000)
+        schedule.mark_polled(projects, now=1060)
+        projects[0].observed_builds = {"1.0": "2025-01-01T13:00:00.000Z"}
+        schedule.mark_polled(projects, now=1120)
+
+        schedule = PollSchedule(registry, path, cadence)
+        assert schedule.quiet_polls == {"paper": 0, "folia": 2, "velocity": 2, "waterfall": 2}
+        assert len(schedule.builds["paper"]["1.0"]) == 2
+        # Two quiet polls make the next one due after 240 s, the project interval caps it
+        assert schedule.seconds_until_due("folia", now=1120) == pytest.approx(240 * 0.95)
+        assert schedule.seconds_until_due("waterfall", now=1120) == pytest.approx(240 * 0.95)
+        assert [p.project for p in schedule.due(projects, now=1200)] == ["paper"]
+
+    def test_schedule_reads_files_without_adaptive_state(self, tmp_path):
+        """Test schedule files written before adaptive polling still load."""
+        from paper_poller import AdaptiveCadence, PollSchedule, ProjectRegistry
+
+        path = tmp_path / "schedule.json"
+        path.write_text(json.dumps({"paper": 1000}))
+
+        schedule = PollSchedule(ProjectRegistry({}), str(path), AdaptiveCadence(60, 3600))
+        assert schedule.last_polled == {"paper": 1000}
+        assert schedule.seconds_until_due("paper", now=1000) == pytest.approx(57)
+
+    def test_daemon_wakes_up_for_the_next_due_project(self, tmp_path):
+        """Test the daemon sleeps until the first project is due, not the full interval."""
+        from paper_poller import AdaptiveCadence, PollerDaemon, PollSchedule, ProjectRegistry
+
+        registry = ProjectRegistry({})
+        projects = registry.create_projects()
+        schedule = PollSchedule(registry, str(tmp_path / "schedule.json"), AdaptiveCadence(60, 3600))
+        schedule.mark_polled(projects)
+
+        daemon = PollerDaemon(projects, interval=300, jitter=0, schedule=schedule)
+        assert daemon.next_delay() == pytest.approx(120 * 0.95, abs=1)
+
+    def test_poll_records_the_latest_build_of_every_version(self):
+        """Test a poll result is reduced to the time of the newest build per version."""
+        from paper_poller import PaperAPI
+
+        api = PaperAPI(base_url="https://example.com/graphql", project="paper")
+        api.observe_builds(
+            {
+                "project": {
+                    "versions": [
+                        {"id": "1.21.4", "builds": [{"id": 7, "time": "2025-01-01T12:00:00.000Z"}]},
+                        {"id": "1.21.3", "builds": []},
+                    ]
+                }
+            }
+        )
+        assert api.observed_builds == {"1.21.4": "2025-01-01T12:00:00.000Z"}
+
+
+class TestSubscriptionMode:
+    """Integration tests for polling on build events from a GraphQL subscription."""
+
+    @pytest.fixture
+    def polls(self, monkeypatch):
+        """Record the projects of every poll cycle instead of polling them."""
+
+        import paper_poller
+
+        main_module = paper_poller.paper_poller_main
+        polls = []
+
+        async def run_projects_async(projects, session=None):
+            polls.append([project.project for project in projects])
+
+        class AsyncClient:
+            async def connect_async(self):
+                return object()
+
+            async def close_async(self):
+                pass
+
+        monkeypatch.setattr(main_module, "run_projects_async", run_projects_async)
+        monkeypatch.setattr(main_module, "_async_client", AsyncClient)
+        return polls
+
+    def _daemon(self, url, **kwargs):
+        from paper_poller import PaperAPI, SubscriptionDaemon
+
+        projects = [
+            PaperAPI(base_url="https://example.com/graphql", project=project)
+            for project in ("paper", "folia")
+        ]
+        options = dict(interval=0, jitter=0, url=url, backoff_max=0.05, retry_after=0)
+        options.update(kwargs)
+        return SubscriptionDaemon(projects, **options)
+
+    def _run_in_thread(self, daemon, max_cycles):
+        thread = threading.Thread(target=daemon.run_forever, args=(max_cycles,), daemon=True)
+        thread.start()
+        return thread
+
+    def test_build_event_polls_its_project(self, polls):
+        """Test a subscription event starts a poll of the project it names."""
+        from tests.fake_upstreams import FakeSubscriptionServer
+
+        with FakeSubscriptionServer() as server:
+            daemon = self._daemon(server.url)
+            thread = self._run_in_thread(daemon, max_cycles=2)
+            assert server.wait_for_subscriptions(1)
+            server.publish("folia", "1.21.4", 12)
+            thread.join(timeout=10)
+
+        assert not thread.is_alive()
+        # The first cycle catches up on builds published before subscribing
+        assert polls == [["paper", "folia"], ["folia"]]
+
+    def test_reconnects_and_catches_up_after_a_lost_connection(self, polls):
+        """Test a dropped connection is reopened and followed by a poll of every project."""
+        from tests.fake_upstreams import FakeSubscriptionServer
+
+        with FakeSubscriptionServer() as server:
+            daemon = self._daemon(server.url)
+            thread = self._run_in_thread(daemon, max_cycles=3)
+            assert server.wait_for_subscriptions(1)
+            server.drop()
+            assert server.wait_for_subscriptions(1)
+            server.publish("paper")
+            thread.join(timeout=10)
+
+        assert not thread.is_alive()
+        assert server.connections == 2
+        assert polls == [["paper", "folia"], ["paper", "folia"], ["paper"]]
+
+    @pytest.mark.parametrize("mode", ["not_supported", "unknown_field"])
+    def test_falls_back_to_polling_without_subscriptions(self, polls, mode):
+        """Test a server without the subscription makes the daemon poll right away."""
+        from tests.fake_upstreams import FakeSubscriptionServer
+
+        with FakeSubscriptionServer(mode=mode) as server:
+            daemon = self._daemon(server.url, retry_after=60)
+            daemon.run_forever(max_cycles=2)
+
+        assert daemon.failures == 0
+        assert polls == [["paper", "folia"], ["paper", "folia"]]
+
+    def test_falls_back_to_polling_after_repeated_connect_failures(self, polls):
+        """Test connects that keep failing are retried with backoff, then polling takes over."""
+        import socket
+
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+        daemon = self._daemon(f"ws://127.0.0.1:{port}/graphql", max_retries=2)
+        attempts = []
+        daemon.reconnect_delay = lambda: attempts.append(daemon.failures) or 0
+
+        daemon.run_forever(max_cycles=1)
+
+        assert attempts == [1, 2]
+        assert polls == [["paper", "folia"]]
+
+    def test_unavailable_errors_are_told_apart_from_lost_connections(self):
+        """Test refused upgrades and query errors mean no subscriptions, timeouts do not."""
+        from gql.transport.exceptions import TransportConnectionFailed, TransportQueryError
+        from paper_poller import subscription_unavailable
+        from websockets.exceptions import InvalidStatus
+        from websockets.http11 import Response
+
+        def refused(status):
+            error = TransportConnectionFailed("Connect failed")
+            error.__cause__ = InvalidStatus(Response(status, "", None))
+            return error
+
+        assert subscription_unavailable(TransportQueryError("Cannot query field"))
+        assert subscription_unavailable(refused(404))
+        assert not subscription_unavailable(refused(503))
+        assert not subscription_unavailable(TransportConnectionFailed("Connect failed"))
+        assert not subscription_unavailable(ConnectionError("the server ended the subscription"))
+
+
+class TestTimeoutsAndRetries:
+    """Integration tests for request timeouts, retries, circuit breakers and the run deadline."""
+
+    @pytest.fixture
+    def graphql_client(self, tmp_path, monkeypatch):
+        """Point the shared GraphQL client at a local server, with short timeouts."""
+        import paper_poller
+
+        main_module = paper_poller.paper_poller_main
+        monkeypatch.chdir(tmp_path)
+        monkeypatch.setattr(main_module, "PERSISTED_QUERIES", False)
+        monkeypatch.setattr(main_module, "READ_TIMEOUT", 0.2)
+
+        def connect(server):
+            monkeypatch.setattr(main_module, "gql_base", server.url)
+            monkeypatch.setattr(main_module, "client", main_module._create_client())
+            return main_module
+
+        return connect
+
+    def test_hung_graphql_server_times_out(self, graphql_client):
+        """Test a server that never answers fails the query after the read timeout and retries."""
+        from gql.transport.exceptions import TransportConnectionFailed
+
+        from tests.fake_upstreams import FakeGraphQLServer
+
+        with FakeGraphQLServer(latency=2.0) as server:
+            main_module = graphql_client(server)
+            start = time.monotonic()
+            with pytest.raises(TransportConnectionFailed, match="timed out"):
+                main_module.execute_query(None, main_module.lazy("projects_query"), {})
+            elapsed = time.monotonic() - start
+            attempts = len(server.requests)
+
+        assert attempts == main_module.REQUEST_RETRIES + 1
+        assert elapsed < 1.5
+
+    def test_server_errors_are_retried(self, graphql_client):
+        """Test a 503 is retried and the query succeeds once the server recovers."""
+        from tests.fake_upstreams import FakeFillServer
+
+        class FlakyServer(FakeFillServer):
+            def answer(self, path, body):
+                if len(self.requests) == 1:
+                    return 503, None
+                return super().answer(path, body)
+
+        with FlakyServer(projects=("paper",)) as server:
+            main_module = graphql_client(server)
+            result = main_module.execute_query(None, main_module.lazy("projects_query"), {})
+
+        assert result == {"projects": [{"id": "paper"}]}
+        # The failed introspection, then introspection and query
+        assert len(server.requests) == 3
+        assert main_module.retries_total.value(upstream=server.url.split("/")[2]) == 1
+
+    def test_query_errors_are_not_retried(self, graphql_client):
+        """Test a GraphQL error answer reaches the caller right away."""
+        from gql.transport.exceptions import TransportQueryError
+
+        from tests.fake_upstreams import FakeGraphQLServer
+
+        def fail(payload):
+            raise ValueError("Unknown project")
+
+        with FakeGraphQLServer(respond=fail, persisted_queries="ignored") as server:
+            main_module = graphql_client(server)
+            with pytest.raises(TransportQueryError):
+                main_module.execute_query(None, main_module.lazy("projects_query"), {})
+
+        assert len(server.requests) == 1
+
+    @patch("requests.Session.post")
+    def test_webhooks_have_timeouts_and_retry_server_errors(self, mock_post):
+        """Test webhook posts set connect and read timeouts and retry a 502."""
+        import paper_poller
+        from paper_poller import WebhookDispatcher
+
+        main_module = paper_poller.paper_poller_main
+        mock_post.side_effect = [Mock(status_code=502, headers={}), Mock(status_code=204, headers={})]
+        dispatcher = WebhookDispatcher(max_workers=1)
+
+        result = dispatcher.post("https://discord.com/api/webhooks/1/token", {})
+
+        assert result.ok
+        assert mock_post.call_count == 2
+        assert mock_post.call_args.kwargs["timeout"] == (
+            main_module.CONNECT_TIMEOUT,
+            main_module.READ_TIMEOUT,
+        )
+
+    def test_open_circuit_skips_the_upstream(self, graphql_client, monkeypatch):
+        """Test an upstream that keeps failing is skipped without sending requests."""
+        from tests.fake_upstreams import FakeFillServer
+
+        class DownServer(FakeFillServer):
+            def answer(self, path, body):
+                return 503, None
+
+        with DownServer(projects=("paper",)) as server:
+            main_module = graphql_client(server)
+            monkeypatch.setattr(main_module, "BREAKER_THRESHOLD", 3)
+            query = main_module.lazy("projects_query")
+            with pytest.raises(Exception, match="503"):
+                main_module.execute_query(None, query, {})
+            with pytest.raises(main_module.CircuitOpenError):
+                main_module.execute_query(None, query, {})
+            attempts = len(server.requests)
+
+        upstream = server.url.split("/")[2]
+        assert attempts == 3
+        assert f'paper_poller_circuit_open{{upstream="{upstream}"}} 1' in main_module.circuit_open.render()
+
+    @patch("requests.Session.post")
+    def test_failing_webhook_does_not_skip_the_others(self, mock_post, monkeypatch):
+        """Test webhook posts are retried but never skipped by a circuit breaker."""
+        import requests
+
+        import paper_poller
+        from paper_poller import WebhookDispatcher
+
+        main_module = paper_poller.paper_poller_main
+        monkeypatch.setattr(main_module, "BREAKER_THRESHOLD", 3)
+        mock_post.side_effect = [requests.ConnectionError("Connection refused")] * 3 + [
+            Mock(status_code=204, headers={})
+        ]
+        dispatcher = WebhookDispatcher(max_workers=1)
+
+        first = dispatcher.post("https://discord.com/api/webhooks/1/token", {})
+        second = dispatcher.post("https://discord.com/api/webhooks/2/token", {})
+
+        assert "Connection refused" in first.error
+        assert second.ok
+        assert mock_post.call_count == 4
+        assert 'upstream="discord.com"' not in main_module.circuit_open.render()
+
+    def test_deadline_leaves_remaining_projects_for_the_next_run(self, monkeypatch, capsys):
+        """Test projects are not started after the deadline and only finished ones count."""
+        import paper_poller
+
+        main_module = paper_poller.paper_poller_main
+        monkeypatch.setattr(main_module, "BATCH_QUERIES", False)
+        slow, skipped = PaperAPI(project="paper"), PaperAPI(project="folia")
+        slow.run = lambda gql_result=None: time.sleep(0.1)
+        skipped.run = Mock()
+
+        deadline = main_module.start_run_deadline(0.05)
+        paper_poller.run_projects([slow, skipped])
+
+        skipped.run.assert_not_called()
+        assert [project.project for project in deadline.finished([slow, skipped])] == ["paper"]
+        assert "leaving folia for the next run" in capsys.readouterr().out
+
+    def test_failing_project_does_not_stop_the_others(self, monkeypatch, capsys):
+        """Test an error in one project is counted and the next project is still polled."""
+        import paper_poller
+
+        main_module = paper_poller.paper_poller_main
+        monkeypatch.setattr(main_module, "BATCH_QUERIES", False)
+        failing, polled = PaperAPI(project="paper"), PaperAPI(project="folia")
+        failing.run = Mock(side_effect=KeyError("project"))
+        polled.run = Mock()
+        errors = main_module.errors_total.value(stage="cycle")
+
+        paper_poller.run_projects([failing, polled])
+
+        polled.run.assert_called_once()
+        assert main_module.errors_total.value(stage="cycle") == errors + 1
+        assert "Error polling paper: 'project'" in capsys.readouterr().out
+
+    def test_deadline_stops_between_versions_and_keeps_finished_ones(
+        self, tmp_path, monkeypatch, sample_all_versions_response
+    ):
+        """Test multi-version mode saves the versions it checked and not the fingerprint."""
+        import paper_poller
+
+        main_module = paper_poller.paper_poller_main
+        monkeypatch.chdir(tmp_path)
+        monkeypatch.setattr(main_module, "DRY_RUN", True)
+        monkeypatch.setattr(main_module, "CHECK_ALL_VERSIONS", True)
+        monkeypatch.setattr(main_module, "TWO_PHASE_POLL", False)
+        api = PaperAPI()
+        checked = []
+
+        def check(version_id, build_info, **kwargs):
+            checked.append(version_id)
+            # The deadline passes while the first version is processed
+            main_module.start_run_deadline(1e-9)
+            api.write_version_to_json(version_id, build_info["id"], build_info["channel"])
+            return False
+
+        api._check_version_for_update = check
+        processed = api._run_multi_version_mode(sample_all_versions_response)
+
+        assert processed is False
+        assert len(checked) == 1
+        with open("paper_poller.json", "r") as f:
+            assert list(json.load(f)["versions"]) == checked
+
+    def test_deadline_during_catch_up_leaves_the_build_unstored(
+        self, tmp_path, monkeypatch, sample_all_versions_response
+    ):
+        """Test a version cut off while fetching missed builds is neither stored nor sent."""
+        import paper_poller
+
+        main_module = paper_poller.paper_poller_main
+        monkeypatch.chdir(tmp_path)
+        monkeypatch.setattr(main_module, "DRY_RUN", True)
+        monkeypatch.setattr(main_module, "CHECK_ALL_VERSIONS", True)
+        api = PaperAPI()
+        api.write_version_to_json("1.21.1", "120", "STABLE")
+
+        def get_missed_builds(version_id, last):
+            main_module.start_run_deadline(1e-9)
+            time.sleep(0.001)
+            main_module.run_deadline.check(f"fetching missed {version_id} builds")
+
+        api.get_missed_builds = get_missed_builds
+        api._process_and_send_update = Mock()
+        processed = api._run_multi_version_mode(sample_all_versions_response)
+
+        assert processed is False
+        api._process_and_send_update.assert_not_called()
+        assert api.get_stored_data_for_version("1.21.1")["build"] == "120"
+
+    @patch("requests.Session.post")
+    def test_webhooks_are_posted_after_the_deadline(self, mock_post):
+        """Test a stored build is still posted, rate limit waits included, once the deadline passed."""
+        import paper_poller
+        from paper_poller import WebhookDispatcher
+
+        main_module = paper_poller.paper_poller_main
+        mock_post.side_effect = [
+            Mock(status_code=429, headers={"Retry-After": "0.01"}),
+            Mock(status_code=204, headers={}),
+        ]
+        main_module.start_run_deadline(1e-9)
+        time.sleep(0.001)
+
+        result = WebhookDispatcher(max_workers=1).post("https://discord.com/api/webhooks/1/token", {})
+
+        assert result.ok
+        assert mock_post.call_count == 2
+
+    def test_main_releases_the_lock_when_upstream_hangs(self, tmp_path, monkeypatch):
+        """Test a cron run against a hung server ends at its deadline and frees the lock."""
+        from filelock import FileLock
+
+        import paper_poller
+        from tests.fake_upstreams import FakeGraphQLServer
+
+        main_module = paper_poller.paper_poller_main
+        monkeypatch.chdir(tmp_path)
+        for name, value in {
+            "DAEMON_MODE": False,
+            "USE_ASYNC": False,
+            "PERSISTED_QUERIES": False,
+            "READ_TIMEOUT": 0.3,
+            "REQUEST_RETRIES": 10,
+            "RUN_DEADLINE": 0.5,
+            "PROJECTS_FILE": str(tmp_path / "projects.json"),
+            "SCHEDULE_FILE": str(tmp_path / "schedule.json"),
+        }.items():
+            monkeypatch.setattr(main_module, name, value)
+
+        with FakeGraphQLServer(latency=5.0) as server:
+            monkeypatch.setattr(main_module, "gql_base", server.url)
+            monkeypatch.setattr(main_module, "client", main_module._create_client())
+            start = time.monotonic()
+            main_module.main()
+            elapsed = time.monotonic() - start
+
+        assert elapsed < 3
+        # The next cron run gets the lock right away
+        with FileLock("paper_poller.lock", timeout=0):
+            pass
+        # No project finished, so every one is due again on the next run
+        with open("schedule.json", "r") as f:
+            assert json.load(f) == {"last_polled": {}}
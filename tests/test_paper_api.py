@@ -14,7 +14,7 @@ sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")
 # Set env vars before import
 os.environ.setdefault("WEBHOOK_URL", '["http://example.com"]')
 
-from paper_poller import PaperAPI, get_spigot_drama
+from paper_poller import PaperAPI
 
 
 class TestPaperAPIInitialization:
@@ -218,17 +218,39 @@ class TestPaperAPIGetChanges:
         assert "github.com/PaperMC/paper/issues/1234" in changes
         assert "github.com/PaperMC/paper/issues/5678" in changes
 
+    def test_get_changes_with_prefixed_pr_numbers(self):
+        """Test a PR number that starts another one does not break its link."""
+        api = PaperAPI()
+        build_data = {"commits": [{"sha": "abc123def456789", "message": "Revert #12, fix #123"}]}
+
+        changes = api.get_changes_for_build(build_data)
+        assert "[#12](https://github.com/PaperMC/paper/issues/12)," in changes
+        assert "[#123](https://github.com/PaperMC/paper/issues/123)\n" in changes
+
+    def test_commit_lines_are_cached_per_project(self):
+        """Test a commit shared by several builds is rendered once per project."""
+        from paper_poller import render_commit_line
+
+        render_commit_line.cache_clear()
+        build_data = {"commits": [{"sha": "abc123def456789", "message": "Fix #1"}]}
+
+        paper = PaperAPI().get_changes_for_build(build_data)
+        PaperAPI().get_changes_for_build(build_data)
+        folia = PaperAPI(project="folia").get_changes_for_build(build_data)
+
+        assert render_commit_line.cache_info().hits == 1
+        assert "PaperMC/folia/issues/1" in folia
+        assert "PaperMC/paper/issues/1" in paper
+
 
 class TestPaperAPIProcessAndSendUpdate:
     """Tests for _process_and_send_update method."""
 
-    @patch("paper_poller.get_spigot_drama")
-    @patch("paper_poller.webhook_urls", ["http://test.webhook.com"])
+    @patch("paper_poller.paper_poller_main.webhook_urls", ["http://test.webhook.com"])
     def test_process_and_send_update_normal_mode(
-        self, mock_drama, sample_build_info, mocker
+        self, sample_build_info, mocker
     ):
         """Test _process_and_send_update sends webhooks in normal mode."""
-        mock_drama.return_value = {"response": "No drama today"}
         mock_send = mocker.patch.object(PaperAPI, "send_v2_webhook")
 
         api = PaperAPI()
@@ -240,7 +262,7 @@ class TestPaperAPIProcessAndSendUpdate:
     def test_process_and_send_update_dry_run_mode(self, sample_build_info, mocker):
         """Test _process_and_send_update doesn't send webhooks in dry run."""
         # Patch DRY_RUN at the module level before it's evaluated
-        mocker.patch("paper_poller.DRY_RUN", True)
+        mocker.patch("paper_poller.paper_poller_main.DRY_RUN", True)
         mock_send = mocker.patch.object(PaperAPI, "send_v2_webhook")
 
         api = PaperAPI()
@@ -261,38 +283,203 @@ class TestPaperAPIProcessAndSendUpdate:
             mock_send.assert_not_called()
 
 
-class TestGetSpigotDrama:
-    """Tests for get_spigot_drama function."""
+class TestPayloadRenderer:
+    """Tests for rendering each update message once."""
+
+    @patch("requests.Session.post")
+    def test_message_is_encoded_once_for_every_url(
+        self, mock_post, sample_build_info, mocker
+    ):
+        """Test every webhook is sent the same encoded bytes."""
+        import paper_poller
+
+        urls = [f"https://discord.com/api/webhooks/{index}/token" for index in range(3)]
+        mocker.patch.object(paper_poller.paper_poller_main, "webhook_urls", urls)
+        mocker.patch.object(paper_poller.paper_poller_main, "DRY_RUN", False)
+        mock_post.return_value.status_code = 204
+        mock_post.return_value.headers = {}
+        api = PaperAPI()
+        build = mocker.spy(api.renderer, "build")
+
+        api._process_and_send_update("1.21.1", sample_build_info, False)
+
+        assert build.call_count == 1
+        bodies = [c.kwargs["data"] for c in mock_post.call_args_list]
+        assert len(bodies) == 3
+        assert all(body is bodies[0] for body in bodies)
+        assert json.loads(bodies[0])["flags"] == 1 << 15
+        assert mock_post.call_args.kwargs["headers"]["Content-Type"] == "application/json"
+
+    def test_skeleton_is_built_with_the_project(self):
+        """Test the shared components are prepared when PaperAPI is created."""
+        api = PaperAPI(project="folia")
+
+        assert api.renderer.title["content"] == "# Folia Update"
+        assert api.renderer.accessory["media"]["url"] == api.image_url
+
+    def test_cache_is_bounded(self):
+        """Test old messages are evicted once the cache is full."""
+        from paper_poller import PayloadRenderer
+
+        renderer = PayloadRenderer("paper", "https://example.com/logo.png", cache_size=2)
+        for build in ("1", "2", "3"):
+            renderer.render(
+                latest_build=build,
+                latest_version="1.21.1",
+                build_time=0,
+                image_url=renderer.image_url,
+                changes="- Change",
+                download_url="https://example.com/paper.jar",
+                channel_name="Stable",
+                channel_changed=False,
+            )
+
+        assert len(renderer._cache) == 2
+
+
+class TestPaperAPICatchUp:
+    """Tests for merging builds missed between polls."""
+
+    @staticmethod
+    def _build(build_id, message):
+        return {
+            "id": build_id,
+            "channel": "STABLE",
+            "commits": [{"sha": f"{build_id}abcdef", "message": message}],
+            "download": {"url": "https://example.com/paper.jar"},
+            "time": "2025-10-12T12:00:00.000Z",
+        }
+
+    def test_merges_commits_of_missed_builds(self):
+        """Test intermediate builds' commits follow the latest build's, newest first."""
+        api = PaperAPI()
+        api.get_missed_builds = Mock(
+            return_value=[
+                {"id": "121", "commits": [{"sha": "121abc", "message": "Older"}]},
+                {"id": "122", "commits": [{"sha": "122abc", "message": "Newer"}]},
+                {"id": "123", "commits": [{"sha": "123abc", "message": "Latest"}]},
+            ]
+        )
+
+        merged = api.catch_up("1.21.1", self._build("123", "Latest"), "120")
+
+        api.get_missed_builds.assert_called_once_with("1.21.1", 3)
+        assert [c["message"] for c in merged["commits"]] == ["Latest", "Newer", "Older"]
+        assert merged["missed_builds"] == ["121", "122"]
+
+    def test_next_build_is_not_fetched(self):
+        """Test no catch-up query is sent when no build was missed."""
+        api = PaperAPI()
+        api.get_missed_builds = Mock()
+        build_info = self._build("121", "Next")
+
+        assert api.catch_up("1.21.1", build_info, "120") is build_info
+        api.get_missed_builds.assert_not_called()
+
+    def test_failed_fetch_announces_latest_build(self, capsys):
+        """Test the latest build is still announced when the catch-up query fails."""
+        api = PaperAPI()
+        api.get_missed_builds = Mock(side_effect=Exception("Timeout"))
+        build_info = self._build("125", "Latest")
+
+        assert api.catch_up("1.21.1", build_info, "120") is build_info
+        assert "Could not fetch missed paper 1.21.1 builds" in capsys.readouterr().out
+
+    @patch("requests.Session.post")
+    def test_webhook_names_build_range(self, mock_post):
+        """Test a caught up message names every build it covers."""
+        mock_post.return_value.status_code = 204
+        mock_post.return_value.headers = {}
+        api = PaperAPI()
+
+        api.send_v2_webhook(
+            hook_url="https://discord.com/api/webhooks/test",
+            latest_build="123",
+            latest_version="1.21.1",
+            build_time=1728734400,
+            image_url="https://example.com/image.png",
+            changes="- Change",
+            download_url="https://example.com/download",
+            channel_name="Stable",
+            channel_changed=False,
+            missed_builds=["121", "122"],
+        )
+
+        payload = json.loads(mock_post.call_args.kwargs["data"])
+        content = payload["components"][0]["components"][0]["components"][1]["content"]
+        assert content.startswith("Stable Builds 121 to 123 for 1.21.1 are now available!")
+
+
+class TestCoalescedUpdates:
+    """Tests for announcing several versions in one message."""
+
+    @staticmethod
+    def _update(version_id, commits=1, message="Fix something"):
+        build_info = {
+            "id": "10",
+            "channel": "STABLE",
+            "commits": [
+                {"sha": f"{index:07d}abcdef", "message": f"{message} {index}"}
+                for index in range(commits)
+            ],
+            "download": {"url": f"https://example.com/{version_id}.jar"},
+            "time": "2025-10-12T12:00:00.000Z",
+        }
+        return (version_id, build_info, False)
+
+    def test_one_container_per_version(self):
+        """Test a few versions share a single message."""
+        api = PaperAPI()
+        updates = [self._update(f"1.21.{index}") for index in range(3)]
 
-    @patch("requests.get")
-    def test_get_spigot_drama_success(self, mock_get):
-        """Test successful drama API call."""
-        mock_get.return_value.json.return_value = {"response": "Some drama!"}
+        payloads = [json.loads(p) for p in api.build_coalesced_payloads(updates)]
 
-        result = get_spigot_drama()
+        assert len(payloads) == 1
+        containers = [c for c in payloads[0]["components"] if c["type"] == 17]
+        assert len(containers) == 3
+        assert containers[0]["components"][0]["content"].startswith("## 1.21.0")
 
-        assert result == {"response": "Some drama!"}
-        mock_get.assert_called_once()
+    def test_messages_stay_within_discord_limits(self):
+        """Test many versions with long changelogs are split over several messages."""
+        from paper_poller import count_components, count_text
 
-    @patch("requests.get")
-    def test_get_spigot_drama_failure(self, mock_get):
-        """Test drama API failure returns default message."""
-        mock_get.side_effect = Exception("API Error")
+        api = PaperAPI()
+        updates = [self._update(f"1.{index}", commits=15) for index in range(20)]
+
+        payloads = [json.loads(p) for p in api.build_coalesced_payloads(updates)]
+
+        assert 1 < len(payloads) < len(updates)
+        versions = []
+        for payload in payloads:
+            assert count_components(payload["components"]) <= 40
+            assert count_text(payload["components"]) <= 4000
+            versions += [
+                c["components"][0]["content"].split("\n")[0]
+                for c in payload["components"]
+                if c["type"] == 17
+            ]
+        assert versions == [f"## 1.{index}" for index in range(20)]
 
-        result = get_spigot_drama()
+    def test_single_update_uses_regular_message(self):
+        """Test one changed version is sent like before."""
+        api = PaperAPI()
+        api._process_and_send_update = Mock(return_value=[])
+        update = self._update("1.21.1")
 
-        assert result == "There's no drama :("
+        api._send_coalesced_updates([update])
+
+        api._process_and_send_update.assert_called_once_with(*update)
 
 
 class TestPaperAPIWebhookPayload:
     """Tests for webhook payload construction."""
 
-    @patch("requests.post")
-    @patch("paper_poller.webhook_urls", ["http://test.webhook.com"])
+    @patch("requests.Session.post")
+    @patch("paper_poller.paper_poller_main.webhook_urls", ["http://test.webhook.com"])
     def test_send_v2_webhook_payload_structure(self, mock_post):
         """Test that webhook payload has correct structure."""
+        mock_post.return_value.status_code = 200
         api = PaperAPI()
-        drama = {"response": "No drama"}
 
         api.send_v2_webhook(
             hook_url="http://test.webhook.com",
@@ -302,7 +489,6 @@ class TestPaperAPIWebhookPayload:
             image_url=api.image_url,
             changes="- abc123d Fix something\n",
             download_url="https://example.com/paper.jar",
-            drama=drama,
             channel_name="Stable",
             channel_changed=False,
         )
@@ -312,17 +498,17 @@ class TestPaperAPIWebhookPayload:
 
         # Check the payload structure
         call_args = mock_post.call_args
-        payload = call_args.kwargs["json"]
+        payload = json.loads(call_args.kwargs["data"])
 
         assert "components" in payload
         assert payload["flags"] == 1 << 15
         assert "allowed_mentions" in payload
 
-    @patch("requests.post")
+    @patch("requests.Session.post")
     def test_send_v2_webhook_with_channel_change(self, mock_post):
         """Test webhook payload includes channel change notification."""
+        mock_post.return_value.status_code = 200
         api = PaperAPI()
-        drama = {"response": "No drama"}
 
         api.send_v2_webhook(
             hook_url="http://test.webhook.com",
@@ -332,15 +518,290 @@ class TestPaperAPIWebhookPayload:
             image_url=api.image_url,
             changes="- abc123d Fix something\n",
             download_url="https://example.com/paper.jar",
-            drama=drama,
             channel_name="Recommended",
             channel_changed=True,
         )
 
         call_args = mock_post.call_args
-        payload = call_args.kwargs["json"]
+        payload = json.loads(call_args.kwargs["data"])
 
         # Should have an extra component for channel change
         # Count components of type 10 (content components)
         content_components = [c for c in payload["components"] if c.get("type") == 10]
         assert len(content_components) > 0
+
+
+class TestWebhookDispatcher:
+    """Tests for pooled, parallel webhook delivery."""
+
+    def test_map_sends_in_parallel(self):
+        """Test webhooks are posted concurrently up to the concurrency limit."""
+        import threading
+        import time
+
+        from paper_poller import WebhookDispatcher
+
+        dispatcher = WebhookDispatcher(max_workers=4)
+        active = []
+        peak = []
+        lock = threading.Lock()
+
+        def send(url):
+            with lock:
+                active.append(url)
+                peak.append(len(active))
+            time.sleep(0.1)
+            with lock:
+                active.remove(url)
+            return url
+
+        urls = [f"http://hook/{i}" for i in range(4)]
+        start = time.monotonic()
+        results = dispatcher.map(send, urls)
+        elapsed = time.monotonic() - start
+        dispatcher.close()
+
+        assert results == urls  # Results keep the URL order
+        assert max(peak) > 1
+        assert elapsed < 0.35
+
+    def test_map_respects_concurrency_limit(self):
+        """Test no more than max_workers webhooks are in flight."""
+        import threading
+        import time
+
+        from paper_poller import WebhookDispatcher
+
+        dispatcher = WebhookDispatcher(max_workers=2)
+        active = []
+        peak = []
+        lock = threading.Lock()
+
+        def send(url):
+            with lock:
+                active.append(url)
+                peak.append(len(active))
+            time.sleep(0.05)
+            with lock:
+                active.remove(url)
+
+        dispatcher.map(send, [f"http://hook/{i}" for i in range(6)])
+        dispatcher.close()
+
+        assert max(peak) <= 2
+
+    @patch("requests.Session.post")
+    def test_post_reuses_session(self, mock_post):
+        """Test every post goes through the same pooled session."""
+        from paper_poller import WebhookDispatcher
+
+        mock_post.return_value.status_code = 204
+        dispatcher = WebhookDispatcher(max_workers=2)
+        session = dispatcher.session
+
+        first = dispatcher.post("http://hook/1", {"components": []})
+        second = dispatcher.post("http://hook/2", {"components": []})
+
+        assert dispatcher.session is session
+        assert mock_post.call_count == 2
+        assert first.ok and second.ok
+        assert first.status_code == 204
+        assert mock_post.call_args.kwargs["params"] == {"with_components": "true"}
+
+    @patch("requests.Session.post")
+    def test_post_reports_errors(self, mock_post):
+        """Test connection errors and bad statuses are returned, not raised."""
+        import requests
+
+        from paper_poller import WebhookDispatcher
+
+        dispatcher = WebhookDispatcher(max_workers=1)
+
+        mock_post.side_effect = requests.ConnectionError("Connection refused")
+        failed = dispatcher.post("http://hook/1", {})
+        assert not failed.ok
+        assert "Connection refused" in failed.error
+
+        mock_post.side_effect = None
+        mock_post.return_value.status_code = 404
+        missing = dispatcher.post("http://hook/1", {})
+        assert not missing.ok
+        assert missing.status_code == 404
+
+    def test_describe_webhook_url_hides_token(self):
+        """Test webhook tokens never end up in log lines."""
+        from paper_poller import describe_webhook_url
+
+        url = "https://discord.com/api/webhooks/123456/secret-token"
+        assert describe_webhook_url(url) == "discord.com/api/webhooks/123456"
+        assert describe_webhook_url("http://example.com/hook") == "example.com/hook"
+
+    @patch("requests.Session.post")
+    def test_process_and_send_update_returns_results(
+        self, mock_post, sample_build_info, monkeypatch, capsys
+    ):
+        """Test per-URL results are returned to _process_and_send_update."""
+        import paper_poller
+
+        main_module = paper_poller.paper_poller_main
+        monkeypatch.setattr(main_module, "DRY_RUN", False)
+        monkeypatch.setattr(
+            main_module,
+            "webhook_urls",
+            ["http://hook.local/accepted", "https://discord.com/api/webhooks/1/token"],
+        )
+        ok = Mock(status_code=204)
+        limited = Mock(status_code=500)
+        mock_post.side_effect = lambda url, **kwargs: ok if "accepted" in url else limited
+
+        api = PaperAPI()
+        results = api._process_and_send_update("1.21.1", sample_build_info, False)
+
+        assert [result.status_code for result in results] == [204, 500]
+        output = capsys.readouterr().out
+        assert "Webhook delivery failed for discord.com/api/webhooks/1: 500" in output
+        assert "token" not in output
+
+
+class TestRateLimiting:
+    """Tests for the Discord rate limit aware webhook dispatcher."""
+
+    @staticmethod
+    def _response(status_code=204, headers=None, body=None):
+        response = Mock(status_code=status_code, headers=headers or {})
+        response.json.return_value = body or {}
+        return response
+
+    def test_bucket_does_not_wait_with_tokens_left(self):
+        """Test a bucket with remaining tokens never sleeps."""
+        from paper_poller import RateLimitBucket
+
+        bucket = RateLimitBucket()
+        bucket.update(
+            {
+                "X-RateLimit-Limit": "5",
+                "X-RateLimit-Remaining": "4",
+                "X-RateLimit-Reset-After": "2.0",
+            }
+        )
+        with patch("time.sleep") as mock_sleep:
+            for _ in range(4):
+                assert bucket.acquire() == 0
+            mock_sleep.assert_not_called()
+
+    def test_bucket_waits_only_when_empty(self):
+        """Test an empty bucket waits until its reset, then refills."""
+        from paper_poller import RateLimitBucket
+
+        bucket = RateLimitBucket()
+        bucket.update(
+            {
+                "X-RateLimit-Limit": "5",
+                "X-RateLimit-Remaining": "0",
+                "X-RateLimit-Reset-After": "1.5",
+            }
+        )
+        with patch("time.sleep") as mock_sleep:
+            waited = bucket.acquire()
+
+        assert 1.0 < waited <= 1.5
+        assert mock_sleep.call_count == 1
+        assert bucket.remaining == 4
+
+    def test_unknown_bucket_never_waits(self):
+        """Test the first post goes out before any headers are known."""
+        from paper_poller import RateLimitBucket
+
+        with patch("time.sleep") as mock_sleep:
+            assert RateLimitBucket().acquire() == 0
+            mock_sleep.assert_not_called()
+
+    @patch("time.sleep")
+    @patch("requests.Session.post")
+    def test_429_is_retried_after_retry_after(self, mock_post, mock_sleep):
+        """Test a 429 waits for Retry-After and then succeeds."""
+        from paper_poller import WebhookDispatcher
+
+        mock_post.side_effect = [
+            self._response(429, {"Retry-After": "0.75"}),
+            self._response(204),
+        ]
+
+        result = WebhookDispatcher(max_workers=1).post("http://hook/1", {})
+
+        assert result.ok
+        assert mock_post.call_count == 2
+        assert 0.5 < mock_sleep.call_args.args[0] <= 0.75
+
+    @patch("time.sleep")
+    @patch("requests.Session.post")
+    def test_429_retry_after_from_json_body(self, mock_post, mock_sleep):
+        """Test retry_after is read from the JSON body without a header."""
+        from paper_poller import WebhookDispatcher
+
+        mock_post.side_effect = [
+            self._response(429, body={"retry_after": 0.4, "global": False}),
+            self._response(204),
+        ]
+
+        result = WebhookDispatcher(max_workers=1).post("http://hook/1", {})
+
+        assert result.ok
+        assert 0.2 < mock_sleep.call_args.args[0] <= 0.4
+
+    @patch("time.sleep")
+    @patch("requests.Session.post")
+    def test_global_rate_limit_blocks_every_webhook(self, mock_post, mock_sleep):
+        """Test a global 429 makes other webhooks wait too."""
+        from paper_poller import WebhookDispatcher
+
+        dispatcher = WebhookDispatcher(max_workers=1)
+        mock_post.side_effect = [
+            self._response(429, {"Retry-After": "5", "X-RateLimit-Global": "true"}),
+        ]
+        dispatcher.max_retries = 0
+        result = dispatcher.post("http://hook/1", {})
+        assert result.status_code == 429
+        assert not result.ok
+
+        mock_post.side_effect = [self._response(204)]
+        assert dispatcher.post("http://hook/2", {}).ok
+        assert mock_sleep.call_count == 1
+        assert mock_sleep.call_args.args[0] > 4
+
+    @patch("time.sleep")
+    @patch("requests.Session.post")
+    def test_gives_up_after_max_retries(self, mock_post, mock_sleep):
+        """Test a webhook that keeps returning 429 is reported as rate limited."""
+        from paper_poller import WebhookDispatcher
+
+        mock_post.return_value = self._response(429, {"Retry-After": "0.1"})
+
+        result = WebhookDispatcher(max_workers=1, max_retries=2).post(
+            "http://hook/1", {}
+        )
+
+        assert mock_post.call_count == 3
+        assert result.error == "rate limited"
+
+    @patch("time.sleep")
+    @patch("requests.Session.post")
+    def test_buckets_are_per_webhook(self, mock_post, mock_sleep):
+        """Test an exhausted webhook does not slow down the others."""
+        from paper_poller import WebhookDispatcher
+
+        dispatcher = WebhookDispatcher(max_workers=1)
+        mock_post.return_value = self._response(
+            204,
+            {
+                "X-RateLimit-Limit": "5",
+                "X-RateLimit-Remaining": "0",
+                "X-RateLimit-Reset-After": "3",
+            },
+        )
+        dispatcher.post("http://hook/1", {})
+        dispatcher.post("http://hook/2", {})
+        mock_sleep.assert_not_called()
+
+        dispatcher.post("http://hook/1", {})
+        assert mock_sleep.call_count == 1
@@ -0,0 +1,339 @@
+"""Tests for the project state layer and its storage backends."""
+
+import json
+import os
+import sys
+
+import pytest
+
+# Add parent directory to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+# Set env vars before import
+os.environ.setdefault("WEBHOOK_URL", '["http://example.com"]')
+
+from paper_poller import (
+    JournalStateBackend,
+    JsonStateBackend,
+    PaperAPI,
+    ProjectState,
+    SqliteStateBackend,
+)
+
+
+@pytest.fixture
+def sqlite_backend(tmp_path, monkeypatch):
+    """SQLite backend in a temporary working directory."""
+    monkeypatch.chdir(tmp_path)
+    backend = SqliteStateBackend(str(tmp_path / "state.db"))
+    yield backend
+    backend.close()
+
+
+class TestSqliteStateBackend:
+    """Tests for the SQLite state backend."""
+
+    def test_uses_wal_mode(self, sqlite_backend):
+        """Test the database is opened in WAL mode for concurrent readers."""
+        mode = sqlite_backend.connection.execute("PRAGMA journal_mode").fetchone()[0]
+        assert mode == "wal"
+
+    def test_version_round_trip(self, sqlite_backend):
+        """Test the PaperAPI state helpers work on top of SQLite."""
+        api = PaperAPI()
+        api.state_backend = sqlite_backend
+
+        api.write_version_to_json("1.21.1", "123", "STABLE")
+        api.write_version_to_json("1.21", "120", "RECOMMENDED")
+
+        assert api.up_to_date_for_version("1.21.1", "123") is True
+        assert api.up_to_date_for_version("1.21", "120") is True
+        assert api.up_to_date_for_version("1.21.1", "124") is False
+        assert api.get_stored_data_for_version("1.21") == {
+            "build": "120",
+            "channel": "RECOMMENDED",
+        }
+        assert api.get_stored_data_for_version("1.20") == {"build": "", "channel": None}
+        assert not os.path.exists("paper_poller.json")
+
+    def test_legacy_single_version_round_trip(self, sqlite_backend):
+        """Test single version mode storage works on top of SQLite."""
+        api = PaperAPI()
+        api.state_backend = sqlite_backend
+
+        api.write_to_json("1.21.1", "123", "STABLE")
+
+        assert api.up_to_date("1.21.1", "123") is True
+        assert api.up_to_date("1.21.1", "124") is False
+        assert api.get_stored_data()["channel"] == "STABLE"
+
+    def test_build_id_type_is_preserved(self, sqlite_backend):
+        """Test integer build ids are not turned into strings."""
+        state = ProjectState("paper", sqlite_backend)
+        state.set_version("1.21.1", 123, "STABLE")
+        state.flush()
+
+        reloaded = ProjectState("paper", sqlite_backend)
+        assert reloaded.version("1.21.1")["build"] == 123
+
+    def test_only_changed_versions_are_written(self, sqlite_backend):
+        """Test saving a run upserts just the versions that changed."""
+        state = ProjectState("paper", sqlite_backend)
+        for index in range(50):
+            state.set_version(f"1.{index}", "1", "STABLE")
+        state.flush()
+
+        statements = []
+        sqlite_backend.connection.set_trace_callback(statements.append)
+        state = ProjectState("paper", sqlite_backend)
+        state.set_version("1.7", "2", "STABLE")
+        state.flush()
+        sqlite_backend.connection.set_trace_callback(None)
+
+        version_writes = [s for s in statements if "INTO poller_versions" in s]
+        assert len(version_writes) == 1
+        assert ProjectState("paper", sqlite_backend).version("1.7")["build"] == "2"
+        assert len(ProjectState("paper", sqlite_backend).data["versions"]) == 50
+
+    def test_archived_versions_are_deleted(self, sqlite_backend):
+        """Test versions archived out of the window are removed from the database."""
+        state = ProjectState("paper", sqlite_backend)
+        state.set_version("1.20", "1", "STABLE")
+        state.set_version("1.21", "1", "STABLE")
+        state.flush()
+
+        state = ProjectState("paper", sqlite_backend)
+        state.archive(["1.20"])
+        state.flush()
+
+        assert set(ProjectState("paper", sqlite_backend).data["versions"]) == {"1.21"}
+        with open("paper_poller_archive.json", "r") as f:
+            assert json.load(f)["versions"] == {"1.20": {"build": "1", "channel": "STABLE"}}
+
+    def test_projects_are_isolated(self, sqlite_backend):
+        """Test projects sharing a database don't see each other's versions."""
+        paper = ProjectState("paper", sqlite_backend)
+        paper.set_version("1.21.1", "123", "STABLE")
+        paper.flush()
+
+        folia = ProjectState("folia", sqlite_backend)
+        assert folia.version("1.21.1") == {"build": "", "channel": None}
+
+    def test_second_connection_sees_writes(self, sqlite_backend, tmp_path):
+        """Test another process reading the database sees committed state."""
+        state = ProjectState("paper", sqlite_backend)
+        state.set_version("1.21.1", "123", "STABLE")
+        state.flush()
+
+        reader = SqliteStateBackend(str(tmp_path / "state.db"))
+        try:
+            assert ProjectState("paper", reader).version("1.21.1")["build"] == "123"
+        finally:
+            reader.close()
+
+    def test_migrates_json_state_once(self, sqlite_backend):
+        """Test existing JSON state files are imported on first use."""
+        data = {
+            "version": "1.21.1",
+            "build": "123",
+            "channel": "STABLE",
+            "versions": {
+                "1.21.1": {"build": "123", "channel": "STABLE"},
+                "1.21": {"build": "120", "channel": "RECOMMENDED"},
+            },
+        }
+        with open("paper_poller.json", "w") as f:
+            json.dump(data, f)
+
+        assert ProjectState("paper", sqlite_backend).data == data
+        assert not os.path.exists("paper_poller.json")
+        assert os.path.exists("paper_poller.json.migrated")
+
+        # A stale JSON file appearing later is not imported again
+        with open("paper_poller.json", "w") as f:
+            json.dump({"versions": {"1.21.1": {"build": "1", "channel": "BETA"}}}, f)
+        assert ProjectState("paper", sqlite_backend).version("1.21.1")["build"] == "123"
+
+    def test_migrates_legacy_json_state(self, sqlite_backend):
+        """Test single version JSON files migrate to the latest record."""
+        with open("paper_poller.json", "w") as f:
+            json.dump({"version": "1.21.1", "build": "123", "channel": "STABLE"}, f)
+
+        api = PaperAPI()
+        api.state_backend = sqlite_backend
+        assert api.up_to_date("1.21.1", "123") is True
+
+
+class TestJsonStateBackend:
+    """Tests for the JSON file state backend."""
+
+    def test_failed_write_keeps_previous_state(self, tmp_path, monkeypatch, mocker):
+        """Test a crash while writing never leaves a truncated state file."""
+        monkeypatch.chdir(tmp_path)
+        backend = JsonStateBackend()
+        state = ProjectState("paper", backend)
+        state.set_version("1.21.1", "123", "STABLE")
+        state.flush()
+
+        mocker.patch("json.dump", side_effect=OSError("Disk full"))
+        state = ProjectState("paper", backend)
+        state.set_version("1.21.1", "124", "STABLE")
+        with pytest.raises(OSError):
+            state.flush()
+
+        with open("paper_poller.json", "r") as f:
+            assert json.load(f)["versions"]["1.21.1"]["build"] == "123"
+
+
+class TestJournalStateBackend:
+    """Tests for the append-only journal state backend."""
+
+    @staticmethod
+    def _journal_records():
+        with open("paper_poller.journal", "r") as f:
+            return [json.loads(line) for line in f]
+
+    def test_round_trip_without_snapshot(self, tmp_path, monkeypatch):
+        """Test state is rebuilt from the journal alone."""
+        monkeypatch.chdir(tmp_path)
+        api = PaperAPI()
+        api.state_backend = JournalStateBackend()
+
+        api.write_version_to_json("1.21.1", "123", "STABLE")
+        api.write_version_to_json("1.21", "120", "RECOMMENDED")
+
+        assert not os.path.exists("paper_poller.json")
+        fresh = PaperAPI()
+        fresh.state_backend = JournalStateBackend()
+        assert fresh.up_to_date_for_version("1.21.1", "123") is True
+        assert fresh.up_to_date_for_version("1.21", "120") is True
+        assert fresh.get_stored_data()["version"] == "1.21"
+
+    def test_update_appends_constant_records(self, tmp_path, monkeypatch):
+        """Test one changed version appends a fixed number of records."""
+        monkeypatch.chdir(tmp_path)
+        backend = JournalStateBackend(compact_every=10_000)
+        state = ProjectState("paper", backend)
+        for index in range(100):
+            state.set_version(f"1.{index}", "1", "STABLE")
+        state.flush()
+        before = len(self._journal_records())
+
+        state = ProjectState("paper", backend)
+        state.set_version("1.50", "2", "STABLE")
+        state.flush()
+
+        records = self._journal_records()[before:]
+        assert [record["op"] for record in records] == ["version", "latest"]
+        assert records[0] == {
+            "op": "version",
+            "project": "paper",
+            "version": "1.50",
+            "build": "2",
+            "channel": "STABLE",
+        }
+
+    def test_archived_versions_are_removed_on_replay(self, tmp_path, monkeypatch):
+        """Test an archived version is recorded and dropped when the journal is replayed."""
+        monkeypatch.chdir(tmp_path)
+        backend = JournalStateBackend(compact_every=10_000)
+        state = ProjectState("paper", backend)
+        state.set_version("1.20", "1", "STABLE")
+        state.set_version("1.21", "1", "STABLE")
+        state.flush()
+
+        state = ProjectState("paper", backend)
+        state.archive(["1.20"])
+        state.flush()
+
+        assert {"op": "remove", "project": "paper", "version": "1.20"} in self._journal_records()
+        fresh = ProjectState("paper", JournalStateBackend())
+        assert set(fresh.data["versions"]) == {"1.21"}
+
+    def test_legacy_single_version_mode(self, tmp_path, monkeypatch):
+        """Test single version mode records replay to the legacy format."""
+        monkeypatch.chdir(tmp_path)
+        api = PaperAPI()
+        api.state_backend = JournalStateBackend()
+
+        api.write_to_json("1.21", "100", "BETA")
+        api.write_to_json("1.21.1", "123", "STABLE")
+
+        fresh = ProjectState("paper", JournalStateBackend())
+        assert fresh.data == {"version": "1.21.1", "build": "123", "channel": "STABLE"}
+
+    def test_torn_record_is_ignored(self, tmp_path, monkeypatch, capsys):
+        """Test a half written record from a crash does not break loading."""
+        monkeypatch.chdir(tmp_path)
+        backend = JournalStateBackend()
+        state = ProjectState("paper", backend)
+        state.set_version("1.21.1", "123", "STABLE")
+        state.flush()
+        with open("paper_poller.journal", "a") as f:
+            f.write('{"op": "version", "project": "paper", "vers')
+
+        state = ProjectState("paper", JournalStateBackend())
+        assert state.version("1.21.1")["build"] == "123"
+        assert "incomplete record" in capsys.readouterr().out
+
+    def test_writes_after_a_torn_record_are_kept(self, tmp_path, monkeypatch):
+        """Test records appended after a torn write are replayed on the next load."""
+        monkeypatch.chdir(tmp_path)
+        state = ProjectState("paper", JournalStateBackend(compact_every=10_000))
+        state.set_version("1.21.1", "123", "STABLE")
+        state.flush()
+        with open("paper_poller.journal", "a") as f:
+            f.write('{"op": "version", "project": "paper", "vers')
+
+        state = ProjectState("paper", JournalStateBackend(compact_every=10_000))
+        state.set_version("1.21.1", "124", "STABLE")
+        state.set_version("1.21.2", "1", "BETA")
+        state.flush()
+
+        fresh = ProjectState("paper", JournalStateBackend())
+        assert fresh.version("1.21.1")["build"] == "124"
+        assert fresh.version("1.21.2")["build"] == "1"
+        # Every line is a whole record again, the torn one was cut off
+        assert [record["op"] for record in self._journal_records()] == [
+            "reset",
+            "version",
+            "latest",
+            "version",
+            "version",
+            "latest",
+        ]
+
+    def test_compaction_writes_snapshot(self, tmp_path, monkeypatch):
+        """Test the journal is folded into a snapshot once it grows too long."""
+        monkeypatch.chdir(tmp_path)
+        backend = JournalStateBackend(compact_every=10)
+        for build in range(1, 8):
+            state = ProjectState("paper", backend)
+            state.set_version("1.21.1", str(build), "STABLE")
+            state.flush()
+
+        # 7 runs of 2 records each passed the threshold once
+        with open("paper_poller.json", "r") as f:
+            snapshot = json.load(f)
+        assert snapshot["versions"]["1.21.1"]["build"] == "5"
+        assert len(self._journal_records()) == 4
+        assert not os.path.exists("paper_poller.json.tmp")
+
+        state = ProjectState("paper", JournalStateBackend())
+        assert state.version("1.21.1")["build"] == "7"
+
+    def test_replaying_compacted_journal_is_harmless(self, tmp_path, monkeypatch):
+        """Test a crash between snapshot and journal truncation loses nothing."""
+        monkeypatch.chdir(tmp_path)
+        backend = JournalStateBackend(compact_every=10_000)
+        state = ProjectState("paper", backend)
+        state.set_version("1.21.1", "123", "STABLE")
+        state.set_version("1.21", "120", "RECOMMENDED")
+        state.flush()
+        expected = ProjectState("paper", JournalStateBackend()).data
+
+        # Snapshot written but the journal was never truncated
+        with open("paper_poller.json", "w") as f:
+            json.dump(expected, f)
+
+        assert ProjectState("paper", JournalStateBackend()).data == expected
@@ -2,6 +2,7 @@
 
 import os
 import sys
+import time
 from datetime import datetime, timezone
 
 import pytest
@@ -15,9 +16,15 @@ os.environ.setdefault("WEBHOOK_URL", '["http://example.com"]')
 from paper_poller import (
     CHANNEL_COLORS,
     COLORS,
+    CircuitBreaker,
+    CircuitOpenError,
     Color,
+    MetricsRegistry,
+    is_transient_error,
     convert_build_date,
     convert_commit_hash_to_short,
+    missed_build_count,
+    truncate_changes,
 )
 
 
@@ -68,6 +75,114 @@ class TestConvertBuildDate:
         assert result.tzinfo is not None
 
 
+class TestMissedBuildCount:
+    """Tests for missed_build_count function."""
+
+    def test_next_build_needs_no_catch_up(self):
+        """Test the build right after the stored one is announced on its own."""
+        assert missed_build_count("122", "123") == 0
+
+    def test_gap_is_counted(self):
+        """Test a gap fetches the stored build's successors up to the latest one."""
+        assert missed_build_count("120", "123") == 3
+
+    def test_gap_is_capped(self, monkeypatch):
+        """Test a long outage only fetches up to the configured number of builds."""
+        import paper_poller
+
+        monkeypatch.setattr(paper_poller.paper_poller_main, "CATCH_UP_MAX_BUILDS", 5)
+        assert missed_build_count("1", "100") == 5
+
+    def test_unknown_stored_build(self):
+        """Test versions without a stored build are not caught up."""
+        assert missed_build_count("", "123") == 0
+        assert missed_build_count(None, "123") == 0
+
+
+class TestTruncateChanges:
+    """Tests for truncate_changes function."""
+
+    def test_short_changes_are_unchanged(self):
+        """Test a changelog within the limit is returned as is."""
+        changes = "- one\n- two\n"
+        assert truncate_changes(changes, limit=100) == changes
+
+    def test_long_changes_are_cut_at_a_line(self):
+        """Test a long changelog keeps whole lines and counts the rest."""
+        changes = "".join(f"- change {index}\n" for index in range(20))
+        truncated = truncate_changes(changes, limit=60)
+
+        assert len(truncated) <= 60
+        assert truncated.startswith("- change 0\n")
+        assert truncated.endswith("more\n")
+
+
+class TestMetricsRegistry:
+    """Tests for the Prometheus text rendering of metrics."""
+
+    def test_histogram_buckets_are_cumulative(self):
+        """Test observations land in cumulative buckets with their sum and count."""
+        registry = MetricsRegistry()
+        histogram = registry.histogram("test_seconds", "Test latency", ("project",), (0.1, 1.0))
+        histogram.observe(0.05, project="paper")
+        histogram.observe(0.5, project="paper")
+        histogram.observe(5, project="paper")
+
+        lines = registry.render().splitlines()
+        assert lines[:2] == ["# HELP test_seconds Test latency", "# TYPE test_seconds histogram"]
+        assert 'test_seconds_bucket{project="paper",le="0.1"} 1' in lines
+        assert 'test_seconds_bucket{project="paper",le="1"} 2' in lines
+        assert 'test_seconds_bucket{project="paper",le="+Inf"} 3' in lines
+        assert 'test_seconds_sum{project="paper"} 5.55' in lines
+        assert 'test_seconds_count{project="paper"} 3' in lines
+
+    def test_counter_labels_are_escaped(self):
+        """Test label values with quotes, backslashes and newlines stay parseable."""
+        registry = MetricsRegistry()
+        counter = registry.counter("test_total", "Test counter", ("webhook",))
+        counter.inc(webhook='a"b\\c\nd')
+        counter.inc(2, webhook='a"b\\c\nd')
+
+        assert 'test_total{webhook="a\\"b\\\\c\\nd"} 3' in registry.render().splitlines()
+
+
+class TestCircuitBreaker:
+    """Tests for the per-upstream circuit breaker."""
+
+    def test_opens_after_transient_failures_and_half_opens(self):
+        """Test the breaker fails fast while open and lets a call through after the cooldown."""
+        breaker = CircuitBreaker("fill.papermc.io", threshold=2, cooldown=0.05)
+        breaker.record(TimeoutError("read timed out"))
+        breaker.check()
+        breaker.record(TimeoutError("read timed out"))
+        with pytest.raises(CircuitOpenError, match="fill.papermc.io"):
+            breaker.check()
+
+        time.sleep(0.06)
+        breaker.check()
+        # One more failure while half open is enough to open it again
+        breaker.record(ConnectionError("refused"))
+        assert breaker.is_open
+        time.sleep(0.06)
+        breaker.check()
+        breaker.record()
+        assert breaker.failures == 0 and not breaker.is_open
+
+    def test_answers_from_the_upstream_close_it(self):
+        """Test errors the upstream answered with, like GraphQL errors, reset the count."""
+        from gql.transport.exceptions import TransportQueryError, TransportServerError
+
+        assert is_transient_error(TransportServerError("Bad Gateway", 502))
+        assert not is_transient_error(TransportServerError("Bad Request", 400))
+        assert not is_transient_error(TransportQueryError("Unknown project"))
+
+        breaker = CircuitBreaker("fill.papermc.io", threshold=2)
+        breaker.record(TimeoutError("read timed out"))
+        breaker.record(TransportQueryError("Unknown project"))
+        breaker.record(TimeoutError("read timed out"))
+        breaker.check()
+
+
 class TestColorEnums:
     """Tests for Color enum and color mappings."""
 
@@ -115,3 +230,89 @@ class TestEnvironmentConfiguration:
         import paper_poller as pp
 
         assert pp.DRY_RUN in [True, False]
+
+
+class TestSideEffectFreeImport:
+    """Tests that importing the module does no work until it is needed."""
+
+    @staticmethod
+    def _import_in_subprocess(code, **kwargs):
+        import subprocess
+
+        root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+        script = f"import sys\nsys.path.insert(0, {root!r})\nsys.argv = ['paper-poller.py', '--stdin']\n{code}"
+        return subprocess.run(
+            [sys.executable, "-c", script],
+            capture_output=True,
+            text=True,
+            timeout=60,
+            **kwargs,
+        )
+
+    def test_import_loads_no_heavy_modules(self):
+        """Test importing only needs the standard library and prints nothing."""
+        result = self._import_in_subprocess(
+            "import paper_poller\n"
+            "heavy = ('aiohttp', 'dotenv', 'filelock', 'gql', 'graphql', 'requests')\n"
+            "print(sorted(m for m in heavy if m in sys.modules))",
+            input="not json",
+        )
+
+        assert result.returncode == 0, result.stderr
+        # --stdin is only read once the webhook URLs are needed
+        assert result.stdout == "[]\n"
+
+    def test_lazy_attributes_are_created_on_first_use(self):
+        """Test the client, queries and webhook URLs are available when asked for."""
+        result = self._import_in_subprocess(
+            "import paper_poller\n"
+            "assert paper_poller.client is paper_poller.client\n"
+            "assert paper_poller.latest_query.document is not None\n"
+            "print(paper_poller.webhook_urls)",
+            input='{"urls": ["https://example.com/hook"]}',
+        )
+
+        assert result.returncode == 0, result.stderr
+        assert result.stdout.strip().endswith("['https://example.com/hook']")
+
+    def test_env_file_settings_apply_after_import(self, tmp_path, monkeypatch):
+        """Test settings from .env replace the configuration read on import."""
+        import paper_poller
+
+        main_module = paper_poller.paper_poller_main
+        # Restore the environment and the configuration when the test is done
+        for name in ("PAPER_POLLER_INTERVAL", "PAPER_POLLER_GRAPHQL_URL"):
+            monkeypatch.setenv(name, "")
+            monkeypatch.delenv(name)
+        monkeypatch.setattr(main_module, "POLL_INTERVAL", main_module.POLL_INTERVAL)
+        monkeypatch.setattr(main_module, "gql_base", main_module.gql_base)
+        env_file = tmp_path / ".env"
+        env_file.write_text(
+            "PAPER_POLLER_INTERVAL=42\nPAPER_POLLER_GRAPHQL_URL=http://127.0.0.1/graphql\n"
+        )
+
+        main_module.load_env_file(str(env_file))
+
+        assert main_module.POLL_INTERVAL == 42.0
+        assert main_module.gql_base == "http://127.0.0.1/graphql"
+
+    def test_env_file_keeps_settings_it_does_not_mention(self, tmp_path, monkeypatch):
+        """Test settings changed after import stay as they are when .env sets others."""
+        import paper_poller
+
+        main_module = paper_poller.paper_poller_main
+        monkeypatch.setenv("PAPER_POLLER_INTERVAL", "")
+        monkeypatch.delenv("PAPER_POLLER_INTERVAL")
+        monkeypatch.setattr(main_module, "POLL_INTERVAL", main_module.POLL_INTERVAL)
+        monkeypatch.setattr(main_module, "DRY_RUN", True)
+        monkeypatch.setattr(main_module, "CHECK_ALL_VERSIONS", True)
+        monkeypatch.setattr(main_module, "gql_base", "http://local")
+        env_file = tmp_path / ".env"
+        env_file.write_text("PAPER_POLLER_INTERVAL=42\n")
+
+        main_module.load_env_file(str(env_file))
+
+        assert main_module.POLL_INTERVAL == 42.0
+        assert main_module.DRY_RUN is True
+        assert main_module.CHECK_ALL_VERSIONS is True
+        assert main_module.gql_base == "http://local"